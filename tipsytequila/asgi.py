@@ -13,4 +13,17 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tipsytequila.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after setup, the event stream uses the models
+from tipsytequilaapi.sse import EventStream  # pylint: disable=wrong-import-position
+
+event_stream = EventStream()
+
+
+async def application(scope, receive, send):
+    """Serve /events from the event stream and everything else from Django"""
+    if scope['type'] == 'http' and scope['path'] == '/events':
+        await event_stream(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -50,6 +51,15 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'tipsytequilaapi.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'tipsytequilaapi.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 10
 }
@@ -60,6 +70,9 @@ CORS_ORIGIN_WHITELIST = (
 )
 
 MIDDLEWARE = [
+    'tipsytequilaapi.middleware.metrics.MetricsMiddleware',
+    'tipsytequilaapi.middleware.timing.ServerTimingMiddleware',
+    'tipsytequilaapi.middleware.admission.AdmissionControlMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -72,6 +85,105 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'tipsytequila.urls'
 
+# Fraction of requests that get a Server-Timing breakdown, and the query
+# duration in milliseconds above which a query is written to the slow log
+REQUEST_TIMING_SAMPLE_RATE = float(os.environ.get('TIPSYTEQUILA_TIMING_SAMPLE_RATE', '1.0' if DEBUG else '0.05'))
+SLOW_QUERY_MS = 100
+
+# Per-process concurrency limits for expensive views, by view name as in
+# Server-Timing. Options not given here use the DEFAULTS in
+# tipsytequilaapi/middleware/admission.py.
+ADMISSION_CONTROL = {
+    'Users.list': {'max_limit': 4},
+    'Customers.list': {'max_limit': 4},
+    'OrderProducts.list': {'max_limit': 4},
+    # Password hashing is slow by design
+    'login_user': {'max_limit': 8, 'target_ms': 500},
+}
+
+# Per-process metric files summed by /metrics. Point every worker at the same
+# directory and clear it when the deployment restarts.
+METRICS_DIR = os.environ.get('TIPSYTEQUILA_METRICS_DIR', str(BASE_DIR / '.metrics'))
+
+# Who may read /metrics: staff users by token, and scrapers connecting from
+# these addresses without one (comma separated in the environment). Never
+# list a reverse proxy in front of the site, every request it forwards
+# comes from its address.
+METRICS_ALLOWED_IPS = [
+    address for address in os.environ.get('TIPSYTEQUILA_METRICS_ALLOWED_IPS', '').split(',') if address]
+
+# Most sub-requests a single POST /batch may carry
+BATCH_MAX_REQUESTS = 20
+
+# Days deleted products stay visible to /products/delta. Clients with an
+# older sync token get the full catalog again.
+PRODUCT_TOMBSTONE_DAYS = 30
+
+# Seconds /products/delta keeps its token behind the present. A product
+# save stamps updated_at before it commits, so the write that commits last
+# can carry the older stamp; tokens stay far enough back to still cover it,
+# and clients may get the last few seconds' changes twice.
+PRODUCT_DELTA_MARGIN = 10
+
+# Fan-out of the /events stream. 'local' keeps events in the process, 'socket'
+# also relays them to the other worker processes on this host through Unix
+# sockets in EVENTS_DIR.
+EVENT_BROKER = os.environ.get('TIPSYTEQUILA_EVENT_BROKER', 'local')
+EVENTS_DIR = os.environ.get('TIPSYTEQUILA_EVENTS_DIR', str(BASE_DIR / '.events'))
+SSE_HEARTBEAT_SECONDS = 15
+
+# Job queue, see tipsytequilaapi/jobs.py. A running job is handed to another
+# worker once it has been locked this long, and failed runs are retried
+# after JOB_RETRY_DELAY seconds, doubling on every attempt.
+JOB_VISIBILITY_TIMEOUT = 300
+JOB_RETRY_DELAY = 10
+
+# Longest side of stored product images, larger uploads are scaled down
+PRODUCT_IMAGE_MAX_SIZE = 1024
+
+# Most products /products/:id/recommendations returns
+RECOMMENDATIONS_TOP_K = 10
+
+# /products/facets: upper price bound of every bucket but the open-ended
+# last one, how many sellers to list, and how long counts may stay cached
+# when ratings are edited or removed
+PRODUCT_PRICE_BUCKETS = (10, 25, 50, 100, 250)
+FACETS_TOP_SELLERS = 20
+FACETS_CACHE_SECONDS = 60
+
+# GET /products?ids=: most ids per request, and most products each worker
+# process keeps cached for it
+PRODUCT_MULTIGET_MAX = 100
+PRODUCT_CACHE_SIZE = 10000
+
+# /customers/:id/sales: longest daily series a seller can ask for, and how
+# many of their best selling products to list
+SALES_MAX_DAYS = 365
+SALES_TOP_PRODUCTS = 10
+
+# Rows removed per transaction when purging a deleted product's dependents
+PRODUCT_PURGE_BATCH_SIZE = 500
+
+# Seconds a response stays replayable for its Idempotency-Key
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'tipsytequila.slow_queries': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -90,6 +202,15 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'tipsytequila.wsgi.application'
 
+# Serve the hot GET endpoints (products, order detail, ratings and reviews)
+# from native async views. Only worthwhile under ASGI; under WSGI Django
+# wraps them back into a sync call.
+ASYNC_READ_VIEWS = os.environ.get('TIPSYTEQUILA_ASYNC_READS', '0') == '1'
+
+# Serialize read endpoints with functions generated from the DRF serializers
+# (tipsytequilaapi/compiled.py) instead of the serializers themselves
+COMPILED_SERIALIZERS = os.environ.get('TIPSYTEQUILA_COMPILED_SERIALIZERS', '1') == '1'
+
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
@@ -101,6 +222,59 @@ DATABASES = {
     }
 }
 
+# 'development' keeps Django's defaults. 'production' keeps connections open
+# between requests, switches SQLite to WAL so reads don't queue behind writes
+# and retries writes that hit "database is locked".
+DATABASE_PROFILE = os.environ.get('TIPSYTEQUILA_DB_PROFILE', 'development')
+
+# PRAGMA name -> value, run on every new SQLite connection
+# (see tipsytequilaapi/db/sqlite.py)
+SQLITE_PRAGMAS = {}
+
+# Extra attempts for write handlers failing with "database is locked", and
+# the base delay in seconds for the exponential backoff between them
+DATABASE_WRITE_RETRIES = 0
+DATABASE_WRITE_RETRY_DELAY = 0.05
+
+# Group commit of rating and review writes (tipsytequilaapi/db/coalesce.py).
+# Concurrent writes share one transaction of up to WRITE_COALESCING_MAX_BATCH
+# writes, its leader waiting up to WRITE_COALESCING_MAX_WAIT_MS for them.
+WRITE_COALESCING = os.environ.get('TIPSYTEQUILA_COALESCE_WRITES', '0') == '1'
+WRITE_COALESCING_MAX_BATCH = 64
+WRITE_COALESCING_MAX_WAIT_MS = 2
+
+if DATABASE_PROFILE == 'production':
+    DATABASES['default']['CONN_MAX_AGE'] = 600
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 268435456,
+        'cache_size': -65536,
+        'busy_timeout': 5000,
+        'temp_store': 'MEMORY',
+    }
+    DATABASE_WRITE_RETRIES = 5
+
+# Number of local read replicas. Each one is a SQLite file refreshed from the
+# primary by `manage.py replicate`; safe requests read from them unless the
+# client wrote within the last READ_REPLICA_PIN_SECONDS.
+READ_REPLICA_COUNT = int(os.environ.get('TIPSYTEQUILA_READ_REPLICAS', '0'))
+READ_REPLICA_PIN_SECONDS = 5
+DATABASE_READ_REPLICAS = []
+
+for replica in range(1, READ_REPLICA_COUNT + 1):
+    alias = f'replica{replica}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'NAME': BASE_DIR / f'db.{alias}.sqlite3',
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_READ_REPLICAS.append(alias)
+
+if DATABASE_READ_REPLICAS:
+    DATABASE_ROUTERS = ['tipsytequilaapi.db.router.PrimaryReplicaRouter']
+    MIDDLEWARE.insert(4, 'tipsytequilaapi.middleware.replica.ReplicaStickinessMiddleware')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -6,6 +6,7 @@ from rest_framework import routers
 from rest_framework.authtoken.views import obtain_auth_token
 from tipsytequilaapi.models import *
 from tipsytequilaapi.views import *
+from tipsytequilaapi.views import async_read
 
 # pylint: disable=invalid-name
 router = routers.DefaultRouter(trailing_slash=False)
@@ -16,6 +17,7 @@ router.register(r'orders', Orders, 'order')
 router.register(r'ratings', Ratings, 'rating')
 router.register(r'reviews', Reviews, 'review')
 router.register(r'orderproducts', OrderProducts, 'orderproduct')
+router.register(r'changes', Changes, 'change')
 
 
 
@@ -25,6 +27,19 @@ urlpatterns = [
     url(r'^', include(router.urls)),
     url(r'^register$', register_user),
     url(r'^login$', login_user),
+    url(r'^metrics$', metrics),
+    url(r'^batch$', batch),
     url(r'^api-token-auth$', obtain_auth_token),
     url(r'^api-auth', include('rest_framework.urls', namespace='rest_framework')),
-]
\ No newline at end of file
+]
+
+# The async read views shadow the router's GET routes, so they go first.
+# Product details only match numeric ids so /products/delta reaches the router.
+if settings.ASYNC_READ_VIEWS:
+    urlpatterns = [
+        url(r'^products$', async_read.products_list_view),
+        url(r'^products/(?P<pk>\d+)$', async_read.products_detail_view),
+        url(r'^orders/(?P<pk>[^/.]+)$', async_read.orders_detail_view),
+        url(r'^ratings$', async_read.ratings_list_view),
+        url(r'^reviews$', async_read.reviews_list_view),
+    ] + urlpatterns
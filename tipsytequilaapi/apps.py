@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class TipsytequilaapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tipsytequilaapi'
+
+    def ready(self):
+        # Connect the connection_created receiver for the SQLite pragmas
+        from .db import sqlite  # pylint: disable=unused-import,import-outside-toplevel
+        # Register the background tasks with the job queue
+        from . import tasks  # pylint: disable=unused-import,import-outside-toplevel
@@ -0,0 +1,230 @@
+"""Replay recorded traffic against the app and summarize latency
+
+Traffic files are JSON lines, one scenario per line:
+
+    {"scenario": "add_to_cart", "weight": 12, "requests": [
+        {"method": "GET", "path": "/products/{product}"},
+        {"method": "POST", "path": "/orderproducts", "body": {"productId": "{product}"}},
+        {"method": "GET", "path": "/orders/{cart}"}]}
+
+Each virtual user repeatedly picks a scenario by weight and runs its
+requests in order through the Django test client, so no server or network
+sits between the benchmark and the views. Placeholders in paths and bodies
+are filled per scenario run: {product} is a random product id, {cart} the
+user's open order, {today} the current date, and anything listed under a
+request's "capture" is read from its JSON response for later requests.
+"""
+import contextlib
+import datetime
+import json
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test import Client
+from rest_framework.authtoken.models import Token
+from tipsytequilaapi.db.replica import snapshot
+from tipsytequilaapi.models import Customer, Order, Product
+
+
+@contextlib.contextmanager
+def throwaway_database(source):
+    """Point every database alias, replicas included, at a copy of source
+
+    The copy is removed on exit. The original settings are not restored,
+    so this is for management commands that exit afterwards.
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        target = os.path.join(workdir, 'bench.sqlite3')
+        snapshot(source, target)
+
+        connections.close_all()
+        for alias in connections:
+            connections[alias].settings_dict['NAME'] = target
+        settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
+        try:
+            yield target
+        finally:
+            connections.close_all()
+
+
+def load_traffic(path):
+    """Scenarios from a traffic file, skipping blank lines"""
+    with open(path, 'r') as traffic_file:
+        return [json.loads(line) for line in traffic_file if line.strip()]
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(samples, elapsed):
+    """Throughput and latency percentiles in milliseconds for each endpoint
+
+    Arguments:
+        samples -- {endpoint: [(seconds, queries, status), ...]}
+        elapsed -- wall clock seconds of the run
+    """
+    endpoints = {}
+    for endpoint, results in sorted(samples.items()):
+        latencies = sorted(result[0] * 1000 for result in results)
+        endpoints[endpoint] = {
+            'requests': len(results),
+            'errors': sum(1 for result in results if result[2] >= 400),
+            'throughput': len(results) / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(latencies, .50),
+            'p95_ms': percentile(latencies, .95),
+            'p99_ms': percentile(latencies, .99),
+            'queries_per_request': sum(result[1] for result in results) / len(results),
+        }
+
+    total = sum(endpoint['requests'] for endpoint in endpoints.values())
+    return {
+        'elapsed_s': elapsed,
+        'requests': total,
+        'throughput': total / elapsed if elapsed else 0.0,
+        'endpoints': endpoints,
+    }
+
+
+def create_virtual_users(count, prefix='bench'):
+    """Users with a customer profile, token and open cart for the replay
+
+    Returns a list of (token key, open order id).
+    """
+    users = []
+    for index in range(count):
+        user, _ = User.objects.get_or_create(
+            username=f'{prefix}{index}',
+            defaults={'first_name': 'Bench', 'last_name': str(index)})
+        if not user.has_usable_password():
+            user.set_unusable_password()
+            user.save()
+        customer, _ = Customer.objects.get_or_create(
+            user=user, defaults={'phone_number': '555-0100', 'address': 'Bench St'})
+        token, _ = Token.objects.get_or_create(user=user)
+        cart = Order.objects.filter(customer=customer, purchased=False).first()
+        if cart is None:
+            cart = Order.objects.create(
+                customer=customer, purchased=False, created_date=datetime.date.today())
+        users.append((token.key, cart.id))
+    return users
+
+
+def product_ids():
+    """Ids the {product} placeholder is drawn from"""
+    return list(Product.objects.values_list('id', flat=True))
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+def _fill(value, variables):
+    """Substitute {placeholders} in a request path or body"""
+    if isinstance(value, str):
+        return value.format_map(variables)
+    if isinstance(value, dict):
+        return {key: _fill(item, variables) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_fill(item, variables) for item in value]
+    return value
+
+
+class Replayer:
+    """Drive a weighted scenario mix from several threads"""
+
+    def __init__(self, scenarios, users, product_ids, seed=0):
+        self.scenarios = scenarios
+        self.weights = [scenario.get('weight', 1) for scenario in scenarios]
+        self.users = users
+        self.product_ids = product_ids
+        self.seed = seed
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def _worker(self, index, deadline, iterations):
+        rng = random.Random(self.seed + index)
+        token, cart = self.users[index % len(self.users)]
+        client = Client(raise_request_exception=False, HTTP_AUTHORIZATION=f'Token {token}')
+        counter = _QueryCounter()
+        samples = {}
+
+        with connection.execute_wrapper(counter):
+            runs = 0
+            while time.monotonic() < deadline and (iterations is None or runs < iterations):
+                runs += 1
+                scenario = rng.choices(self.scenarios, weights=self.weights)[0]
+                variables = {
+                    'product': rng.choice(self.product_ids),
+                    'cart': cart,
+                    'today': datetime.date.today().isoformat(),
+                }
+                for step in scenario['requests']:
+                    method = step['method'].upper()
+                    body = _fill(step.get('body'), variables)
+                    path = _fill(step['path'], variables)
+
+                    counter.queries = 0
+                    start = time.perf_counter()
+                    response = client.generic(
+                        method, path,
+                        json.dumps(body) if body is not None else '',
+                        content_type='application/json')
+                    elapsed = time.perf_counter() - start
+
+                    endpoint = f'{method} {step["path"]}'
+                    samples.setdefault(endpoint, []).append(
+                        (elapsed, counter.queries, response.status_code))
+
+                    for name, field in step.get('capture', {}).items():
+                        if response.status_code < 400:
+                            variables[name] = response.json()[field]
+                    if 'cart' in step.get('capture', {}):
+                        cart = variables['cart']
+
+        connection.close()
+        with self._lock:
+            for endpoint, results in samples.items():
+                self.samples.setdefault(endpoint, []).extend(results)
+
+    def run(self, concurrency, duration=None, iterations=None):
+        """Replay until duration seconds pass or each user ran iterations scenarios"""
+        deadline = time.monotonic() + duration if duration else float('inf')
+        threads = [
+            threading.Thread(target=self._worker, args=(index, deadline, iterations))
+            for index in range(concurrency)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return summarize(self.samples, time.perf_counter() - start)
+
+
+def compare(current, baseline):
+    """Per-endpoint change in throughput and latency against a saved run"""
+    rows = []
+    for endpoint, stats in current['endpoints'].items():
+        before = baseline['endpoints'].get(endpoint)
+        if before is None:
+            continue
+        rows.append((endpoint, {
+            key: (stats[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+            for key in ('throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request')
+        }))
+    return rows
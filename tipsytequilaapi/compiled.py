@@ -0,0 +1,319 @@
+"""Compiled serializers for the read paths
+
+DRF serializes a queryset by loading model instances, then walking every
+serializer field of every row: get_attribute(), a SkipField check, the
+field's to_representation() and an OrderedDict insert, plus a full
+reverse() and build_absolute_uri() for each hyperlink. On list endpoints
+that is most of the request's CPU time.
+
+compile_serializer() walks a serializer's field tree once and generates a
+plain function that builds the same dict straight from a values_list()
+row, with the columns of nested foreign keys joined into that row. Plain
+columns go through int/str/float/bool or the DRF field's own
+to_representation(). Hyperlinks are the URL reversed once per view name
+and host, with the row's id spliced in. Nested lists and many-to-many
+fields take one more query each, like the prefetch_related() they
+replace.
+
+Anything the compiler doesn't understand, such as method fields, dotted
+sources or properties, raises NotCompilable, and serialize() falls back
+to the serializer itself. The output renders to the same bytes as DRF's.
+"""
+from types import SimpleNamespace
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db import models
+from django.urls import NoReverseMatch
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+from tipsytequilaapi.middleware.timing import timed_serialize
+
+MAX_CACHED_LINKS = 256
+
+# Spliced out of a reversed URL to leave its prefix and suffix
+_PLACEHOLDER = '918273645546372819'
+
+_compiled = {}
+_links = {}
+
+
+class NotCompilable(Exception):
+    """The serializer uses something only DRF itself can serialize"""
+
+
+def _link_factory(request, field):
+    """Turn ids into the URLs field would build for them on this request"""
+    key = (field.view_name, field.lookup_field, field.lookup_url_kwarg, request.scheme, request.get_host())
+    parts = _links.get(key)
+    if parts is None:
+        placeholder = SimpleNamespace(**{'pk': _PLACEHOLDER, field.lookup_field: _PLACEHOLDER})
+        try:
+            url = field.get_url(placeholder, field.view_name, request, None)
+        except NoReverseMatch:
+            raise ImproperlyConfigured(
+                f'Could not resolve URL for hyperlinked relationship using view name "{field.view_name}".'
+            ) from None
+        parts = url.split(_PLACEHOLDER)
+        if len(parts) != 2:
+            raise ImproperlyConfigured(f'Could not find the id in the URL of "{field.view_name}": {url}')
+        if len(_links) >= MAX_CACHED_LINKS:
+            _links.clear()
+        _links[key] = parts
+
+    prefix, suffix = parts
+    return lambda pk: f'{prefix}{pk}{suffix}'
+
+
+def _file_factory(request, file_field):
+    """Turn stored file names into what a DRF FileField returns for them"""
+    use_url, storage = file_field
+    if not use_url:
+        return lambda name: name or None
+    if request is None:
+        return lambda name: storage.url(name) if name else None
+    return lambda name: request.build_absolute_uri(storage.url(name)) if name else None
+
+
+def _converter(field):
+    """The cheapest callable with the output of field.to_representation"""
+    representation = type(field).to_representation
+    for drf_field, builtin in ((serializers.IntegerField, int), (serializers.CharField, str),
+                               (serializers.FloatField, float), (serializers.BooleanField, bool)):
+        if representation is drf_field.to_representation:
+            return builtin
+    return field.to_representation
+
+
+class _Plan:
+    """The columns of one query and the function that serializes its rows
+
+    leading columns come first in every row and are not serialized, e.g.
+    the parent id a nested list is grouped by.
+    """
+
+    def __init__(self, model, leading=()):
+        self.model = model
+        self.columns = list(leading)
+        self.namespace = {}
+        self.per_request = []
+        self.children = []
+        self.bind = None
+
+    def column(self, lookup):
+        """Source of the row item holding a values_list() lookup"""
+        if lookup not in self.columns:
+            self.columns.append(lookup)
+        return f'row[{self.columns.index(lookup)}]'
+
+    def constant(self, value):
+        name = f'_c{len(self.namespace)}'
+        self.namespace[name] = value
+        return name
+
+    def request_bound(self, factory, argument):
+        """Name of factory(request, argument), made once per serialization"""
+        name = f'_r{len(self.per_request)}'
+        self.per_request.append((name, self.constant(factory), self.constant(argument)))
+        return name
+
+    def child(self, key_column, relation):
+        """Name of the {parent key: [items]} dict of a nested list"""
+        self.children.append((key_column, relation))
+        return f'_m{len(self.children) - 1}'
+
+    def finish(self, expression):
+        lines = ['def bind(request, many):']
+        lines += [f'    {name} = {factory}(request, {argument})' for name, factory, argument in self.per_request]
+        lines += [f'    _m{index} = many[{index}]' for index in range(len(self.children))]
+        lines += ['    def serialize(row):', f'        return {expression}', '    return serialize']
+        exec('\n'.join(lines), self.namespace)  # pylint: disable=exec-used
+        self.bind = self.namespace['bind']
+
+    def serialize(self, rows, request):
+        if not rows:
+            return []
+        many = []
+        for key_column, relation in self.children:
+            index = self.columns.index(key_column)
+            many.append(relation.group({row[index] for row in rows} - {None}, request))
+        serialize = self.bind(request, many)
+        return [serialize(row) for row in rows]
+
+
+class _Many:
+    """A nested list, read with one query for all the parent rows"""
+
+    def __init__(self, model, back, plan):
+        self.model = model
+        self.back = back
+        self.plan = plan
+
+    def group(self, keys, request):
+        if not keys:
+            return {}
+        rows = list(
+            self.model._default_manager.filter(**{f'{self.back}__in': keys}).values_list(*self.plan.columns))
+        grouped = {}
+        for row, item in zip(rows, self.plan.serialize(rows, request)):
+            grouped.setdefault(row[0], []).append(item)
+        return grouped
+
+
+def _guard(column, expression, nullable):
+    return f'(None if {column} is None else {expression})' if nullable else expression
+
+
+def _object(plan, serializer, prefix, model):
+    """Source of the dict serializer makes of the model row under prefix"""
+    if type(serializer).to_representation is not serializers.Serializer.to_representation:
+        raise NotCompilable(f'{type(serializer).__name__} overrides to_representation()')
+    items = [
+        f'{field.field_name!r}: {_value(plan, field, prefix, model)}'
+        for field in serializer.fields.values() if not field.write_only
+    ]
+    return '{' + ', '.join(items) + '}'
+
+
+def _related(plan, field, model, pk_column, prefix):
+    """Source of a relation field's output for the model row under prefix"""
+    if isinstance(field, serializers.HyperlinkedRelatedField):
+        if field.lookup_field == 'pk':
+            lookup_column, lookup_field = pk_column, model._meta.pk
+        else:
+            lookup_column = plan.column(prefix + field.lookup_field)
+            lookup_field = model._meta.get_field(field.lookup_field)
+        if not isinstance(lookup_field, models.IntegerField):
+            raise NotCompilable(f'{field.view_name} URLs are not looked up by an integer')
+        return f'{plan.request_bound(_link_factory, field)}({lookup_column})'
+    if type(field) is serializers.PrimaryKeyRelatedField and field.pk_field is None:
+        return pk_column
+    raise NotCompilable(f'{type(field).__name__} is not supported')
+
+
+def _many(plan, field, prefix, model_field):
+    """Source of a nested list or many-to-many field"""
+    if model_field.one_to_many or (model_field.many_to_many and not model_field.concrete):
+        back = model_field.field.name
+    elif model_field.many_to_many:
+        back = model_field.related_query_name()
+    else:
+        raise NotCompilable(f'{model_field.name} is not a to-many relation')
+
+    model = model_field.related_model
+    child = _Plan(model, leading=(back,))
+    if isinstance(field, serializers.ListSerializer):
+        if type(field).to_representation is not serializers.ListSerializer.to_representation:
+            raise NotCompilable(f'{type(field).__name__} overrides to_representation()')
+        child.finish(_object(child, field.child, '', model))
+    else:
+        child.finish(_related(child, field.child_relation, model, child.column('pk'), ''))
+
+    key_column = prefix + 'pk'
+    key = plan.column(key_column)
+    return f'({plan.child(key_column, _Many(model, back, child))}.get({key}) or [])'
+
+
+def _value(plan, field, prefix, model):
+    """Source of one field's output for the model row under prefix"""
+    if field.source == '*':
+        if isinstance(field, serializers.HyperlinkedRelatedField):
+            return _related(plan, field, model, plan.column(prefix + 'pk'), prefix)
+        raise NotCompilable(f'{field.field_name} serializes the whole object')
+    if len(field.source_attrs) != 1:
+        raise NotCompilable(f'{field.field_name} has a dotted source')
+    try:
+        model_field = model._meta.get_field(field.source)
+    except FieldDoesNotExist:
+        raise NotCompilable(f'{model.__name__}.{field.source} is not a model field') from None
+    path = prefix + field.source
+
+    if isinstance(field, (serializers.ListSerializer, serializers.ManyRelatedField)):
+        return _many(plan, field, prefix, model_field)
+    forward = model_field.concrete and (model_field.many_to_one or model_field.one_to_one)
+    if model_field.is_relation and not forward:
+        raise NotCompilable(f'{model.__name__}.{field.source} is not a foreign key')
+
+    column = plan.column(path)
+    if isinstance(field, serializers.BaseSerializer):
+        related = model_field.related_model
+        return _guard(column, _object(plan, field, path + '__', related), model_field.null)
+    if isinstance(field, serializers.RelatedField):
+        related = model_field.related_model
+        return _guard(column, _related(plan, field, related, column, path + '__'), model_field.null)
+    if model_field.is_relation:
+        raise NotCompilable(f'{field.field_name} is not a relation field')
+    if isinstance(field, serializers.FileField):
+        # FieldFile is never None, DRF checks its name instead
+        use_url = getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL)
+        return f'{plan.request_bound(_file_factory, (use_url, model_field.storage))}({column})'
+    return _guard(column, f'{plan.constant(_converter(field))}({column})', model_field.null)
+
+
+class CompiledSerializer:
+    """serializer_class's output, built from values_list() rows"""
+
+    def __init__(self, serializer_class):
+        model = serializer_class.Meta.model
+        self.plan = _Plan(model)
+        self.plan.finish(_object(self.plan, serializer_class(), '', model))
+
+    @property
+    def columns(self):
+        """The values_list() lookups of a row, in order"""
+        return tuple(self.plan.columns)
+
+    def rows(self, queryset):
+        """The values_list() of queryset the serializer reads"""
+        # Compiled nested lists replace prefetches, and values() can't use them
+        return queryset.prefetch_related(None).values_list(*self.columns)
+
+    def serialize(self, rows, request):
+        """Serialize rows from rows()"""
+        # Timed like Serializer.data, which includes reading the queryset
+        with timed_serialize():
+            return self.plan.serialize(list(rows), request)
+
+
+def compile_serializer(serializer_class):
+    """The CompiledSerializer of serializer_class, built on first use
+
+    Raises NotCompilable for serializers it can't reproduce.
+    """
+    compiled = _compiled.get(serializer_class)
+    if compiled is None:
+        try:
+            compiled = CompiledSerializer(serializer_class)
+        except NotCompilable as ex:
+            compiled = ex
+        _compiled[serializer_class] = compiled
+    if isinstance(compiled, NotCompilable):
+        raise compiled
+    return compiled
+
+
+def _compiled_or_none(serializer_class):
+    if not settings.COMPILED_SERIALIZERS:
+        return None
+    try:
+        return compile_serializer(serializer_class)
+    except NotCompilable:
+        return None
+
+
+def serialize(serializer_class, queryset, request):
+    """serializer_class(queryset, many=True, context={'request': request}).data"""
+    compiled = _compiled_or_none(serializer_class)
+    if compiled is None:
+        return serializer_class(queryset, many=True, context={'request': request}).data
+    return compiled.serialize(compiled.rows(queryset), request)
+
+
+def serialize_one(serializer_class, queryset, request, **lookup):
+    """serializer_class(queryset.get(**lookup), context={'request': request}).data
+
+    Raises DoesNotExist and MultipleObjectsReturned like get().
+    """
+    compiled = _compiled_or_none(serializer_class)
+    if compiled is None:
+        return serializer_class(queryset.get(**lookup), context={'request': request}).data
+    return compiled.serialize([compiled.rows(queryset).get(**lookup)], request)[0]
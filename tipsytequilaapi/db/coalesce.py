@@ -0,0 +1,133 @@
+"""Group commit for small, independent writes
+
+Every write transaction on SQLite takes the database's single write lock
+and ends in a sync to disk. A burst of one-row writes, like the reviews
+that follow a promotion, spends most of its time queueing for that lock
+and waiting for those syncs, and the requests at the back of the queue
+hit "database is locked".
+
+The coalescer lets concurrent request threads share one transaction. The
+first thread to submit a write becomes the leader: it waits up to
+WRITE_COALESCING_MAX_WAIT_MS for more writes, then runs the whole batch
+in one retry_on_locked transaction, each write in its own savepoint so a
+failing one doesn't take the others down with it. Writes submitted while
+a batch commits queue up for the next leader. Results and exceptions are
+handed back to the submitting threads.
+
+Writes run on the leader's thread and connection, so they must only touch
+the database through the ORM and must not depend on thread-local state.
+"""
+import threading
+import time
+from django.conf import settings
+from django.db import OperationalError, transaction
+from .sqlite import is_locked_error, retry_on_locked
+
+
+class _Write:
+    __slots__ = ('func', 'result', 'error', 'finished')
+
+    def __init__(self, func):
+        self.func = func
+        self.result = None
+        self.error = None
+        self.finished = False
+
+
+class WriteCoalescer:
+    """Batch writes from concurrent threads into shared transactions"""
+
+    def __init__(self, max_batch, max_wait):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = []
+        self._leader = None
+        self._condition = threading.Condition()
+
+    def submit(self, func):
+        """Run func in a group transaction and return its result
+
+        Inside an atomic block func runs right away in that transaction,
+        which already holds the write lock.
+        """
+        if transaction.get_connection().in_atomic_block:
+            return func()
+
+        write = _Write(func)
+        with self._condition:
+            self._queue.append(write)
+            if self._leader is None:
+                self._leader = write
+            self._condition.notify_all()
+            while not write.finished and self._leader is not write:
+                self._condition.wait()
+
+        if not write.finished:
+            self._lead()
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def _lead(self):
+        deadline = time.monotonic() + self.max_wait
+        with self._condition:
+            while len(self._queue) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = self._queue[:self.max_batch]
+            del self._queue[:self.max_batch]
+
+        try:
+            self._commit(batch)
+        except Exception as ex:  # pylint: disable=broad-except
+            for write in batch:
+                write.result, write.error = None, ex
+
+        with self._condition:
+            for write in batch:
+                write.finished = True
+            # The oldest queued write leads the next batch
+            self._leader = self._queue[0] if self._queue else None
+            self._condition.notify_all()
+
+    @staticmethod
+    @retry_on_locked
+    def _commit(batch):
+        for write in batch:
+            write.result, write.error = None, None
+            try:
+                with transaction.atomic():
+                    write.result = write.func()
+            except OperationalError as ex:
+                if is_locked_error(ex):
+                    # Retry the whole batch rather than fail one write
+                    raise
+                write.error = ex
+            except Exception as ex:  # pylint: disable=broad-except
+                write.error = ex
+
+
+_coalescer = None
+_coalescer_lock = threading.Lock()
+
+
+def get_coalescer():
+    """The process-wide coalescer"""
+    global _coalescer  # pylint: disable=global-statement
+    if _coalescer is None:
+        with _coalescer_lock:
+            if _coalescer is None:
+                _coalescer = WriteCoalescer(
+                    settings.WRITE_COALESCING_MAX_BATCH, settings.WRITE_COALESCING_MAX_WAIT_MS / 1000)
+    return _coalescer
+
+
+def write(func):
+    """Run func in one write transaction, shared with concurrent writes
+    when settings.WRITE_COALESCING is on, and return its result
+    """
+    if settings.WRITE_COALESCING:
+        return get_coalescer().submit(func)
+    return retry_on_locked(func)()
@@ -0,0 +1,32 @@
+"""Local replication stand-in built on SQLite's online backup API
+
+Each call copies a consistent snapshot of the primary database file into
+every replica file in place, so connections already open on a replica see
+the new data on their next transaction.
+"""
+import sqlite3
+from django.conf import settings
+from .router import PRIMARY
+
+
+def snapshot(source_path, target_path, pages=-1):
+    """Copy source_path into target_path with the backup API"""
+    source = sqlite3.connect(str(source_path))
+    target = sqlite3.connect(str(target_path))
+    try:
+        source.backup(target, pages=pages)
+    finally:
+        target.close()
+        source.close()
+
+
+def replicate():
+    """Refresh every configured read replica from the primary
+
+    Returns the aliases that were refreshed.
+    """
+    primary = settings.DATABASES[PRIMARY]['NAME']
+    replicas = getattr(settings, 'DATABASE_READ_REPLICAS', [])
+    for alias in replicas:
+        snapshot(primary, settings.DATABASES[alias]['NAME'])
+    return replicas
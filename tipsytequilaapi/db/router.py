@@ -0,0 +1,61 @@
+"""Primary/replica database router
+
+Reads go to one of settings.DATABASE_READ_REPLICAS only while the current
+request has been marked read-only by ReplicaStickinessMiddleware. Anything
+else (writes, management commands, the shell) talks to the primary. As soon
+as a write is routed the rest of the request is pinned to the primary, so a
+view always reads back what it just wrote.
+"""
+import contextvars
+import random
+from django.conf import settings
+
+PRIMARY = 'default'
+
+# Auth lookups happen on every request and a freshly registered token must
+# be visible immediately, so these apps never read from a lagging replica.
+PRIMARY_ONLY_APPS = {'auth', 'authtoken', 'sessions', 'contenttypes'}
+
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+_wrote = contextvars.ContextVar('wrote', default=False)
+
+
+def use_replicas(enabled=True):
+    """Allow reads in the current context to go to a replica
+
+    Returns tokens for reset_replicas().
+    """
+    return _replica_reads.set(enabled), _wrote.set(False)
+
+
+def reset_replicas(tokens):
+    """Undo use_replicas() and report whether a write happened meanwhile"""
+    wrote = _wrote.get()
+    replica_token, wrote_token = tokens
+    _replica_reads.reset(replica_token)
+    _wrote.reset(wrote_token)
+    return wrote
+
+
+class PrimaryReplicaRouter:
+    """Send reads to the replicas when allowed, everything else to primary"""
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'DATABASE_READ_REPLICAS', [])
+        if not replicas or not _replica_reads.get() or _wrote.get():
+            return PRIMARY
+        if model._meta.app_label in PRIMARY_ONLY_APPS:
+            return PRIMARY
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        _wrote.set(True)
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas are copies of the primary, so objects are interchangeable
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema through snapshots, never through migrate
+        return db == PRIMARY
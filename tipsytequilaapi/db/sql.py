@@ -0,0 +1,7 @@
+"""Helpers for the raw SQL of the bulk rollups and loaders"""
+from django.db import connection
+
+
+def table(model):
+    """The quoted table name of a model, to put in raw SQL"""
+    return connection.ops.quote_name(model._meta.db_table)
@@ -0,0 +1,82 @@
+"""SQLite connection tuning and lock handling
+
+The pragmas in settings.SQLITE_PRAGMAS are applied to every new SQLite
+connection. With the production profile that switches the database to WAL
+so readers no longer block behind the add-to-cart writes, and together
+with CONN_MAX_AGE the cost is paid once per persistent connection rather
+than once per request.
+"""
+import contextvars
+import functools
+import random
+import time
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# Set while retry_on_locked runs a handler, so its transaction starts with
+# BEGIN IMMEDIATE
+_write_transaction = contextvars.ContextVar('write_transaction', default=False)
+
+
+def _begin(connection):
+    """Start a transaction, taking the write lock up front for write handlers
+
+    A deferred BEGIN that reads before it writes has to upgrade its lock
+    mid-transaction. When another writer holds the lock SQLite fails that
+    upgrade at once instead of waiting out busy_timeout.
+    """
+    connection.cursor().execute('BEGIN IMMEDIATE' if _write_transaction.get() else 'BEGIN')
+
+
+@receiver(connection_created)
+def apply_pragmas(sender, connection, **kwargs):
+    """Run the configured PRAGMA statements on a freshly opened connection"""
+    if connection.vendor != 'sqlite':
+        return
+
+    connection._start_transaction_under_autocommit = functools.partial(_begin, connection)
+
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def is_locked_error(ex):
+    """True for SQLite's transient busy/locked errors"""
+    message = str(ex).lower()
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+def retry_on_locked(func):
+    """Retry a write handler with jittered exponential backoff on lock errors
+
+    Each attempt runs in its own transaction, so a handler that performs
+    several inserts is either fully applied or safely re-run. Nested calls
+    (already inside an atomic block) are not retried, the outermost caller
+    owns the retry.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        attempts = getattr(settings, 'DATABASE_WRITE_RETRIES', 0)
+        delay = getattr(settings, 'DATABASE_WRITE_RETRY_DELAY', 0.05)
+
+        if transaction.get_connection().in_atomic_block:
+            return func(*args, **kwargs)
+
+        token = _write_transaction.set(True)
+        try:
+            for attempt in range(attempts + 1):
+                try:
+                    with transaction.atomic():
+                        return func(*args, **kwargs)
+                except OperationalError as ex:
+                    if attempt == attempts or not is_locked_error(ex):
+                        raise
+                    time.sleep(delay * (2 ** attempt) * random.uniform(0.5, 1.5))
+        finally:
+            _write_transaction.reset(token)
+
+    return wrapper
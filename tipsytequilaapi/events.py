@@ -0,0 +1,198 @@
+"""In-process pub/sub for the server-sent event stream
+
+Views publish events to topics once their transaction commits, and every
+open /events connection holds one Subscription whose asyncio queue receives
+the events of the topics it follows. Publishing is thread-safe, so the sync
+views can publish from their worker threads into the event loop.
+
+Topics:
+    customer:<id> -- cart changes of the customer's open order
+    product:<id>  -- stock level changes of a product
+
+With TIPSYTEQUILA_EVENT_BROKER=socket, events are also relayed to the other
+worker processes on this host through Unix datagram sockets in
+settings.EVENTS_DIR, one per process. It is a stand-in for a real broker for
+pre-forked deployments, with the same best-effort delivery.
+"""
+import asyncio
+import glob
+import json
+import logging
+import os
+import socket
+import threading
+from django.conf import settings
+from django.db import transaction
+
+# Events a slow client may fall behind by before it is disconnected
+QUEUE_SIZE = 100
+
+logger = logging.getLogger('tipsytequila.events')
+
+
+class Subscription:
+    """The queue of events for one connection and the topics it follows"""
+
+    def __init__(self, broker, loop):
+        self.broker = broker
+        self.loop = loop
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        self.topics = set()
+        self.overflowed = False
+
+    def follow(self, topic):
+        self.broker.add(self, topic)
+
+    def unfollow(self, topic):
+        self.broker.remove(self, topic)
+
+    def close(self):
+        for topic in list(self.topics):
+            self.broker.remove(self, topic)
+
+    def deliver(self, topic, event):
+        """Queue an event from any thread"""
+        self.loop.call_soon_threadsafe(self._put, topic, event)
+
+    def _put(self, topic, event):
+        try:
+            self.queue.put_nowait((topic, event))
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class Broker:
+    """Fans events out to the subscriptions of this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._topics = {}
+
+    def subscribe(self, topics=()):
+        subscription = Subscription(self, asyncio.get_running_loop())
+        for topic in topics:
+            self.add(subscription, topic)
+        return subscription
+
+    def add(self, subscription, topic):
+        with self._lock:
+            self._topics.setdefault(topic, set()).add(subscription)
+            subscription.topics.add(topic)
+
+    def remove(self, subscription, topic):
+        with self._lock:
+            subscribers = self._topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._topics[topic]
+            subscription.topics.discard(topic)
+
+    def deliver(self, topic, event):
+        with self._lock:
+            subscribers = list(self._topics.get(topic, ()))
+        for subscription in subscribers:
+            subscription.deliver(topic, event)
+
+    def publish(self, topic, event):
+        self.deliver(topic, event)
+
+
+class SocketBroker(Broker):
+    """Broker that also relays events to the other processes on this host"""
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        self._receiver_pid = None
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f'events_{pid}.sock')
+
+    def _ensure_receiver(self):
+        """Bind this process's socket, again after a fork"""
+        pid = os.getpid()
+        if self._receiver_pid == pid:
+            return
+        with self._lock:
+            if self._receiver_pid == pid:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(pid)
+            if os.path.exists(path):
+                os.unlink(path)
+            receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            receiver.bind(path)
+            threading.Thread(target=self._receive, args=(receiver,), daemon=True).start()
+            self._receiver_pid = pid
+
+    def _receive(self, receiver):
+        while True:
+            message = receiver.recv(65536)
+            # One bad message must not end the thread, and with it all relaying
+            try:
+                topic, event = json.loads(message)
+                self.deliver(topic, event)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Dropped a relayed event: %.200r', message)
+
+    def subscribe(self, topics=()):
+        self._ensure_receiver()
+        return super().subscribe(topics)
+
+    def publish(self, topic, event):
+        self.deliver(topic, event)
+        message = json.dumps([topic, event]).encode()
+        own = self._path(os.getpid())
+        for path in glob.glob(self._path('*')):
+            if path == own:
+                continue
+            try:
+                self._sender.sendto(message, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Socket of a process that exited
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            except BlockingIOError:
+                pass
+            except OSError:
+                # Runs after the write committed, so the request must not fail,
+                # e.g. on EMSGSIZE the same message fits no other socket either
+                logger.exception('Could not relay an event on %s', topic)
+                break
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker  # pylint: disable=global-statement
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                if settings.EVENT_BROKER == 'socket':
+                    _broker = SocketBroker(settings.EVENTS_DIR)
+                else:
+                    _broker = Broker()
+    return _broker
+
+
+def publish(topic, event):
+    """Publish an event once the current transaction commits"""
+    transaction.on_commit(lambda: get_broker().publish(topic, event))
+
+
+def publish_cart(customer_id, order_id, product_id, operation):
+    """Publish a line item added to or removed from a customer's cart"""
+    publish(f'customer:{customer_id}', {
+        'type': 'cart', 'order': order_id, 'product': product_id, 'operation': operation,
+    })
+
+
+def publish_stock(product_id, quantity):
+    """Publish a product's new stock level"""
+    publish(f'product:{product_id}', {'type': 'stock', 'product': product_id, 'quantity': quantity})
@@ -0,0 +1,151 @@
+"""Filter sidebar counts for the product catalog
+
+facet_counts() groups the filtered catalog once by every facet at the same
+time, price bucket x in stock x seller x rating band, and folds that cube
+into the four facets in Python, rather than running one query per facet.
+
+Results are cached per process and filter set, under a catalog version
+made of the newest product updated_at and the newest product rating id.
+Product writes, soft deletes included, move updated_at, and new ratings
+move the rating id, so both are seen on the next request from any worker.
+Rating edits and deletions only show after FACETS_CACHE_SECONDS.
+"""
+import threading
+import time
+from django.conf import settings
+from django.db import connection
+from django.db.models import (Avg, BooleanField, Case, ExpressionWrapper, IntegerField, Max,
+                              OuterRef, Q, Subquery, Value, When)
+from tipsytequilaapi import metrics
+from tipsytequilaapi.models import Customer, Product, ProductRating
+
+RATING_BANDS = 5
+MAX_CACHED = 256
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def filter_products(products, params):
+    """Apply the catalog filters in query params to a product queryset
+
+    min_price, max_price -- price range, inclusive
+    in_stock -- true or false
+    seller -- customer id of the seller
+
+    Raises ValueError with a message for malformed values.
+    """
+    try:
+        if params.get('min_price'):
+            products = products.filter(price__gte=float(params['min_price']))
+        if params.get('max_price'):
+            products = products.filter(price__lte=float(params['max_price']))
+        if params.get('seller'):
+            products = products.filter(customer_id=int(params['seller']))
+    except ValueError:
+        raise ValueError('min_price, max_price and seller must be numbers.') from None
+
+    in_stock = params.get('in_stock')
+    if in_stock:
+        if in_stock not in ('true', 'false'):
+            raise ValueError('in_stock must be true or false.')
+        products = products.filter(quantity__gt=0) if in_stock == 'true' else products.filter(quantity=0)
+    return products
+
+
+def _cube(products):
+    """Product counts by (price bucket, in stock, seller, rating band)"""
+    edges = settings.PRODUCT_PRICE_BUCKETS
+    average = (
+        ProductRating.objects.filter(product=OuterRef('pk'))
+        .values('product').annotate(average=Avg('rating__score')).values('average')
+    )
+    per_product = (
+        products
+        .annotate(
+            price_bucket=Case(
+                *[When(price__lt=edge, then=Value(index)) for index, edge in enumerate(edges)],
+                default=Value(len(edges)), output_field=IntegerField()),
+            in_stock=ExpressionWrapper(Q(quantity__gt=0), output_field=BooleanField()),
+            average_rating=Subquery(average))
+        .order_by()
+        .values_list('price_bucket', 'in_stock', 'customer_id', 'average_rating')
+    )
+    # Grouped in an outer query, since Django would repeat the rating
+    # subquery in GROUP BY and run it twice for every product
+    sql, params = per_product.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT price_bucket, in_stock, customer_id, average_rating, COUNT(*) FROM ({sql}) '
+            f'GROUP BY price_bucket, in_stock, customer_id, average_rating', params)
+        return cursor.fetchall()
+
+
+def _fold(cube):
+    edges = settings.PRODUCT_PRICE_BUCKETS
+    prices = [0] * (len(edges) + 1)
+    availability = {'in_stock': 0, 'out_of_stock': 0}
+    sellers = {}
+    ratings = [0] * RATING_BANDS
+    unrated = 0
+
+    for price_bucket, in_stock, seller, average_rating, count in cube:
+        prices[price_bucket] += count
+        availability['in_stock' if in_stock else 'out_of_stock'] += count
+        sellers[seller] = sellers.get(seller, 0) + count
+        if average_rating is None:
+            unrated += count
+        else:
+            # A perfect 5 goes into the top band with the 4s
+            ratings[min(int(average_rating), RATING_BANDS - 1)] += count
+
+    bounds = [0, *edges, None]
+    top_sellers = sorted(sellers.items(), key=lambda seller: (-seller[1], seller[0]))[:settings.FACETS_TOP_SELLERS]
+    names = {
+        customer.id: customer.user.get_full_name() or customer.user.username
+        for customer in Customer.objects.filter(id__in=[seller for seller, _ in top_sellers]).select_related('user')
+    }
+    return {
+        'count': sum(prices),
+        'price': [
+            {'min': bounds[index], 'max': bounds[index + 1], 'count': count}
+            for index, count in enumerate(prices)
+        ],
+        'availability': availability,
+        'sellers': [
+            {'id': seller, 'name': names.get(seller, ''), 'count': count} for seller, count in top_sellers
+        ],
+        'ratings': [{'min': band, 'max': band + 1, 'count': count} for band, count in enumerate(ratings)],
+        'unrated': unrated,
+    }
+
+
+def catalog_version():
+    """Changes whenever a product is written or a product is rated"""
+    return (
+        Product.all_objects.aggregate(latest=Max('updated_at'))['latest'],
+        ProductRating.objects.aggregate(latest=Max('id'))['latest'],
+    )
+
+
+def facet_counts(params):
+    """Facet counts of the catalog narrowed by the filters in params
+
+    Raises ValueError for malformed filters, see filter_products.
+    """
+    products = filter_products(Product.objects.all(), params)
+    key = tuple(sorted((name, params.get(name)) for name in ('min_price', 'max_price', 'in_stock', 'seller')))
+    version = catalog_version()
+
+    cached = _cache.get(key)
+    hit = cached is not None and cached[0] == version and cached[1] > time.monotonic()
+    metrics.record_cache('product_facets', hit)
+    if hit:
+        return cached[2]
+
+    facets = _fold(_cube(products))
+    with _cache_lock:
+        if len(_cache) >= MAX_CACHED:
+            _cache.clear()
+        _cache[key] = (version, time.monotonic() + settings.FACETS_CACHE_SECONDS, facets)
+    return facets
@@ -0,0 +1,114 @@
+"""Replay of create responses for retried requests
+
+A client that retries a POST with the same Idempotency-Key header gets the
+stored first response back, with an Idempotent-Replayed header, and the
+view does not run again. Keys are scoped to the authenticated user and
+expire after IDEMPOTENCY_KEY_TTL seconds. Reusing a key for a different
+request body is a 422. Anonymous requests are not replayed: they share no
+user to scope the key to, and register's response holds the new token,
+which must not be stored.
+
+The response is stored in the same transaction as the write, and that
+transaction holds SQLite's write lock, so two concurrent retries can't
+both run the view.
+"""
+import datetime
+import functools
+import hashlib
+import json
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+from tipsytequilaapi.db.sqlite import retry_on_locked
+from tipsytequilaapi.models import IdempotencyKey
+from tipsytequilaapi.renderers import dumps, loads
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+
+
+def _fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode()).hexdigest()
+
+
+def _lookup(user_id, key):
+    return IdempotencyKey.objects.filter(user_id=user_id, key=key, expires_at__gt=timezone.now()).first()
+
+
+def _replay(stored, fingerprint):
+    if stored.fingerprint != fingerprint:
+        return Response(
+            {'message': 'This Idempotency-Key was already used for a different request.'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+
+    if stored.content_type:
+        response = HttpResponse(bytes(stored.content), content_type=stored.content_type, status=stored.status_code)
+    else:
+        response = Response(loads(bytes(stored.content)), status=stored.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _store(user_id, key, fingerprint, response):
+    if isinstance(response, Response):
+        content, content_type = dumps(response.data), ''
+    else:
+        content, content_type = response.content, response['Content-Type']
+
+    # An expired entry for the key may still be in the table
+    IdempotencyKey.objects.update_or_create(
+        user_id=user_id, key=key,
+        defaults={
+            'fingerprint': fingerprint,
+            'status_code': response.status_code,
+            'content': content,
+            'content_type': content_type,
+            'expires_at': timezone.now() + datetime.timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+        })
+
+
+def idempotent(func):
+    """Replay the stored response of a view for a repeated Idempotency-Key
+
+    Goes above retry_on_locked on a view method or function view. Server
+    errors are not stored, so the client can retry them.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        request = next(arg for arg in args if isinstance(arg, Request))
+        key = request.META.get(HEADER)
+        if not key or not request.user.is_authenticated:
+            return func(*args, **kwargs)
+        if len(key) > 255:
+            return Response(
+                {'message': 'Idempotency-Key can be at most 255 characters.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        user_id = request.user.id
+        fingerprint = _fingerprint(request)
+
+        # Cheap check outside the write lock first
+        stored = _lookup(user_id, key)
+        if stored is not None:
+            return _replay(stored, fingerprint)
+
+        @retry_on_locked
+        def run():
+            # A concurrent retry may have finished while we waited for the lock
+            stored = _lookup(user_id, key)
+            if stored is not None:
+                return _replay(stored, fingerprint)
+
+            response = func(*args, **kwargs)
+            if response.status_code < 500:
+                _store(user_id, key, fingerprint, response)
+            return response
+
+        return run()
+
+    return wrapper
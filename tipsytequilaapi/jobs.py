@@ -0,0 +1,154 @@
+"""Database-backed job queue run by manage.py runworker
+
+Tasks are plain functions registered with @task and queued by name with
+keyword arguments that must be JSON serializable:
+
+    @task(max_attempts=3)
+    def optimize_product_image(product_id):
+        ...
+
+    enqueue('optimize_product_image', product_id=product.id)
+
+enqueue writes a Job row in the current transaction, so a job is only
+queued when the write that asked for it commits. Delivery is at least once:
+a claimed job is hidden from other workers for the task's timeout, and if
+its worker dies before finishing it becomes visible again. Tasks must
+therefore be safe to run twice. Failed runs are retried with exponential
+backoff until max_attempts, after which the job stays in the table with
+status 'failed' and its last traceback. Finished jobs are deleted.
+"""
+import datetime
+import json
+import logging
+import random
+import traceback
+from django.conf import settings
+from django.db import connections
+from django.db.models import F, Q
+from django.utils import timezone
+from tipsytequilaapi.db.sqlite import retry_on_locked
+from tipsytequilaapi.models import Job
+
+logger = logging.getLogger('tipsytequila.jobs')
+
+_tasks = {}
+
+
+class Task:
+    def __init__(self, func, name, max_attempts, timeout):
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+
+
+def task(func=None, *, name=None, max_attempts=5, timeout=None):
+    """Register a function as a task, under its own name by default
+
+    Arguments:
+        max_attempts -- runs before the job is marked failed
+        timeout -- seconds a run may take before the job is handed to
+                   another worker, settings.JOB_VISIBILITY_TIMEOUT by default
+    """
+    def register(func):
+        task_name = name or func.__name__
+        _tasks[task_name] = Task(func, task_name, max_attempts, timeout)
+        return func
+
+    return register(func) if func is not None else register
+
+
+def get_task(name):
+    try:
+        return _tasks[name]
+    except KeyError:
+        raise LookupError(f'No task named {name!r} is registered') from None
+
+
+def enqueue(name, delay=0, **kwargs):
+    """Queue a run of the named task, delay seconds from now"""
+    definition = get_task(name)
+    return Job.objects.create(
+        task=name,
+        payload=json.dumps(kwargs),
+        max_attempts=definition.max_attempts,
+        run_at=timezone.now() + datetime.timedelta(seconds=delay),
+    )
+
+
+@retry_on_locked
+def claim(worker, limit):
+    """Lock up to limit due jobs for worker and return them
+
+    Running jobs whose visibility timeout passed are claimed again, or
+    failed if they have used up their attempts.
+    """
+    now = timezone.now()
+    candidates = list(
+        Job.objects.select_for_update(skip_locked=True).filter(
+            Q(status=Job.QUEUED, run_at__lte=now) | Q(status=Job.RUNNING, locked_until__lt=now)
+        ).order_by('run_at')[:limit]
+    )
+
+    claimed = []
+    for job in candidates:
+        if job.attempts >= job.max_attempts:
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.FAILED, locked_until=None,
+                last_error=f'Timed out on {job.locked_by}')
+            continue
+
+        try:
+            timeout = get_task(job.task).timeout or settings.JOB_VISIBILITY_TIMEOUT
+        except LookupError:
+            timeout = settings.JOB_VISIBILITY_TIMEOUT
+        job.status = Job.RUNNING
+        job.attempts += 1
+        job.locked_by = worker
+        job.locked_until = now + datetime.timedelta(seconds=timeout)
+        Job.objects.filter(pk=job.pk).update(
+            status=job.status, attempts=F('attempts') + 1,
+            locked_by=worker, locked_until=job.locked_until)
+        claimed.append(job)
+    return claimed
+
+
+def execute(name, payload):
+    """Run a task and return None, or the traceback if it raised
+
+    Runs in the pool's thread or process, so it only touches the database
+    through the task itself and closes its connection afterwards.
+    """
+    try:
+        get_task(name).func(**json.loads(payload))
+        return None
+    except Exception:  # pylint: disable=broad-except
+        return traceback.format_exc()
+    finally:
+        connections.close_all()
+
+
+def _owned(job):
+    # A job that timed out may have been claimed again by another worker
+    return Job.objects.filter(pk=job.pk, locked_by=job.locked_by, attempts=job.attempts)
+
+
+@retry_on_locked
+def complete(job):
+    _owned(job).delete()
+
+
+@retry_on_locked
+def fail(job, error):
+    """Schedule a retry with backoff, or mark the job failed"""
+    if job.attempts >= job.max_attempts:
+        logger.error('Job %s (%s) failed for good: %s', job.pk, job.task, error)
+        _owned(job).update(status=Job.FAILED, locked_until=None, last_error=error)
+        return
+
+    delay = settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1) * random.uniform(0.5, 1.5)
+    logger.warning('Job %s (%s) failed, retrying in %.0fs: %s', job.pk, job.task, delay, error)
+    _owned(job).update(
+        status=Job.QUEUED, locked_until=None, last_error=error,
+        run_at=timezone.now() + datetime.timedelta(seconds=delay))
+
@@ -0,0 +1,95 @@
+"""Replay a traffic mix against a copy of the database"""
+import datetime
+import json
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from tipsytequilaapi import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Replay the scenarios of a traffic file against a throwaway copy of '
+            'the database and report throughput, latency percentiles and '
+            'queries per request for each endpoint')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--traffic', default=str(settings.BASE_DIR / 'benchmarks' / 'traffic.jsonl'),
+            help='JSON lines file of weighted scenarios')
+        parser.add_argument(
+            '--database', default=None,
+            help='Seeded SQLite file to copy (default: the configured database)')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument(
+            '--duration', type=float, default=30.0,
+            help='Seconds to run (default: 30)')
+        parser.add_argument(
+            '--iterations', type=int, default=None,
+            help='Scenarios per virtual user, overrides --duration')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='Previous results JSON to compare against')
+
+    def handle(self, *args, **options):
+        scenarios = benchmark.load_traffic(options['traffic'])
+        if not scenarios:
+            raise CommandError(f'No scenarios in {options["traffic"]}')
+        source = options['database'] or settings.DATABASES['default']['NAME']
+        if not os.path.exists(source):
+            raise CommandError(f'{source} does not exist, seed a database first')
+
+        with benchmark.throwaway_database(source):
+            product_ids = benchmark.product_ids()
+            if not product_ids:
+                raise CommandError(f'{source} has no products to browse')
+            users = benchmark.create_virtual_users(options['concurrency'])
+            connections.close_all()
+
+            replayer = benchmark.Replayer(scenarios, users, product_ids, seed=options['seed'])
+            results = replayer.run(
+                options['concurrency'],
+                duration=None if options['iterations'] else options['duration'],
+                iterations=options['iterations'])
+
+        results['run'] = {
+            'started': datetime.datetime.now().isoformat(timespec='seconds'),
+            'traffic': options['traffic'],
+            'database': str(source),
+            'concurrency': options['concurrency'],
+            'seed': options['seed'],
+            'async_reads': settings.ASYNC_READ_VIEWS,
+            'database_profile': settings.DATABASE_PROFILE,
+        }
+        self._report(results)
+
+        if options['compare']:
+            with open(options['compare'], 'r') as baseline_file:
+                self._report_comparison(results, json.load(baseline_file))
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                json.dump(results, output_file, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    def _report(self, results):
+        self.stdout.write(
+            f'{"endpoint":<40} {"reqs":>7} {"err":>5} {"req/s":>8} '
+            f'{"p50ms":>8} {"p95ms":>8} {"p99ms":>8} {"q/req":>6}')
+        for endpoint, stats in results['endpoints'].items():
+            self.stdout.write(
+                f'{endpoint:<40} {stats["requests"]:>7} {stats["errors"]:>5} '
+                f'{stats["throughput"]:>8.1f} {stats["p50_ms"]:>8.2f} '
+                f'{stats["p95_ms"]:>8.2f} {stats["p99_ms"]:>8.2f} '
+                f'{stats["queries_per_request"]:>6.1f}')
+        self.stdout.write(
+            f'{results["requests"]} requests in {results["elapsed_s"]:.1f}s, '
+            f'{results["throughput"]:.1f} req/s')
+
+    def _report_comparison(self, results, baseline):
+        self.stdout.write('Change against baseline (%):')
+        for endpoint, change in benchmark.compare(results, baseline):
+            self.stdout.write(
+                f'{endpoint:<40} req/s {change["throughput"]:+7.1f} '
+                f'p50 {change["p50_ms"]:+7.1f} p95 {change["p95_ms"]:+7.1f} '
+                f'p99 {change["p99_ms"]:+7.1f} q/req {change["queries_per_request"]:+7.1f}')
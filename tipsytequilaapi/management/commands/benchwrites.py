@@ -0,0 +1,87 @@
+"""Compare rating and review write throughput with and without coalescing"""
+import json
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from tipsytequilaapi import benchmark
+from tipsytequilaapi.db import coalesce
+
+
+class Command(BaseCommand):
+    help = ('Replay a burst of concurrent rating and review writes against two '
+            'throwaway copies of the database, once with one transaction per '
+            'request and once with group commits, and report the difference')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--traffic', default=str(settings.BASE_DIR / 'benchmarks' / 'review_burst.jsonl'),
+            help='JSON lines file of weighted write scenarios')
+        parser.add_argument(
+            '--database', default=None,
+            help='Seeded SQLite file to copy (default: the configured database)')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument(
+            '--duration', type=float, default=10.0,
+            help='Seconds to run each mode (default: 10)')
+        parser.add_argument(
+            '--iterations', type=int, default=None,
+            help='Scenarios per virtual user, overrides --duration')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--max-batch', type=int, default=settings.WRITE_COALESCING_MAX_BATCH,
+            help='Writes per group commit')
+        parser.add_argument(
+            '--max-wait-ms', type=float, default=settings.WRITE_COALESCING_MAX_WAIT_MS,
+            help='How long a group commit waits for more writes')
+        parser.add_argument('--output', help='Write both runs to this JSON file')
+
+    def handle(self, *args, **options):
+        scenarios = benchmark.load_traffic(options['traffic'])
+        if not scenarios:
+            raise CommandError(f'No scenarios in {options["traffic"]}')
+        source = options['database'] or settings.DATABASES['default']['NAME']
+        if not os.path.exists(source):
+            raise CommandError(f'{source} does not exist, seed a database first')
+
+        runs = {}
+        for mode, coalescing in (('single', False), ('coalesced', True)):
+            settings.WRITE_COALESCING = coalescing
+            coalesce._coalescer = coalesce.WriteCoalescer(
+                options['max_batch'], options['max_wait_ms'] / 1000)
+
+            # Each mode writes to a fresh copy, so both start from the same rows
+            with benchmark.throwaway_database(source):
+                product_ids = benchmark.product_ids()
+                if not product_ids:
+                    raise CommandError(f'{source} has no products to rate')
+                users = benchmark.create_virtual_users(options['concurrency'])
+                connections.close_all()
+
+                replayer = benchmark.Replayer(scenarios, users, product_ids, seed=options['seed'])
+                runs[mode] = replayer.run(
+                    options['concurrency'],
+                    duration=None if options['iterations'] else options['duration'],
+                    iterations=options['iterations'])
+            self._report(mode, runs[mode])
+
+        single, coalesced = runs['single'], runs['coalesced']
+        gain = (coalesced['throughput'] / single['throughput'] - 1) * 100 if single['throughput'] else 0.0
+        self.stdout.write(
+            f'Coalescing: {gain:+.1f}% writes/s with {options["concurrency"]} writers, '
+            f'database profile {settings.DATABASE_PROFILE}')
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                json.dump(runs, output_file, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+    def _report(self, mode, results):
+        requests = results['requests']
+        errors = sum(stats['errors'] for stats in results['endpoints'].values())
+        self.stdout.write(f'{mode}: {requests} writes in {results["elapsed_s"]:.1f}s, '
+                          f'{results["throughput"]:.1f} writes/s, {errors} errors')
+        for endpoint, stats in results['endpoints'].items():
+            self.stdout.write(
+                f'  {endpoint:<20} p50 {stats["p50_ms"]:>8.2f}ms  p95 {stats["p95_ms"]:>8.2f}ms  '
+                f'p99 {stats["p99_ms"]:>8.2f}ms  errors {stats["errors"]}')
@@ -0,0 +1,61 @@
+"""Drop superseded change log entries, expired product tombstones and idempotency keys"""
+import datetime
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from tipsytequilaapi.db.sqlite import retry_on_locked
+from tipsytequilaapi.models import Change, IdempotencyKey, ProductTombstone
+
+
+class Command(BaseCommand):
+    help = ('Delete change log entries older than the retention window that a later '
+            'entry for the same row supersedes, so the log keeps the latest change per row. '
+            'Also drops product tombstones older than PRODUCT_TOMBSTONE_DAYS and expired '
+            'idempotency keys.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=float, default=7.0,
+            help='Keep every entry younger than this many days (default: 7)')
+        parser.add_argument(
+            '--drop-deletes', action='store_true',
+            help='Also delete old delete entries, the last trace of deleted rows')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Entries deleted per transaction (default: 5000)')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(days=options['days'])
+        old = Change.objects.filter(created_at__lt=cutoff)
+        superseded = old.filter(Exists(Change.objects.filter(
+            entity=OuterRef('entity'), entity_id=OuterRef('entity_id'), id__gt=OuterRef('id'))))
+
+        removed = self.purge(superseded, options['batch_size'])
+        if options['drop_deletes']:
+            removed += self.purge(old.filter(operation=Change.DELETE), options['batch_size'])
+
+        self.stdout.write(f'Compacted {removed} change(s) older than {cutoff:%Y-%m-%d %H:%M}')
+
+        horizon = timezone.now() - datetime.timedelta(days=settings.PRODUCT_TOMBSTONE_DAYS)
+        expired = self.purge(ProductTombstone.objects.filter(deleted_at__lt=horizon), options['batch_size'])
+        self.stdout.write(f'Dropped {expired} product tombstone(s) older than {horizon:%Y-%m-%d %H:%M}')
+
+        keys = self.purge(IdempotencyKey.objects.filter(expires_at__lt=timezone.now()), options['batch_size'])
+        self.stdout.write(f'Dropped {keys} expired idempotency key(s)')
+
+    def purge(self, queryset, batch_size):
+        """Delete queryset in short transactions so writers aren't blocked"""
+
+        @retry_on_locked
+        def delete_batch():
+            ids = list(queryset.order_by('id').values_list('id', flat=True)[:batch_size])
+            queryset.model.objects.filter(id__in=ids).delete()
+            return len(ids)
+
+        removed = 0
+        while True:
+            count = delete_batch()
+            removed += count
+            if count < batch_size:
+                return removed
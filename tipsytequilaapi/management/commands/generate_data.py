@@ -0,0 +1,218 @@
+"""Generate a large, realistic dataset for benchmarks"""
+import datetime
+import itertools
+import random
+import time
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from rest_framework.authtoken.models import Token
+from tipsytequilaapi.db.sql import table
+from tipsytequilaapi.models import (Customer, Order, OrderProduct, Product,
+                                    ProductRating, ProductReview, Rating, Review)
+
+ADJECTIVES = ('Silver', 'Blanco', 'Reposado', 'Anejo', 'Extra Anejo', 'Cristalino', 'Joven')
+BRANDS = ('Patron', 'Casamigos', 'Don Julio', 'Espolon', 'Herradura', 'Olmeca',
+          'Cazadores', 'Fortaleza', 'Siete Leguas', 'Tapatio', 'El Tesoro', 'Milagro')
+NOTES = ('agave', 'citrus', 'vanilla', 'black pepper', 'caramel', 'oak', 'honey',
+         'cinnamon', 'butterscotch', 'mint', 'dried fruit', 'chocolate')
+REVIEWS = ('Smooth and easy to sip.', 'Great for margaritas.', 'A bit harsh on the finish.',
+           'Worth every penny.', 'Not what I expected.', 'My new favorite.',
+           'Good value for the price.', 'Too sweet for my taste.')
+
+
+def zipf_sampler(rng, population, exponent):
+    """Draw from population with Zipfian popularity in a random rank order
+
+    Returns a function taking k and returning k samples.
+    """
+    ranked = list(population)
+    rng.shuffle(ranked)
+    cum_weights = list(itertools.accumulate(1 / rank ** exponent for rank in range(1, len(ranked) + 1)))
+
+    def sample(k):
+        return rng.choices(ranked, cum_weights=cum_weights, k=k)
+
+    return sample
+
+
+class Command(BaseCommand):
+    help = ('Append a deterministic, seeded dataset of customers, products, orders, '
+            'line items, ratings and reviews with Zipfian product popularity')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=1000)
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--orders', type=int, default=20000)
+        parser.add_argument('--line-items', type=int, default=100000)
+        parser.add_argument('--ratings', type=int, default=50000)
+        parser.add_argument('--reviews', type=int, default=20000)
+        parser.add_argument(
+            '--open-cart-ratio', type=float, default=0.3,
+            help='Share of customers that get an unpurchased order (default: 0.3)')
+        parser.add_argument(
+            '--zipf', type=float, default=1.1,
+            help='Exponent of the product and seller popularity skew (default: 1.1)')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument(
+            '--password', default='tequila',
+            help='Password set for every generated user (default: tequila)')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.today = datetime.date.today()
+
+        with transaction.atomic():
+            customer_ids = self._customers(options['customers'], options['password'])
+            product_ids = self._products(options['products'], customer_ids, options['zipf'])
+            order_ids = self._orders(options['orders'], customer_ids, options['open_cart_ratio'])
+            popular = zipf_sampler(self.rng, product_ids, options['zipf'])
+            self._line_items(options['line_items'], order_ids, popular)
+            self._ratings(options['ratings'], popular)
+            self._reviews(options['reviews'], popular)
+
+    def _insert(self, model, columns, rows):
+        """Insert an iterable of row tuples with batched executemany"""
+        started = time.monotonic()
+        sql = (f'INSERT INTO {table(model)} ({", ".join(connection.ops.quote_name(c) for c in columns)}) '
+               f'VALUES ({", ".join(["%s"] * len(columns))})')
+        count = 0
+        rows = iter(rows)
+        with connection.cursor() as cursor:
+            while True:
+                batch = list(itertools.islice(rows, self.batch_size))
+                if not batch:
+                    break
+                cursor.executemany(sql, batch)
+                count += len(batch)
+        self.stdout.write(
+            f'{model._meta.db_table}: {count} rows in {time.monotonic() - started:.1f}s')
+
+    def _next_id(self, model):
+        last = model.objects.order_by('-pk').values_list('pk', flat=True).first()
+        return (last or 0) + 1
+
+    def _date(self, days_back=730):
+        return (self.today - datetime.timedelta(days=self.rng.randrange(days_back))).isoformat()
+
+    def _customers(self, count, password):
+        rng = self.rng
+        first_user = self._next_id(User)
+        first_customer = self._next_id(Customer)
+        user_ids = range(first_user, first_user + count)
+        customer_ids = range(first_customer, first_customer + count)
+        # Hashing once keeps 100k users fast while every user can still log in
+        hashed = make_password(password)
+        joined = connection.ops.adapt_datetimefield_value(
+            datetime.datetime.combine(self.today, datetime.time(), tzinfo=datetime.timezone.utc))
+
+        self._insert(User, (
+            'id', 'password', 'is_superuser', 'username', 'first_name', 'last_name',
+            'email', 'is_staff', 'is_active', 'date_joined'), (
+            (user_id, hashed, False, f'user{user_id}', 'Test', f'User{user_id}',
+             f'user{user_id}@example.com', False, True, joined)
+            for user_id in user_ids))
+        self._insert(Token, ('key', 'user_id', 'created'), (
+            # Prefixed with the user id so appending another run can't collide
+            (f'{user_id:08x}{rng.getrandbits(128):032x}', user_id, joined) for user_id in user_ids))
+        self._insert(Customer, ('id', 'user_id', 'phone_number', 'address'), (
+            (customer_id, user_id, f'555-{rng.randrange(10000):04d}',
+             f'{rng.randrange(1, 9999)} {rng.choice(BRANDS)} St')
+            for customer_id, user_id in zip(customer_ids, user_ids)))
+        return list(customer_ids)
+
+    def _products(self, count, customer_ids, exponent):
+        rng = self.rng
+        first = self._next_id(Product)
+        sellers = zipf_sampler(rng, customer_ids, exponent)
+        updated = connection.ops.adapt_datetimefield_value(
+            datetime.datetime.combine(self.today, datetime.time(), tzinfo=datetime.timezone.utc))
+
+        def rows():
+            for offset in range(0, count, self.batch_size):
+                for product_id, seller in zip(
+                        range(first + offset, first + min(count, offset + self.batch_size)),
+                        sellers(min(self.batch_size, count - offset))):
+                    notes = ', '.join(rng.sample(NOTES, 3))
+                    yield (
+                        product_id,
+                        f'{rng.choice(BRANDS)} {rng.choice(ADJECTIVES)} {product_id}',
+                        seller,
+                        round(min(10000.0, rng.lognormvariate(3.8, 0.6)), 2),
+                        f'Notes of {notes}.',
+                        0 if rng.random() < 0.1 else rng.randrange(1, 500),
+                        self._date(),
+                        '',
+                        updated,
+                    )
+
+        self._insert(Product, (
+            'id', 'name', 'customer_id', 'price', 'description', 'quantity',
+            'created_date', 'image_path', 'updated_at'), rows())
+        return list(range(first, first + count))
+
+    def _orders(self, count, customer_ids, open_cart_ratio):
+        rng = self.rng
+        first = self._next_id(Order)
+        open_carts = [customer for customer in customer_ids if rng.random() < open_cart_ratio]
+        purchased = ((customer, True) for customer in (rng.choice(customer_ids) for _ in range(count)))
+        carts = ((customer, False) for customer in open_carts)
+
+        def rows():
+            for order_id, (customer, is_purchased) in zip(itertools.count(first), itertools.chain(purchased, carts)):
+                if is_purchased:
+                    # Counted on that day by the next rollup rebuild
+                    day = self._date()
+                    yield (order_id, customer, True, day, day)
+                else:
+                    yield (order_id, customer, False, self.today.isoformat(), None)
+
+        self._insert(Order, ('id', 'customer_id', 'purchased', 'created_date', 'counted_date'), rows())
+        return list(range(first, first + count + len(open_carts)))
+
+    def _line_items(self, count, order_ids, popular):
+        rng = self.rng
+        first = self._next_id(OrderProduct)
+
+        def rows():
+            for offset in range(0, count, self.batch_size):
+                size = min(self.batch_size, count - offset)
+                for line_id, product in zip(range(first + offset, first + offset + size), popular(size)):
+                    yield (line_id, rng.choice(order_ids), product)
+
+        self._insert(OrderProduct, ('id', 'order_id', 'product_id'), rows())
+
+    def _attached(self, count, popular, model, columns, value, link_model, link_column):
+        """Insert count rows of model plus one link row to a popular product each"""
+        first = self._next_id(model)
+        first_link = self._next_id(link_model)
+        ids = range(first, first + count)
+
+        self._insert(model, ('id', *columns), ((row_id, *value()) for row_id in ids))
+
+        def links():
+            for offset in range(0, count, self.batch_size):
+                size = min(self.batch_size, count - offset)
+                for index, product in zip(range(offset, offset + size), popular(size)):
+                    yield (first_link + index, product, first + index)
+
+        self._insert(link_model, ('id', 'product_id', link_column), links())
+
+    def _ratings(self, count, popular):
+        rng = self.rng
+        # Skewed towards good scores, like most storefront ratings
+        scores, weights = (1, 2, 3, 4, 5), (5, 7, 15, 33, 40)
+        self._attached(
+            count, popular, Rating, ('score',),
+            lambda: (rng.choices(scores, weights)[0],),
+            ProductRating, 'rating_id')
+
+    def _reviews(self, count, popular):
+        rng = self.rng
+        self._attached(
+            count, popular, Review, ('description',),
+            lambda: (rng.choice(REVIEWS),),
+            ProductReview, 'review_id')
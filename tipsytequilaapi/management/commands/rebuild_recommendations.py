@@ -0,0 +1,16 @@
+"""Recompute the co-purchase matrix behind product recommendations"""
+import time
+from django.core.management.base import BaseCommand
+from tipsytequilaapi import recommendations
+from tipsytequilaapi.db.sqlite import retry_on_locked
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the co-purchase counts of /products/:id/recommendations from '
+            'every purchased order. Checkouts keep them current, so this is only '
+            'needed after loading orders some other way, like generate_data.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        pairs = retry_on_locked(recommendations.rebuild)()
+        self.stdout.write(f'Counted {pairs} product pairs in {time.monotonic() - started:.1f}s')
@@ -0,0 +1,22 @@
+"""Recompute the seller sales rollups"""
+import time
+from django.core.management.base import BaseCommand
+from tipsytequilaapi import sales
+from tipsytequilaapi.db.sqlite import retry_on_locked
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the units sold and revenue behind /customers/:id/sales from every '
+            'purchased order. Checkouts keep them current, so this is only needed after '
+            'loading orders some other way, like generate_data. Past orders are counted '
+            'at current prices.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seller', type=int, default=None,
+            help='Only rebuild this seller (customer id), in a much shorter transaction')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        products = retry_on_locked(sales.rebuild)(options['seller'])
+        self.stdout.write(f'Rolled up sales of {products} products in {time.monotonic() - started:.1f}s')
@@ -0,0 +1,32 @@
+"""Keep the local read replicas in sync with the primary"""
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from tipsytequilaapi.db.replica import replicate
+
+
+class Command(BaseCommand):
+    help = 'Snapshot the primary SQLite database into the read replicas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help='Seconds between snapshots (default: 1.0)')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Take a single snapshot and exit')
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'DATABASE_READ_REPLICAS', []):
+            raise CommandError(
+                'No read replicas configured, set TIPSYTEQUILA_READ_REPLICAS')
+
+        while True:
+            started = time.monotonic()
+            aliases = replicate()
+            self.stdout.write(
+                f'Replicated to {", ".join(aliases)} in {time.monotonic() - started:.3f}s')
+
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,85 @@
+"""Run queued background jobs"""
+import concurrent.futures
+import os
+import signal
+import socket
+import time
+import django
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connections
+from tipsytequilaapi import jobs
+
+
+def _init_process():
+    # Spawned (not forked) pool processes start without Django set up
+    if not apps.ready:
+        django.setup()
+
+
+class Command(BaseCommand):
+    help = 'Claim jobs from the job queue and run them in a thread or process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pool', choices=('thread', 'process'), default='thread',
+            help='Run jobs in threads, or in processes for CPU-heavy tasks (default: thread)')
+        parser.add_argument(
+            '--concurrency', type=int, default=4,
+            help='Jobs run at the same time (default: 4)')
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds to wait for new jobs when the queue is empty (default: 1.0)')
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='Exit once the queue is empty instead of waiting for more jobs')
+
+    def handle(self, *args, **options):
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+        concurrency = options['concurrency']
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        if options['pool'] == 'process':
+            # Forked children must not share the parent's connections
+            connections.close_all()
+            executor = concurrent.futures.ProcessPoolExecutor(concurrency, initializer=_init_process)
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(concurrency, thread_name_prefix='job')
+
+        self.stdout.write(f'Worker {worker} running up to {concurrency} jobs in a {options["pool"]} pool')
+        running = {}
+        with executor:
+            while True:
+                if not self.stopping and len(running) < concurrency:
+                    for job in jobs.claim(worker, concurrency - len(running)):
+                        running[executor.submit(jobs.execute, job.task, job.payload)] = (job, time.monotonic())
+
+                if not running:
+                    if self.stopping or options['burst']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                done, _ = concurrent.futures.wait(
+                    running, timeout=options['poll_interval'],
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    job, started = running.pop(future)
+                    error = future.result()
+                    if error is None:
+                        jobs.complete(job)
+                    else:
+                        jobs.fail(job, error)
+                    if options['verbosity'] >= 2 or error is not None:
+                        self.stdout.write(
+                            f'{job.task} #{job.pk} {"ok" if error is None else "failed"} '
+                            f'in {time.monotonic() - started:.2f}s')
+
+    def stop(self, signum, frame):
+        """Finish the running jobs, but claim no more"""
+        if self.stopping:
+            raise KeyboardInterrupt
+        self.stopping = True
+        self.stdout.write('Stopping after the running jobs, signal again to abort')
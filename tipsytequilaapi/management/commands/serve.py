@@ -0,0 +1,56 @@
+"""Serve the site with a pre-forking pool of worker processes"""
+import os
+from django.core.management.base import BaseCommand, CommandError
+from tipsytequilaapi import server
+
+
+def _address(value):
+    host, _, port = value.rpartition(':')
+    if not host or not port.isdigit():
+        raise CommandError(f'--bind must be host:port, not "{value}"')
+    return host.strip('[]'), int(port)
+
+
+class Command(BaseCommand):
+    help = ('Serve tipsytequila.wsgi from worker processes forked from one warmed-up master, '
+            'all listening on the same port. TERM or INT stops gracefully, HUP reloads the code')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bind', default='127.0.0.1:8000',
+            help='Address to listen on, host:port (default: 127.0.0.1:8000)')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Worker processes (default: one per CPU)')
+        parser.add_argument(
+            '--max-requests', type=int, default=10000,
+            help='Requests after which a worker is replaced, 0 to keep workers (default: 10000)')
+        parser.add_argument(
+            '--max-requests-jitter', type=int, default=1000,
+            help='Up to this many more requests per worker, so workers restart apart (default: 1000)')
+        parser.add_argument(
+            '--max-rss', type=int, default=0,
+            help='Resident memory in MB after which a worker is replaced, 0 for no limit (default: 0)')
+        parser.add_argument(
+            '--keep-alive', type=float, default=5.0,
+            help='Seconds an idle keep-alive connection stays open (default: 5)')
+        parser.add_argument(
+            '--graceful-timeout', type=float, default=30.0,
+            help='Seconds stopping workers get to finish their requests (default: 30)')
+        parser.add_argument(
+            '--backlog', type=int, default=2048,
+            help='Connections each worker queues before refusing more (default: 2048)')
+        parser.add_argument(
+            '--no-access-log', action='store_false', dest='access_log',
+            help='Do not log every request')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+        options['max_rss'] *= 1024 * 1024
+        master = server.Master(_address(options['bind']), options, self.stdout)
+        try:
+            master.check_address()
+        except OSError as ex:
+            raise CommandError(f'Could not listen on {options["bind"]}: {ex}') from ex
+        master.run()
@@ -0,0 +1,212 @@
+"""Multi-process metrics store and text exposition
+
+Every worker process appends its samples to its own mmap-backed file in
+settings.METRICS_DIR, so recording a sample is a dict lookup and an
+in-place float write with no cross-process locking. The /metrics view reads
+all files in the directory and sums them, which makes the output correct
+for pre-forked and multi-worker deployments. Gauges only count files of
+processes that are still alive. The directory should be emptied when the
+whole deployment restarts, since counters carry over otherwise.
+
+Only the metrics declared in METRICS can be recorded.
+"""
+import glob
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+from django.conf import settings
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# name -> (type, help)
+METRICS = {
+    'http_requests_total': (
+        'counter', 'Requests served, by route, method and status code'),
+    'http_request_duration_seconds': (
+        'histogram', 'Request latency in seconds, by route and method'),
+    'http_requests_in_flight': (
+        'gauge', 'Requests currently being handled, by route and method'),
+    'http_request_db_queries': (
+        'histogram', 'Database queries issued per request, by route and method'),
+    'cache_requests_total': (
+        'counter', 'Cache lookups, by cache and result (hit or miss)'),
+    'http_requests_shed_total': (
+        'counter', 'Requests rejected with 503 by admission control, by view'),
+}
+
+_HEADER = struct.Struct('i4x')
+_LENGTH = struct.Struct('i')
+_VALUE = struct.Struct('d')
+_INITIAL_SIZE = 1 << 16
+
+
+class MmapStore:
+    """Append-only key -> float table kept in a memory-mapped file
+
+    Layout: a header holding the number of used bytes, then entries of
+    (key length, utf-8 key padded to 8 bytes, float64 value). The used size
+    is written after an entry is complete, so readers never see half an
+    entry.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._positions = {}
+        self._file = open(path, 'a+b')
+        if os.fstat(self._file.fileno()).st_size < _INITIAL_SIZE:
+            self._file.truncate(_INITIAL_SIZE)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._used = _HEADER.unpack_from(self._map, 0)[0] or _HEADER.size
+        for key, _, position in self._entries(self._map, self._used):
+            self._positions[key] = position
+
+    @staticmethod
+    def _entries(data, used):
+        position = _HEADER.size
+        while position < used:
+            length = _LENGTH.unpack_from(data, position)[0]
+            key_start = position + _LENGTH.size
+            value_position = key_start + length + (-(_LENGTH.size + length) % 8)
+            key = bytes(data[key_start:key_start + length]).decode('utf-8')
+            yield key, _VALUE.unpack_from(data, value_position)[0], value_position
+            position = value_position + _VALUE.size
+
+    @classmethod
+    def read(cls, path):
+        """(key, value) pairs from a store file written by any process"""
+        with open(path, 'rb') as store_file:
+            data = store_file.read()
+        if len(data) < _HEADER.size:
+            return []
+        return [(key, value) for key, value, _ in cls._entries(data, _HEADER.unpack_from(data, 0)[0])]
+
+    def _position(self, key):
+        position = self._positions.get(key)
+        if position is not None:
+            return position
+
+        encoded = key.encode('utf-8')
+        padding = -(_LENGTH.size + len(encoded)) % 8
+        size = _LENGTH.size + len(encoded) + padding + _VALUE.size
+        while self._used + size > len(self._map):
+            self._grow()
+
+        _LENGTH.pack_into(self._map, self._used, len(encoded))
+        self._map[self._used + _LENGTH.size:self._used + _LENGTH.size + len(encoded)] = encoded
+        position = self._used + _LENGTH.size + len(encoded) + padding
+        _VALUE.pack_into(self._map, position, 0.0)
+        self._used += size
+        _HEADER.pack_into(self._map, 0, self._used)
+        self._positions[key] = position
+        return position
+
+    def _grow(self):
+        size = len(self._map) * 2
+        self._map.close()
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+    def inc(self, key, amount=1.0):
+        with self._lock:
+            position = self._position(key)
+            value = _VALUE.unpack_from(self._map, position)[0]
+            _VALUE.pack_into(self._map, position, value + amount)
+
+
+_store = None
+_store_pid = None
+_store_lock = threading.Lock()
+
+
+def _process_store():
+    """This process's store, reopened after a fork"""
+    global _store, _store_pid  # pylint: disable=global-statement
+    pid = os.getpid()
+    if _store_pid != pid:
+        with _store_lock:
+            if _store_pid != pid:
+                os.makedirs(settings.METRICS_DIR, exist_ok=True)
+                _store = MmapStore(os.path.join(settings.METRICS_DIR, f'metrics_{pid}.db'))
+                _store_pid = pid
+    return _store
+
+
+def _key(name, sample, labels):
+    return json.dumps([name, sample, labels], sort_keys=True)
+
+
+def inc(name, labels, amount=1.0):
+    """Increment a counter or move a gauge by amount"""
+    _process_store().inc(_key(name, name, labels), amount)
+
+
+def observe(name, labels, value, buckets):
+    """Record value in a histogram with the given upper bounds"""
+    store = _process_store()
+    for bound in buckets:
+        # Empty buckets are written too so every series has the full bucket set
+        store.inc(
+            _key(name, f'{name}_bucket', {**labels, 'le': repr(float(bound))}),
+            1.0 if value <= bound else 0.0)
+    store.inc(_key(name, f'{name}_bucket', {**labels, 'le': '+Inf'}))
+    store.inc(_key(name, f'{name}_sum', labels), value)
+    store.inc(_key(name, f'{name}_count', labels))
+
+
+def record_cache(cache, hit, count=1):
+    """Count count cache lookups for the hit ratio"""
+    inc('cache_requests_total', {'cache': cache, 'result': 'hit' if hit else 'miss'}, count)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _sample_order(item):
+    (sample, labels), _ = item
+    bound = dict(labels).get('le')
+    return (sample, [label for label in labels if label[0] != 'le'],
+            float(bound) if bound is not None else 0.0)
+
+
+def collect():
+    """Sum every process's store into the text exposition format"""
+    samples = {}
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, 'metrics_*.db')):
+        pid = int(re.search(r'metrics_(\d+)\.db$', path).group(1))
+        alive = None
+        for key, value in MmapStore.read(path):
+            name, sample, labels = json.loads(key)
+            if name not in METRICS:
+                continue
+            if METRICS[name][0] == 'gauge':
+                alive = _alive(pid) if alive is None else alive
+                if not alive:
+                    continue
+            series = samples.setdefault(name, {})
+            label_key = (sample, tuple(sorted(labels.items())))
+            series[label_key] = series.get(label_key, 0.0) + value
+
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (sample, labels), value in sorted(samples.get(name, {}).items(), key=_sample_order):
+            rendered = ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+            lines.append(f'{sample}{{{rendered}}} {value!r}' if rendered else f'{sample} {value!r}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,45 @@
+"""Request middleware of the API"""
+import asyncio
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+class AsyncCapableMiddleware:
+    """Base of a middleware that runs in the mode of the chain it wraps
+
+    Django runs a chain async under ASGI only if every middleware in it can,
+    and otherwise calls async views through async_to_sync. Subclasses define
+    __call__ for sync requests, starting with
+
+        if self.is_async:
+            return self.__acall__(request)
+
+    and an async __acall__ doing the same around an awaited get_response.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # How Django's MiddlewareMixin marks an instance as a coroutine function
+            self._is_coroutine = asyncio.coroutines._is_coroutine  # pylint: disable=protected-access
+
+
+def install_execute_wrapper(wrapper):
+    """Run wrapper around every query of every connection, in any thread
+
+    Installed for good rather than per request with execute_wrapper(), since
+    under ASGI the queries run on the connections of sync_to_async threads,
+    which the middleware never sees. wrapper finds its request's state in a
+    context variable, and sync_to_async carries those into its threads.
+    """
+    def install(connection, **kwargs):
+        if wrapper not in connection.execute_wrappers:
+            # First, so execute_wrapper() blocks still pop their own wrapper
+            connection.execute_wrappers.insert(0, wrapper)
+
+    connection_created.connect(install, weak=False, dispatch_uid=f'{wrapper.__module__}.{wrapper.__qualname__}')
+    for connection in connections.all():
+        install(connection)
@@ -0,0 +1,140 @@
+"""Adaptive admission control for expensive views
+
+Each view named in settings.ADMISSION_CONTROL gets a concurrency limit per
+process. Requests over the limit wait in a short queue, and once the queue
+is full, or a request has waited queue_timeout seconds, it is shed with 503
+and a Retry-After header instead of piling onto the worker pool.
+
+The limit adapts with AIMD: each request that finishes under target_ms
+raises it by 1/limit, about one per limit's worth of requests, and each
+slower request or server error multiplies it by backoff. A view that
+starts to hog the database therefore gets fewer slots and leaves the
+rest of the pool to checkout.
+"""
+import math
+import threading
+import time
+from django.conf import settings
+from django.http import JsonResponse
+from tipsytequilaapi import metrics
+from . import AsyncCapableMiddleware
+from .timing import view_name
+
+DEFAULTS = {
+    'initial_limit': 4,
+    'min_limit': 1,
+    'max_limit': 16,
+    'max_queue': 8,
+    'queue_timeout': 0.5,
+    'target_ms': 250,
+    'backoff': 0.9,
+}
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit with a bounded wait queue"""
+
+    def __init__(self, initial_limit, min_limit, max_limit, max_queue, queue_timeout, target_ms, backoff):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.target = target_ms / 1000
+        self.backoff = backoff
+        self.in_flight = 0
+        self.waiting = 0
+        # Moving average of latency, for Retry-After
+        self.latency = self.target
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Take a slot, waiting in the queue if needed; False if shed"""
+        with self._condition:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            if self.waiting >= self.max_queue:
+                return False
+
+            self.waiting += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self.in_flight >= int(self.limit):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+                self.in_flight += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self, elapsed, failed):
+        """Give the slot back and adapt the limit to how the request went"""
+        with self._condition:
+            self.in_flight -= 1
+            self.latency += (elapsed - self.latency) * 0.1
+            if failed or elapsed > self.target:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify()
+
+    def retry_after(self):
+        """Seconds until the queue ahead of a new request should have drained"""
+        return max(1, math.ceil(self.latency * (self.waiting + 1) / max(1, int(self.limit))))
+
+
+SHED_MESSAGE = 'The server is busy, please retry shortly.'
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name):
+    """The process-wide limiter of a view, or None if it isn't limited"""
+    limiter = _limiters.get(name)
+    if limiter is None:
+        options = getattr(settings, 'ADMISSION_CONTROL', {}).get(name)
+        if options is None:
+            return None
+        with _limiters_lock:
+            limiter = _limiters.setdefault(name, AdaptiveLimiter(**{**DEFAULTS, **options}))
+    return limiter
+
+
+class AdmissionControlMiddleware(AsyncCapableMiddleware):
+    """Shed load on the views listed in settings.ADMISSION_CONTROL"""
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.release(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.release(request, await self.get_response(request))
+
+    @staticmethod
+    def release(request, response):
+        admitted = getattr(request, '_admission', None)
+        if admitted is not None:
+            limiter, start = admitted
+            limiter.release(time.perf_counter() - start, response.status_code >= 500)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Django runs this in a thread under ASGI too, so acquire() may block
+        name = view_name(view_func, request.method)
+        limiter = get_limiter(name)
+        if limiter is None:
+            return None
+
+        if not limiter.acquire():
+            metrics.inc('http_requests_shed_total', {'view': name})
+            response = JsonResponse({'message': SHED_MESSAGE}, status=503)
+            response['Retry-After'] = str(limiter.retry_after())
+            return response
+
+        request._admission = (limiter, time.perf_counter())
+        return None
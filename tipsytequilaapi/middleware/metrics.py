@@ -0,0 +1,84 @@
+"""Per-route request metrics for the /metrics endpoint"""
+import contextlib
+import contextvars
+import re
+import time
+from tipsytequilaapi import metrics
+from . import AsyncCapableMiddleware, install_execute_wrapper
+
+_counter = contextvars.ContextVar('request_query_counter', default=None)
+
+
+def route_label(request):
+    """URL pattern the request resolved to, e.g. /products/{pk}"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None or match.route is None:
+        return 'unmatched'
+    route = re.sub(r'\(\?P<(\w+)>[^)]*\)', r'{\1}', match.route)
+    return '/' + route.replace('^', '').replace('$', '').replace('\\', '')
+
+
+class QueryCounter:
+    """Count of the queries of one request"""
+
+    def __init__(self):
+        self.queries = 0
+
+
+def _count_query(execute, sql, params, many, context):
+    counter = _counter.get()
+    if counter is not None:
+        counter.queries += 1
+    return execute(sql, params, many, context)
+
+
+class MetricsMiddleware(AsyncCapableMiddleware):
+    """Record request counts, latency, in-flight requests and query counts"""
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        install_execute_wrapper(_count_query)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with self.counting(request, counter):
+            response = self.get_response(request)
+        return self.record(request, response, counter, start)
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with self.counting(request, counter):
+            response = await self.get_response(request)
+        return self.record(request, response, counter, start)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def counting(request, counter):
+        """Count the block's queries and keep it in the in-flight gauge"""
+        token = _counter.set(counter)
+        try:
+            yield
+        finally:
+            _counter.reset(token)
+            labels = getattr(request, 'metrics_labels', None)
+            if labels is not None:
+                metrics.inc('http_requests_in_flight', labels, -1)
+
+    @staticmethod
+    def record(request, response, counter, start):
+        labels = getattr(request, 'metrics_labels', None) or {'route': route_label(request), 'method': request.method}
+        metrics.inc('http_requests_total', {**labels, 'status': str(response.status_code)})
+        metrics.observe(
+            'http_request_duration_seconds', labels,
+            time.perf_counter() - start, metrics.LATENCY_BUCKETS)
+        metrics.observe(
+            'http_request_db_queries', labels, counter.queries, metrics.QUERY_BUCKETS)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_labels = {'route': route_label(request), 'method': request.method}
+        metrics.inc('http_requests_in_flight', request.metrics_labels)
@@ -0,0 +1,47 @@
+"""Request scoping for the primary/replica router"""
+from django.conf import settings
+from tipsytequilaapi.db.router import reset_replicas, use_replicas
+from . import AsyncCapableMiddleware
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Set after a write so the same client keeps reading from the primary until
+# the replicas have caught up
+PIN_COOKIE = 'tt_primary_pin'
+
+
+class ReplicaStickinessMiddleware(AsyncCapableMiddleware):
+    """Let safe requests read from replicas unless the client just wrote"""
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        tokens = use_replicas(self.read_only(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = reset_replicas(tokens)
+        return self.pin(request, response, wrote)
+
+    async def __acall__(self, request):
+        tokens = use_replicas(self.read_only(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            wrote = reset_replicas(tokens)
+        return self.pin(request, response, wrote)
+
+    @staticmethod
+    def read_only(request):
+        return request.method in SAFE_METHODS and PIN_COOKIE not in request.COOKIES
+
+    @staticmethod
+    def pin(request, response, wrote):
+        if wrote or request.method not in SAFE_METHODS:
+            response.set_cookie(
+                PIN_COOKIE, '1',
+                max_age=settings.READ_REPLICA_PIN_SECONDS,
+                httponly=True, samesite='Lax'
+            )
+
+        return response
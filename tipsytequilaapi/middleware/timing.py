@@ -0,0 +1,204 @@
+"""Per-request latency breakdown reported through Server-Timing
+
+For a sampled fraction of requests this records the view name
+(e.g. Products.list), total time, time spent in the database and the number
+of queries, time spent in serializer .data or compiled serializers and time
+spent rendering the response, and adds them to the response as a Server-Timing header.
+
+Queries are timed with a connection execute wrapper rather than DEBUG query
+capture, and query and serializer timing are a single context variable
+lookup when the request is not sampled, so the middleware is cheap enough to leave enabled.
+Queries slower than SLOW_QUERY_MS are logged to 'tipsytequila.slow_queries'
+with the SQL and the project frame that issued it.
+"""
+import contextlib
+import contextvars
+import logging
+import random
+import time
+import traceback
+from django.conf import settings
+from rest_framework import serializers
+from . import AsyncCapableMiddleware, install_execute_wrapper
+
+slow_query_log = logging.getLogger('tipsytequila.slow_queries')
+
+_current = contextvars.ContextVar('request_timing', default=None)
+
+
+def view_name(view_func, method):
+    """Name a resolved view the way the ViewSets read, e.g. Orders.retrieve"""
+    cls = getattr(view_func, 'cls', None)
+    actions = getattr(view_func, 'actions', None)
+    if cls is not None and actions:
+        return f'{cls.__name__}.{actions.get(method.lower(), method.lower())}'
+    if cls is not None:
+        return cls.__name__
+    return getattr(view_func, '__name__', repr(view_func))
+
+
+def query_origin():
+    """First stack frame in project code, skipping Django and this module"""
+    base_dir = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()[:-2]):
+        if frame.filename.startswith(base_dir) and frame.filename != __file__ \
+                and 'site-packages' not in frame.filename:
+            return f'{frame.filename}:{frame.lineno} in {frame.name}'
+    return 'unknown'
+
+
+class RequestTiming:
+    """Counters collected for one sampled request"""
+
+    __slots__ = ('view', 'db_time', 'queries', 'serialize_time',
+                 'serialize_depth', 'render_start', 'render_time')
+
+    def __init__(self):
+        self.view = None
+        self.db_time = 0.0
+        self.queries = 0
+        self.serialize_time = 0.0
+        self.serialize_depth = 0
+        self.render_start = None
+        self.render_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        """Execute wrapper hook timing a query of the request"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.db_time += elapsed
+            self.queries += 1
+            if elapsed * 1000 >= settings.SLOW_QUERY_MS:
+                slow_query_log.warning(
+                    '%.1fms %s: %s [%s]', elapsed * 1000, self.view, sql, query_origin())
+
+    def header(self, total):
+        """Format the counters as a Server-Timing header value"""
+        return ', '.join((
+            f'total;dur={total * 1000:.1f}',
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+            f'serialize;dur={self.serialize_time * 1000:.1f}',
+            f'render;dur={self.render_time * 1000:.1f}',
+            f'view;desc="{self.view}"',
+        ))
+
+
+def _timed_execute(execute, sql, params, many, context):
+    timing = _current.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    return timing(execute, sql, params, many, context)
+
+
+def _timed_data(prop):
+    """Wrap a serializer .data property so the outermost access is timed"""
+    getter = prop.fget
+
+    def data(self):
+        if _current.get() is None:
+            return getter(self)
+        with timed_serialize():
+            return getter(self)
+
+    data.timed = True
+    return property(data)
+
+
+def _instrument_serializers():
+    for cls in (serializers.Serializer, serializers.ListSerializer):
+        if not getattr(cls.data.fget, 'timed', False):
+            cls.data = _timed_data(cls.data)
+
+
+@contextlib.contextmanager
+def timed_serialize():
+    """Count a block as serialize time, unless it runs inside another one"""
+    timing = _current.get()
+    if timing is None:
+        yield
+        return
+
+    timing.serialize_depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.serialize_depth -= 1
+        if timing.serialize_depth == 0:
+            timing.serialize_time += time.perf_counter() - start
+
+
+@contextlib.contextmanager
+def timed_render():
+    """Count a block as render time for responses rendered by hand"""
+    timing = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timing is not None:
+            timing.render_time += time.perf_counter() - start
+
+
+class ServerTimingMiddleware(AsyncCapableMiddleware):
+    """Sample requests and report their latency breakdown"""
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        _instrument_serializers()
+        install_execute_wrapper(_timed_execute)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if random.random() >= settings.REQUEST_TIMING_SAMPLE_RATE:
+            return self.get_response(request)
+
+        with self.timed(request) as timed:
+            response = self.get_response(request)
+        return timed(response)
+
+    async def __acall__(self, request):
+        if random.random() >= settings.REQUEST_TIMING_SAMPLE_RATE:
+            return await self.get_response(request)
+
+        with self.timed(request) as timed:
+            response = await self.get_response(request)
+        return timed(response)
+
+    @contextlib.contextmanager
+    def timed(self, request):
+        """Time the block, yielding what adds the header to its response"""
+        timing = RequestTiming()
+        token = _current.set(timing)
+        request.timing = timing
+        start = time.perf_counter()
+
+        def add_header(response):
+            response['Server-Timing'] = timing.header(time.perf_counter() - start)
+            return response
+
+        try:
+            yield add_header
+        finally:
+            _current.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timing = getattr(request, 'timing', None)
+        if timing is not None:
+            timing.view = view_name(view_func, request.method)
+
+    def process_template_response(self, request, response):
+        # DRF responses render after the view returns; time that step
+        timing = getattr(request, 'timing', None)
+        if timing is not None:
+            timing.render_start = time.perf_counter()
+
+            def rendered(response):
+                timing.render_time = time.perf_counter() - timing.render_start
+
+            response.add_post_render_callback(rendered)
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tipsytequilaapi', '0006_product_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='deleted_at',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-19 17:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tipsytequilaapi', '0007_product_deleted_at_unindexed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoPurchase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tipsytequilaapi.product')),
+                ('product', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tipsytequilaapi.product')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='copurchase',
+            index=models.Index(fields=['product', '-count', 'other'], name='tipsytequil_product_5eef26_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='copurchase',
+            unique_together={('product', 'other')},
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-19 18:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def delete_anonymous_keys(apps, schema_editor):
+    # Stored register responses, which hold the new user's token
+    apps.get_model('tipsytequilaapi', 'IdempotencyKey').objects.filter(user__isnull=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tipsytequilaapi', '0009_seller_sales'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_anonymous_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='idempotencykey',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-19 18:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tipsytequilaapi', '0010_idempotency_key_user'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='copurchase',
+            name='tipsytequil_product_5eef26_idx',
+        ),
+        migrations.AddIndex(
+            model_name='copurchase',
+            index=models.Index(fields=['product', '-count', 'other'], name='copurchase_product_count_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-19 18:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tipsytequilaapi', '0011_co_purchase_index_name'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='productsales',
+            name='tipsytequil_seller__20d590_idx',
+        ),
+        migrations.AddIndex(
+            model_name='productsales',
+            index=models.Index(fields=['seller', '-revenue'], name='productsales_seller_rev_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-19 21:10
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def count_purchased_orders(apps, schema_editor):
+    # Orders purchased so far are what the rollups were built from
+    apps.get_model('tipsytequilaapi', 'Order').objects.filter(purchased=True).update(counted_date=F('created_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tipsytequilaapi', '0012_product_sales_index_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='counted_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.RunPython(count_purchased_orders, migrations.RunPython.noop),
+    ]
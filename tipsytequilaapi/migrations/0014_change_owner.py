@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-19 21:50
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+
+
+def set_owners(apps, schema_editor):
+    # Changes of rows deleted since stay without owner, visible to staff only
+    Change = apps.get_model('tipsytequilaapi', 'Change')
+    Order = apps.get_model('tipsytequilaapi', 'Order')
+    OrderProduct = apps.get_model('tipsytequilaapi', 'OrderProduct')
+    Change.objects.filter(entity='customer').update(owner=F('entity_id'))
+    Change.objects.filter(entity='order').update(owner=Subquery(
+        Order.objects.filter(pk=OuterRef('entity_id')).values('customer_id')[:1]))
+    Change.objects.filter(entity='orderproduct').update(owner=Subquery(
+        OrderProduct.objects.filter(pk=OuterRef('entity_id')).values('order__customer_id')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tipsytequilaapi', '0013_order_counted_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='change',
+            name='owner',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.RunPython(set_owners, migrations.RunPython.noop),
+    ]
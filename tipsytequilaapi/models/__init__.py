@@ -5,4 +5,11 @@ from .product import Product
 from .review import Review
 from .rating import Rating
 from .product_rating import ProductRating
-from .product_review import ProductReview
\ No newline at end of file
+from .product_review import ProductReview
+from .product_tombstone import ProductTombstone
+from .change import Change
+from .job import Job
+from .idempotency_key import IdempotencyKey
+from .co_purchase import CoPurchase
+from .product_sales import ProductSales
+from .seller_daily_sales import SellerDailySales
@@ -0,0 +1,77 @@
+from django.db import models
+from django.db.models import Max
+
+
+class Change(models.Model):
+    """Append-only log of writes made through the API
+
+    The id doubles as the consumers' cursor. version counts the changes
+    recorded for one row, so consumers can drop stale updates. Changes to
+    PUBLIC_ENTITIES are visible to everyone, the others only to their
+    owner and staff.
+    """
+
+    CREATE = 'create'
+    UPDATE = 'update'
+    DELETE = 'delete'
+    OPERATIONS = ((CREATE, 'Create'), (UPDATE, 'Update'), (DELETE, 'Delete'))
+
+    PUBLIC_ENTITIES = ('product', 'rating', 'review')
+
+    entity = models.CharField(max_length=20,)
+    entity_id = models.IntegerField()
+    operation = models.CharField(max_length=6, choices=OPERATIONS,)
+    version = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Customer id the changed row belongs to, kept here since a deleted
+    # row can't tell anymore. Null for public entities.
+    owner = models.IntegerField(null=True,)
+
+    class Meta:
+        indexes = [models.Index(fields=['entity', 'entity_id'])]
+
+    @classmethod
+    def record(cls, instance, operation):
+        """Log a write of instance; call inside the write's transaction
+
+        Deletes must be recorded before instance.delete() clears its pk.
+        """
+        entity = instance._meta.model_name
+        version = 1
+        if operation != cls.CREATE:
+            latest = cls.objects.filter(
+                entity=entity, entity_id=instance.pk
+            ).order_by('-id').values_list('version', flat=True).first()
+            version = (latest or 0) + 1
+        return cls.objects.create(
+            entity=entity, entity_id=instance.pk, operation=operation, version=version,
+            owner=_owner(instance))
+
+    @classmethod
+    def record_many(cls, model, ids, operation, owners=None):
+        """Log the same write to many rows of model with one insert
+
+        owners maps the ids of private rows to their owners' customer ids.
+        """
+        owners = owners or {}
+        entity = model._meta.model_name
+        latest = dict(
+            cls.objects.filter(entity=entity, entity_id__in=ids)
+            .values('entity_id').annotate(latest=Max('version')).values_list('entity_id', 'latest'))
+        cls.objects.bulk_create([
+            cls(entity=entity, entity_id=entity_id, operation=operation, version=latest.get(entity_id, 0) + 1,
+                owner=owners.get(entity_id))
+            for entity_id in ids
+        ])
+
+
+def _owner(instance):
+    """Id of the customer a private row belongs to"""
+    model = instance._meta.model_name
+    if model == 'customer':
+        return instance.pk
+    if model == 'order':
+        return instance.customer_id
+    if model == 'orderproduct':
+        return instance.order.customer_id
+    return None
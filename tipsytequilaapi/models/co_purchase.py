@@ -0,0 +1,19 @@
+from django.db import models
+
+
+class CoPurchase(models.Model):
+    """How many purchased orders contained both product and other
+
+    One row per ordered pair, both directions, so the table is the sparse
+    co-occurrence matrix in coordinate form. The (product, -count, other)
+    index keeps every product's row sorted best first, which makes its
+    top-K recommendations a single index range read.
+    """
+
+    product = models.ForeignKey("Product", on_delete=models.CASCADE, db_index=False, related_name="+")
+    other = models.ForeignKey("Product", on_delete=models.CASCADE, related_name="+")
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (('product', 'other'),)
+        indexes = [models.Index(fields=['product', '-count', 'other'], name='copurchase_product_count_idx')]
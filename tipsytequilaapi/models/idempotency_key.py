@@ -0,0 +1,19 @@
+from django.contrib.auth.models import User
+from django.db import models
+
+
+class IdempotencyKey(models.Model):
+    """First response to a request sent with an Idempotency-Key header"""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255,)
+    # Hash of the request, to catch a key reused for a different request
+    fingerprint = models.CharField(max_length=64,)
+    status_code = models.PositiveSmallIntegerField()
+    content = models.BinaryField()
+    # Empty when content is the JSON of a DRF Response's data
+    content_type = models.CharField(max_length=100, blank=True, default='')
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = (('user', 'key'),)
@@ -5,4 +5,7 @@ from .customer import Customer
 class Order(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.DO_NOTHING,)
     purchased = models.BooleanField(default=False)
-    created_date = models.DateField(default="0000-00-00",)
\ No newline at end of file
+    created_date = models.DateField(default="0000-00-00",)
+    # The day the sales rollups count the order under, null until the
+    # purchase is counted, so it's counted once and stays on its day
+    counted_date = models.DateField(null=True, blank=True,)
@@ -1,8 +1,16 @@
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.utils import timezone
 from .customer import Customer
 
 
+class ProductManager(models.Manager):
+    """Hides soft-deleted products"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class Product(models.Model):
 
     name = models.CharField(max_length=50,)
@@ -17,4 +25,20 @@ class Product(models.Model):
         upload_to='products', height_field=None,
         width_field=None, max_length=None, null=True)
 
-    
\ No newline at end of file
+    # Bumped on every save, read by the delta sync
+    updated_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    # Set by Products.destroy. The purge_product task then removes the
+    # dependent rows and the product itself in the background. Not indexed:
+    # almost every row is NULL, and an index on it would win over updated_at
+    # in the delta query's plan.
+    deleted_at = models.DateTimeField(null=True)
+
+    objects = ProductManager()
+    all_objects = models.Manager()
+
+    def save(self, *args, **kwargs):
+        self.updated_at = timezone.now()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'updated_at'}
+        super().save(*args, **kwargs)
@@ -0,0 +1,17 @@
+from django.db import models
+
+
+class ProductSales(models.Model):
+    """Units sold and revenue of a product over all purchased orders
+
+    Maintained by tipsytequilaapi/sales.py. The (seller, -revenue) index
+    keeps a seller's best sellers first.
+    """
+
+    product = models.OneToOneField("Product", on_delete=models.CASCADE, related_name="sales")
+    seller = models.ForeignKey("Customer", on_delete=models.CASCADE, db_index=False, related_name="+")
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['seller', '-revenue'], name='productsales_seller_rev_idx')]
@@ -0,0 +1,9 @@
+from django.db import models
+from django.utils import timezone
+
+
+class ProductTombstone(models.Model):
+    """Marks a deleted product, so delta sync clients can drop it too"""
+
+    product_id = models.IntegerField(unique=True)
+    deleted_at = models.DateTimeField(default=timezone.now, db_index=True)
@@ -0,0 +1,17 @@
+from django.db import models
+
+
+class SellerDailySales(models.Model):
+    """Units sold and revenue of one seller's products on one day
+
+    Maintained by tipsytequilaapi/sales.py, keyed by the purchased
+    order's date.
+    """
+
+    seller = models.ForeignKey("Customer", on_delete=models.CASCADE, db_index=False, related_name="+")
+    date = models.DateField()
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = (('seller', 'date'),)
@@ -0,0 +1,76 @@
+"""Per-process product cache behind GET /products?ids=
+
+Cart pages, wishlists and recommendation tiles show a handful of known
+products. get_many() fetches them in one request: one id__in query reads
+the requested products' updated_at, with the catalog filters applied, and
+rows cached under the same updated_at are served without reading the
+product again. Only the misses are read, in one more id__in query.
+
+Every product write bumps updated_at, soft deletes included, and deleted
+products are left out by the first query, so a cached row is never served
+after its product changed, whichever worker changed it.
+
+Rows are cached as the compiled ProductSerializer reads them, not as
+serialized dicts, because the image URLs depend on the request's host.
+"""
+import threading
+from django.conf import settings
+from tipsytequilaapi import metrics
+from tipsytequilaapi.compiled import NotCompilable, compile_serializer
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def parse_ids(value):
+    """The distinct product ids in a comma separated list, in order
+
+    Raises ValueError with a message for malformed or too long lists.
+    """
+    try:
+        ids = [int(part) for part in value.split(',')]
+    except ValueError:
+        raise ValueError('ids must be a comma separated list of product ids.') from None
+    if len(ids) > settings.PRODUCT_MULTIGET_MAX:
+        raise ValueError(f'At most {settings.PRODUCT_MULTIGET_MAX} ids can be requested at once.')
+    return list(dict.fromkeys(ids))
+
+
+def get_many(serializer_class, products, ids, request):
+    """Serialized products of the products queryset with these ids
+
+    Products come back in the order of ids. Ids that don't exist or are
+    filtered out are left out.
+    """
+    try:
+        compiled = compile_serializer(serializer_class) if settings.COMPILED_SERIALIZERS else None
+    except NotCompilable:
+        compiled = None
+    if compiled is None:
+        found = products.in_bulk(ids)
+        return serializer_class(
+            [found[pk] for pk in ids if pk in found], many=True, context={'request': request}).data
+
+    stamps = dict(products.filter(pk__in=ids).order_by().values_list('pk', 'updated_at'))
+    rows = {}
+    for pk, updated_at in stamps.items():
+        cached = _cache.get(pk)
+        if cached is not None and cached[0] == updated_at:
+            rows[pk] = cached[1]
+    misses = [pk for pk in stamps if pk not in rows]
+    if rows:
+        metrics.record_cache('products', True, len(rows))
+
+    if misses:
+        metrics.record_cache('products', False, len(misses))
+        fetched = products.model.objects.filter(pk__in=misses).values_list('pk', *compiled.columns)
+        with _cache_lock:
+            if len(_cache) + len(misses) > settings.PRODUCT_CACHE_SIZE:
+                _cache.clear()
+            for pk, *row in fetched:
+                row = tuple(row)
+                # Fetched after its stamp, so the row is never older than it
+                _cache[pk] = (stamps[pk], row)
+                rows[pk] = row
+
+    return compiled.serialize([rows[pk] for pk in ids if pk in rows], request)
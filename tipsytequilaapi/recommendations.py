@@ -0,0 +1,60 @@
+"""Customers who bought this also bought
+
+CoPurchase is the sparse product-by-product co-occurrence matrix of
+purchased orders. rebuild() recomputes all of it from the order history
+with one INSERT ... SELECT, so SQLite does the pairing and counting
+instead of a Python loop over line items. record_purchase() adds one
+order's pairs as it is paid for, and top() reads a product's best K from
+the matrix's sorted index, so a product page never joins order history.
+"""
+from django.db import connection
+from tipsytequilaapi.db.sql import table
+from tipsytequilaapi.models import CoPurchase, Order, OrderProduct
+
+
+def rebuild():
+    """Recompute the matrix from every counted order and return its size
+
+    Call inside a write transaction, readers keep seeing the old matrix
+    until it commits.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table(CoPurchase)}')
+        cursor.execute(
+            f'INSERT INTO {table(CoPurchase)} (product_id, other_id, count) '
+            f'SELECT item.product_id, other.product_id, COUNT(DISTINCT item.order_id) '
+            f'FROM {table(OrderProduct)} item '
+            f'INNER JOIN {table(Order)} purchase ON purchase.id = item.order_id '
+            f'INNER JOIN {table(OrderProduct)} other '
+            f'ON other.order_id = item.order_id AND other.product_id != item.product_id '
+            f'WHERE purchase.counted_date IS NOT NULL '
+            f'GROUP BY item.product_id, other.product_id')
+        return cursor.rowcount
+
+
+def record_purchase(order_id):
+    """Count the product pairs of a just purchased order
+
+    Call in the transaction that sets the order's counted_date. Orders
+    are counted only while that's unset, and their line items can't
+    change once purchased, so each purchase is counted exactly once.
+    """
+    products = set(OrderProduct.objects.filter(order_id=order_id).values_list('product_id', flat=True))
+    pairs = [(product, other) for product in products for other in products if product != other]
+    if not pairs:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {table(CoPurchase)} (product_id, other_id, count) VALUES (%s, %s, 1) '
+            f'ON CONFLICT (product_id, other_id) DO UPDATE SET count = count + 1', pairs)
+
+
+def top(product_id, limit):
+    """The products bought together with product_id most often, best first"""
+    rows = (
+        CoPurchase.objects
+        .filter(product_id=product_id, other__deleted_at__isnull=True)
+        .select_related('other')
+        .order_by('-count', 'other_id')[:limit]
+    )
+    return [row.other for row in rows]
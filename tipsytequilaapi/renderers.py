@@ -0,0 +1,103 @@
+"""JSON renderer and parser backed by orjson when it is installed
+
+orjson encodes the serializers' OrderedDict/ReturnList output directly in
+C, without the per-object Python callbacks of the stdlib encoder. Without
+orjson both classes behave exactly like DRF's JSONRenderer/JSONParser.
+
+Output is byte-identical to DRF's compact renderer. Dates and datetimes are
+passed back to DRF's encoder, because DRF trims datetime microseconds and
+writes UTC as 'Z', and orjson does neither. Anything orjson can't encode,
+such as integers wider than 64 bits, falls back to the stdlib path.
+"""
+import json
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+from rest_framework.utils import json as drf_json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - exercised when orjson is absent
+    orjson = None
+
+_encoder = encoders.JSONEncoder()
+
+
+def _default(obj):
+    return _encoder.default(obj)
+
+
+def _escape_separators(content):
+    # Same \u2028/\u2029 escaping as JSONRenderer, so the output stays a
+    # strict JavaScript subset
+    if b'\xe2\x80\xa8' in content or b'\xe2\x80\xa9' in content:
+        content = content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+    return content
+
+
+def dumps(data):
+    """Encode data to compact JSON bytes, the way FastJSONRenderer does"""
+    if orjson is not None:
+        try:
+            return _escape_separators(orjson.dumps(
+                data, default=_default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS))
+        except orjson.JSONEncodeError:
+            pass
+
+    return json.dumps(
+        data, cls=encoders.JSONEncoder, ensure_ascii=False, separators=(',', ':')
+    ).replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode()
+
+
+def loads(content):
+    """Decode JSON bytes, the way FastJSONParser does for UTF-8 bodies"""
+    if orjson is not None:
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            pass
+    return drf_json.loads(content.decode('utf-8') if isinstance(content, bytes) else content)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer that encodes compact output with orjson"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        # Indented output (e.g. for the browsable API) and non-default
+        # settings go through DRF's own implementation
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if orjson is None or indent is not None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        return dumps(data)
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser that decodes UTF-8 bodies with orjson"""
+
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+
+        content = stream.read() if stream is not None else b''
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            pass
+
+        # orjson rejects NaN/Infinity, which non-strict DRF accepts
+        try:
+            parse_constant = drf_json.strict_constant if self.strict else None
+            return drf_json.loads(content.decode(encoding), parse_constant=parse_constant)
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
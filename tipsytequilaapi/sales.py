@@ -0,0 +1,117 @@
+"""Seller sales rollups behind /customers/:id/sales
+
+ProductSales holds every product's units sold and revenue, SellerDailySales
+every seller's per day. record_purchase() adds an order to both when it is
+paid for, so the dashboard reads a few hundred rollup rows at most, however
+many line items a seller has. rebuild() recomputes them from the order
+history. Both count an order on its counted_date, the day it was purchased
+with, which later changes to its created_date don't move.
+
+Revenue is counted at the product's price when the order is purchased.
+Line items don't keep their price, so a rebuild counts past orders at
+today's prices.
+"""
+import datetime
+from django.db import connection
+from django.db.models import Sum
+from tipsytequilaapi.db.sql import table
+from tipsytequilaapi.models import Order, OrderProduct, Product, ProductSales, SellerDailySales
+
+
+def rebuild(seller_id=None):
+    """Recompute the rollups of one seller, or of all, from counted orders
+
+    Call inside a write transaction. Returns the number of products with sales.
+    """
+    seller_filter, params = ('AND product.customer_id = %s', [seller_id]) if seller_id is not None else ('', [])
+    sold = (
+        f'FROM {table(OrderProduct)} item '
+        f'INNER JOIN {table(Order)} purchase ON purchase.id = item.order_id '
+        f'INNER JOIN {table(Product)} product ON product.id = item.product_id '
+        f'WHERE purchase.counted_date IS NOT NULL {seller_filter}'
+    )
+    with connection.cursor() as cursor:
+        for model in (ProductSales, SellerDailySales):
+            if seller_id is None:
+                cursor.execute(f'DELETE FROM {table(model)}')
+            else:
+                cursor.execute(f'DELETE FROM {table(model)} WHERE seller_id = %s', [seller_id])
+
+        cursor.execute(
+            f'INSERT INTO {table(SellerDailySales)} (seller_id, date, units, revenue) '
+            f'SELECT product.customer_id, purchase.counted_date, COUNT(*), SUM(product.price) {sold} '
+            f'GROUP BY product.customer_id, purchase.counted_date', params)
+        cursor.execute(
+            f'INSERT INTO {table(ProductSales)} (product_id, seller_id, units, revenue) '
+            f'SELECT product.id, product.customer_id, COUNT(*), SUM(product.price) {sold} '
+            f'GROUP BY product.id', params)
+        return cursor.rowcount
+
+
+def record_purchase(order):
+    """Add a just counted order to the rollups
+
+    Orders.update calls it in the write that sets the order's counted_date,
+    so a retried or failed update never counts an order twice or not at all.
+    """
+    products = {}
+    sellers = {}
+    for product, seller, price in OrderProduct.objects.filter(order_id=order.id).values_list(
+            'product_id', 'product__customer_id', 'product__price'):
+        _, units, revenue = products.get(product, (seller, 0, 0.0))
+        products[product] = (seller, units + 1, revenue + price)
+        units, revenue = sellers.get(seller, (0, 0.0))
+        sellers[seller] = (units + 1, revenue + price)
+    if not products:
+        return
+
+    day = connection.ops.adapt_datefield_value(
+        Order._meta.get_field('counted_date').to_python(order.counted_date))
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {table(SellerDailySales)} (seller_id, date, units, revenue) '
+            f'VALUES (%s, %s, %s, %s) ON CONFLICT (seller_id, date) DO UPDATE SET '
+            f'units = units + excluded.units, revenue = revenue + excluded.revenue',
+            [(seller, day, units, revenue) for seller, (units, revenue) in sellers.items()])
+        cursor.executemany(
+            f'INSERT INTO {table(ProductSales)} (product_id, seller_id, units, revenue) '
+            f'VALUES (%s, %s, %s, %s) ON CONFLICT (product_id) DO UPDATE SET '
+            f'seller_id = excluded.seller_id, units = units + excluded.units, '
+            f'revenue = revenue + excluded.revenue',
+            [(product, seller, units, revenue) for product, (seller, units, revenue) in products.items()])
+
+
+def dashboard(seller_id, days, top):
+    """Totals, the top products by revenue and a daily series of a seller
+
+    The series covers the last days days up to today, with zeros for days
+    without sales.
+    """
+    rollups = SellerDailySales.objects.filter(seller_id=seller_id)
+    totals = rollups.aggregate(units=Sum('units'), revenue=Sum('revenue'))
+
+    start = datetime.date.today() - datetime.timedelta(days=days - 1)
+    sold = {
+        day: (units, revenue)
+        for day, units, revenue in rollups.filter(date__gte=start).values_list('date', 'units', 'revenue')
+    }
+    daily = []
+    for offset in range(days):
+        day = start + datetime.timedelta(days=offset)
+        units, revenue = sold.get(day, (0, 0.0))
+        daily.append({'date': day.isoformat(), 'units': units, 'revenue': round(revenue, 2)})
+
+    best = (
+        ProductSales.objects.filter(seller_id=seller_id)
+        .select_related('product').order_by('-revenue')[:top]
+    )
+    return {
+        'seller': seller_id,
+        'units': totals['units'] or 0,
+        'revenue': round(totals['revenue'] or 0, 2),
+        'top_products': [
+            {'id': row.product_id, 'name': row.product.name, 'units': row.units, 'revenue': round(row.revenue, 2)}
+            for row in best
+        ],
+        'daily': daily,
+    }
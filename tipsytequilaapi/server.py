@@ -0,0 +1,379 @@
+"""Pre-forking HTTP server for tipsytequila.wsgi
+
+The master process imports the WSGI application, its middleware and the
+whole URLconf with every view module once, freezes those objects out of
+the garbage collector, and forks the workers. The workers share the
+warmed-up memory copy-on-write, so a worker starts in milliseconds and
+costs little more than its own request state, instead of importing
+Django and the app again.
+
+Every worker opens its own listening socket on the same address with
+SO_REUSEPORT, and the kernel spreads new connections across them. A
+worker is a threaded WSGI server speaking HTTP/1.1 with keep-alive. It
+retires itself after max_requests requests, plus a random jitter so the
+workers don't all restart at once, or when its resident memory passes
+max_rss. The master then forks a replacement, and the old worker keeps
+serving until the replacement listens, so recycling never leaves the port
+without a listener.
+
+Signals to the master:
+    TERM, INT -- stop. Workers stop accepting, finish the requests they
+                 have and exit, and are killed after graceful_timeout.
+    HUP -- graceful reload. The master re-executes itself, so the new
+           code is imported, then forks new workers and retires the old
+           ones once the new ones listen. The port is never closed.
+
+Workers tell the master over a pipe when they listen and when they want to
+be replaced. Connections already in a retiring worker's accept queue are
+still served, but one arriving in the instant before its socket closes
+can be dropped.
+"""
+import gc
+import os
+import random
+import resource
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.db import connections
+from django.urls import get_resolver
+
+# Pids of the previous image's workers across a graceful reload
+OLD_WORKERS_ENV = 'TIPSYTEQUILA_SERVE_OLD_WORKERS'
+
+# Held back from a new worker until it can handle them
+SIGNALS = {signal.SIGTERM, signal.SIGINT, signal.SIGHUP}
+
+# A worker dying sooner than this is restarted after the same delay, so a
+# broken deployment doesn't fork in a tight loop
+MIN_WORKER_LIFETIME = 1.0
+
+
+def load_application():
+    """Import the WSGI application and everything its requests import"""
+    from tipsytequila.wsgi import application  # pylint: disable=import-outside-toplevel
+    # Imports the URLconf, and with it every view module and serializer
+    get_resolver().url_patterns
+    return application
+
+
+def resident_memory():
+    """Resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # Peak rather than current size, in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RequestHandler(WSGIRequestHandler):
+    """Django's request handler, quiet about idle keep-alive connections"""
+
+    def handle_one_request(self):
+        try:
+            super().handle_one_request()
+        except socket.timeout:
+            # The client kept the connection open but sent nothing
+            self.close_connection = True
+            return
+        if self.server.stopping:
+            self.close_connection = True
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        if self.server.access_log:
+            super().log_message(format, *args)
+
+
+class WorkerServer(ThreadedWSGIServer):
+    """A threaded WSGI server on its own SO_REUSEPORT socket"""
+
+    # Connection threads are joined on close, so a stopping worker finishes
+    # its requests before exiting
+    daemon_threads = False
+    block_on_close = True
+
+    def __init__(self, worker, address, backlog, keep_alive, access_log):
+        self.worker = worker
+        self.request_queue_size = backlog
+        self.stopping = False
+        self.access_log = access_log
+        handler = type('Handler', (RequestHandler,), {'timeout': keep_alive})
+        super().__init__(address, handler, ipv6=':' in address[0])
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def service_actions(self):
+        self.worker.check_master()
+
+    def drain(self):
+        """Serve the connections already waiting in the accept queue"""
+        self.socket.settimeout(0)
+        while True:
+            try:
+                request, client_address = self.get_request()
+            except OSError:
+                return
+            self.process_request(request, client_address)
+
+
+class Worker:
+    """One forked worker process"""
+
+    def __init__(self, application, address, options, master_fd, stdout):
+        self.application = application
+        self.address = address
+        self.options = options
+        self.master_fd = master_fd
+        self.stdout = stdout
+        self.server = None
+        self.requests = 0
+        self.master_pid = os.getppid()
+        self.max_requests = options['max_requests'] and (
+            options['max_requests'] + random.randint(0, options['max_requests_jitter']))
+        self.recycling = False
+        self._lock = threading.Lock()
+        self._stop_reason = None
+
+    def run(self):
+        self.server = WorkerServer(
+            self, self.address, self.options['backlog'], self.options['keep_alive'], self.options['access_log'])
+        self.server.set_app(self.serve)
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop(self.recycling or 'shutting down'))
+        signal.signal(signal.SIGHUP, lambda signum, frame: self.stop(self.recycling or 'shutting down'))
+        # Ctrl-C reaches the whole process group, the master stops the workers
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        # Blocked by the master since the fork, a stop sent meanwhile lands now
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, SIGNALS)
+        self.tell_master('ready')
+
+        self.server.serve_forever(poll_interval=0.5)
+        self.server.drain()
+        self.server.server_close()
+        self.stdout.write(f'Worker {os.getpid()} exited, {self._stop_reason}')
+        self.stdout.flush()
+
+    def serve(self, environ, start_response):
+        try:
+            return self.application(environ, start_response)
+        finally:
+            self._count()
+
+    def _count(self):
+        with self._lock:
+            self.requests += 1
+            requests = self.requests
+            if self.recycling:
+                return
+            if self.max_requests and requests >= self.max_requests:
+                self.recycling = f'recycled after {requests} requests'
+            elif self.options['max_rss'] and resident_memory() > self.options['max_rss']:
+                self.recycling = f'recycled at {resident_memory() >> 20}MB resident'
+            else:
+                return
+        # Served on until the master's replacement listens and it stops this one
+        self.tell_master('retire')
+
+    def check_master(self):
+        """Stop if the master died without stopping this worker"""
+        if os.getppid() != self.master_pid:
+            self.stop('master is gone')
+
+    def tell_master(self, message):
+        # Shorter than PIPE_BUF, so messages of different workers don't mix
+        try:
+            os.write(self.master_fd, f'{message} {os.getpid()}\n'.encode())
+        except BrokenPipeError:
+            # The master is gone, check_master() stops this worker
+            pass
+
+    def stop(self, reason):
+        """Stop accepting and exit once the open requests are done"""
+        with self._lock:
+            if self._stop_reason is not None:
+                return
+            self._stop_reason = reason
+        self.server.stopping = True
+        # shutdown() waits for serve_forever(), which may be on this thread
+        threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+
+class Master:
+    """Forks, watches and replaces the workers"""
+
+    def __init__(self, address, options, stdout):
+        self.address = address
+        self.options = options
+        self.stdout = stdout
+        self.application = None
+        self.workers = {}
+        self.starting = set()
+        # Replacement worker pid -> pid of the worker it replaces
+        self.replacing = {}
+        self.retiring = {}
+        self.stopping = False
+        self.reloading = False
+        self.messages_r, self.messages_w = os.pipe()
+        self._buffer = b''
+
+    def log(self, message):
+        self.stdout.write(message)
+        self.stdout.flush()
+
+    def check_address(self):
+        """Raise OSError now if the workers won't be able to listen"""
+        family = socket.AF_INET6 if ':' in self.address[0] else socket.AF_INET
+        with socket.socket(family, socket.SOCK_STREAM) as probe:
+            probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            probe.bind(self.address)
+
+    def run(self):
+        self.application = load_application()
+        # Forked workers must not share the master's connections
+        connections.close_all()
+        # Objects the collector never visits keep their pages shared
+        gc.collect()
+        gc.freeze()
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGHUP, self._reload)
+        # Blocked across a reload's exec, so signals sent while it imported wait for the handlers
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, SIGNALS)
+
+        old_workers = [int(pid) for pid in os.environ.pop(OLD_WORKERS_ENV, '').split(',') if pid]
+        self.log(f'Master {os.getpid()} serving on http://{self.address[0]}:{self.address[1]} '
+                 f'with {self.options["workers"]} workers')
+        for _ in range(self.options['workers']):
+            self._spawn()
+        if old_workers:
+            deadline = time.monotonic() + self.options['graceful_timeout']
+            while self.starting and not self.stopping and time.monotonic() < deadline:
+                self._reap()
+                self._read_messages(0.5)
+            self._retire(old_workers)
+
+        while not self.stopping and not self.reloading:
+            self._reap()
+            while len(self.workers) - len(self.replacing) < self.options['workers'] and not self.stopping:
+                self._spawn()
+            self._read_messages(0.5)
+
+        if self.reloading:
+            self._exec()
+        self._retire(list(self.workers))
+        while self.retiring:
+            self._reap()
+            time.sleep(0.1)
+        self.log(f'Master {os.getpid()} stopped')
+
+    def _spawn(self):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        signal.pthread_sigmask(signal.SIG_BLOCK, SIGNALS)
+        pid = os.fork()
+        if pid:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, SIGNALS)
+            self.workers[pid] = time.monotonic()
+            self.starting.add(pid)
+            return pid
+
+        status = 0
+        try:
+            os.close(self.messages_r)
+            Worker(self.application, self.address, self.options, self.messages_w, self.stdout).run()
+        except BaseException:  # pylint: disable=broad-except
+            import traceback  # pylint: disable=import-outside-toplevel
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            # Skip the master's atexit handlers and buffered output
+            os._exit(status)  # pylint: disable=protected-access
+
+    def _read_messages(self, timeout):
+        """Handle what the workers tell, waiting up to timeout seconds"""
+        readable, _, _ = select.select([self.messages_r], [], [], timeout)
+        if not readable:
+            return
+        *lines, self._buffer = (self._buffer + os.read(self.messages_r, 4096)).split(b'\n')
+        for line in lines:
+            message, pid = line.decode().split()
+            pid = int(pid)
+            if message == 'ready':
+                self.starting.discard(pid)
+                if pid in self.replacing:
+                    self._retire([self.replacing.pop(pid)])
+            elif message == 'retire' and pid in self.workers and pid not in self.replacing.values():
+                if not self.stopping and not self.reloading:
+                    self.replacing[self._spawn()] = pid
+
+    def _retire(self, pids):
+        """Ask workers to finish their requests and exit"""
+        deadline = time.monotonic() + self.options['graceful_timeout']
+        for pid in pids:
+            self.workers.pop(pid, None)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                continue
+            self.retiring[pid] = deadline
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if not pid:
+                break
+            self.retiring.pop(pid, None)
+            self.starting.discard(pid)
+            if pid in self.replacing:
+                # The replacement failed, the respawn makes a new one
+                self._retire([self.replacing.pop(pid)])
+            started = self.workers.pop(pid, None)
+            if started is not None and not self.stopping:
+                code = os.waitstatus_to_exitcode(status)
+                if code:
+                    self.log(f'Worker {pid} exited with {code}')
+                if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                    time.sleep(MIN_WORKER_LIFETIME)
+
+        now = time.monotonic()
+        for pid, deadline in list(self.retiring.items()):
+            if now > deadline:
+                self.log(f'Worker {pid} still busy after {self.options["graceful_timeout"]}s, killing it')
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                self.retiring[pid] = now + 5
+
+    def _exec(self):
+        """Replace this process with a fresh import of the code
+
+        The workers are left serving until the new image's workers listen.
+        They stay this pid's children, so the new image reaps them.
+        """
+        self.log(f'Master {os.getpid()} reloading')
+        os.environ[OLD_WORKERS_ENV] = ','.join(str(pid) for pid in [*self.workers, *self.retiring])
+        sys.stdout.flush()
+        sys.stderr.flush()
+        signal.pthread_sigmask(signal.SIG_BLOCK, SIGNALS)
+        os.execv(sys.executable, [sys.executable, *sys.argv])
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+
+    def _reload(self, signum, frame):
+        self.reloading = True
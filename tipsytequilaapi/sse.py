@@ -0,0 +1,164 @@
+"""Server-sent event stream of cart and stock changes
+
+A plain ASGI app mounted at /events by tipsytequila/asgi.py. Django 3.2 can't
+stream from async views, and an idle connection here is one coroutine and
+one queue, with no thread held. The client authenticates with the usual
+Authorization header or, since EventSource can't set headers, ?token=.
+
+The stream follows the customer's topic, where cart changes arrive, and the
+topic of every product in the open order. It sends:
+
+    event: ready  -- data: {"order": 5, "products": [3, 8]}, once
+    event: cart   -- data: {"type": "cart", "order": 5, "product": 3, "operation": "add"}
+    event: stock  -- data: {"type": "stock", "product": 3, "quantity": 12}
+
+Cart operations are add and remove for line items, open for a new cart
+and purchase when the open order is paid for.
+
+and a comment line every SSE_HEARTBEAT_SECONDS to keep proxies from closing
+it. Clients should reload the cart when they reconnect, since events sent
+while they were away are not replayed.
+"""
+import asyncio
+import collections
+import json
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.authtoken.models import Token
+from tipsytequilaapi.events import get_broker
+from tipsytequilaapi.models import Customer, Order, OrderProduct
+
+
+@sync_to_async
+def _load_cart(key):
+    """(customer id, open order id, product id counts) for a token key"""
+    try:
+        token = Token.objects.select_related('user__customer').get(key=key)
+        customer = token.user.customer
+    except (Token.DoesNotExist, Customer.DoesNotExist):
+        return None
+    if not token.user.is_active:
+        return None
+
+    order = Order.objects.filter(customer=customer, purchased=False).first()
+    products = collections.Counter(
+        OrderProduct.objects.filter(order=order).values_list('product_id', flat=True)
+    ) if order is not None else collections.Counter()
+    return customer.id, order.id if order is not None else None, products
+
+
+def _token_key(scope):
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            parts = value.decode('latin-1').split()
+            if len(parts) == 2 and parts[0].lower() == 'token':
+                return parts[1]
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    return query.get('token', [None])[0]
+
+
+async def _respond(send, status_code, message):
+    await send({
+        'type': 'http.response.start',
+        'status': status_code,
+        'headers': [(b'content-type', b'application/json')],
+    })
+    await send({'type': 'http.response.body', 'body': json.dumps({'message': message}).encode()})
+
+
+def _event(name, data):
+    return f'event: {name}\ndata: {json.dumps(data)}\n\n'.encode()
+
+
+class EventStream:
+    """ASGI app streaming cart and stock events to one customer"""
+
+    async def __call__(self, scope, receive, send):
+        if scope['method'] != 'GET':
+            await _respond(send, 405, 'Method not allowed.')
+            return
+
+        key = _token_key(scope)
+        cart = await _load_cart(key) if key else None
+        if cart is None:
+            await _respond(send, 401, 'Invalid or missing token.')
+            return
+        customer_id, order_id, products = cart
+        cart = {'order': order_id, 'products': products}
+
+        subscription = get_broker().subscribe(
+            [f'customer:{customer_id}'] + [f'product:{product_id}' for product_id in products])
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream'),
+                    (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no'),
+                ],
+            })
+            await send({
+                'type': 'http.response.body',
+                'body': _event('ready', {'order': order_id, 'products': sorted(products)}),
+                'more_body': True,
+            })
+            await self._stream(subscription, cart, receive, send)
+        finally:
+            subscription.close()
+
+    async def _stream(self, subscription, cart, receive, send):
+        disconnect = asyncio.ensure_future(receive())
+        get = None
+        try:
+            while True:
+                get = get or asyncio.ensure_future(subscription.queue.get())
+                done, _ = await asyncio.wait(
+                    {disconnect, get}, timeout=settings.SSE_HEARTBEAT_SECONDS,
+                    return_when=asyncio.FIRST_COMPLETED)
+
+                if disconnect in done:
+                    return
+                if get not in done:
+                    await send({'type': 'http.response.body', 'body': b': ping\n\n', 'more_body': True})
+                    continue
+
+                _, event = get.result()
+                get = None
+                if event['type'] == 'cart':
+                    self._track(subscription, cart, event)
+                await send({'type': 'http.response.body', 'body': _event(event['type'], event), 'more_body': True})
+
+                if subscription.overflowed:
+                    # Too far behind, the client reconnects and reloads
+                    await send({'type': 'http.response.body', 'body': b''})
+                    return
+        finally:
+            for task in (disconnect, get):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    @staticmethod
+    def _track(subscription, cart, event):
+        """Follow the stock of products while they are in the open order"""
+        products = cart['products']
+        product_id = event.get('product')
+        if event['operation'] == 'open':
+            cart['order'] = event['order']
+        elif event['order'] != cart['order']:
+            return
+        elif event['operation'] == 'add':
+            if not products[product_id]:
+                subscription.follow(f'product:{product_id}')
+            products[product_id] += 1
+        elif event['operation'] == 'remove' and products[product_id]:
+            products[product_id] -= 1
+            if not products[product_id]:
+                del products[product_id]
+                subscription.unfollow(f'product:{product_id}')
+        elif event['operation'] == 'purchase':
+            for product_id in list(products):
+                subscription.unfollow(f'product:{product_id}')
+            products.clear()
+            cart['order'] = None
@@ -0,0 +1,97 @@
+"""Background tasks run by manage.py runworker"""
+import io
+from django.conf import settings
+from PIL import Image
+from tipsytequilaapi.db.sqlite import retry_on_locked
+from tipsytequilaapi.events import publish_cart
+from tipsytequilaapi.jobs import task
+from tipsytequilaapi.models import (Change, OrderProduct, Product, ProductRating,
+                                    ProductReview, Rating, Review)
+
+
+@task(max_attempts=3)
+def optimize_product_image(product_id):
+    """Shrink an uploaded product image to PRODUCT_IMAGE_MAX_SIZE in place
+
+    Images that are already small enough are left alone, so running it
+    twice is harmless.
+    """
+    product = Product.objects.filter(pk=product_id).first()
+    if product is None or not product.image_path:
+        return
+
+    storage = product.image_path.storage
+    with storage.open(product.image_path.name, 'rb') as image_file:
+        image = Image.open(image_file)
+        image.load()
+
+    limit = settings.PRODUCT_IMAGE_MAX_SIZE
+    if image.width <= limit and image.height <= limit:
+        return
+
+    image_format = image.format
+    image.thumbnail((limit, limit))
+    content = io.BytesIO()
+    image.save(content, format=image_format, optimize=True)
+    with storage.open(product.image_path.name, 'wb') as image_file:
+        image_file.write(content.getvalue())
+
+
+@retry_on_locked
+def _purge_cart_items(product_id, batch_size):
+    """Delete one batch of a product's line items in open carts"""
+    rows = list(
+        OrderProduct.objects.filter(product_id=product_id, order__purchased=False)
+        .values_list('id', 'order_id', 'order__customer_id')[:batch_size])
+    ids = [line_id for line_id, _, _ in rows]
+    OrderProduct.objects.filter(id__in=ids).delete()
+    Change.record_many(OrderProduct, ids, Change.DELETE,
+                       owners={line_id: customer_id for line_id, _, customer_id in rows})
+    for _, order_id, customer_id in rows:
+        publish_cart(customer_id, order_id, product_id, 'remove')
+    return len(rows)
+
+
+@retry_on_locked
+def _purge_attached(link_model, model, field, product_id, batch_size):
+    """Delete one batch of a product's ratings or reviews with their links"""
+    links = list(
+        link_model.objects.filter(product_id=product_id)
+        .values_list('id', f'{field}_id')[:batch_size])
+    ids = [target_id for _, target_id in links]
+    link_model.objects.filter(id__in=[link_id for link_id, _ in links]).delete()
+    model.objects.filter(id__in=ids).delete()
+    Change.record_many(model, ids, Change.DELETE)
+    return len(links)
+
+
+@retry_on_locked
+def _delete_product(product_id):
+    # Purchased orders keep their line items, and with them the product row
+    if OrderProduct.objects.filter(product_id=product_id).exists():
+        return False
+    Product.all_objects.filter(pk=product_id).delete()
+    return True
+
+
+@task(timeout=900)
+def purge_product(product_id):
+    """Remove a soft-deleted product's dependents in PRODUCT_PURGE_BATCH_SIZE chunks
+
+    Each chunk is its own short transaction, so a seller removing a large
+    catalog never holds SQLite's write lock for long. Line items in open
+    carts, ratings and reviews are deleted. The product row goes last,
+    unless purchased orders still refer to it, in which case it stays
+    soft-deleted as part of the order history.
+    """
+    if not Product.all_objects.filter(pk=product_id, deleted_at__isnull=False).exists():
+        return
+
+    batch_size = settings.PRODUCT_PURGE_BATCH_SIZE
+    while _purge_cart_items(product_id, batch_size) == batch_size:
+        pass
+    while _purge_attached(ProductRating, Rating, 'rating', product_id, batch_size) == batch_size:
+        pass
+    while _purge_attached(ProductReview, Review, 'review', product_id, batch_size) == batch_size:
+        pass
+    _delete_product(product_id)
@@ -1,3 +1,952 @@
-from django.test import TestCase
+"""Regression tests for the hot read endpoints
 
-# Create your tests here.
+QueryPlanTests requests each router endpoint against a seeded, mid-sized
+dataset, runs EXPLAIN QUERY PLAN on every SELECT the request issued, and
+fails when a plan scans one of our tables it should search by index, sorts
+through a temporary B-tree, or the endpoint issues more queries than its
+ceiling. A failure prints the offending SQL with its plan.
+
+CompiledSerializerTests renders the compiled serializers' output next to
+the DRF serializers' and requires the same bytes, ProductCacheTests
+checks that /products?ids= never serves a product that has changed,
+IdempotencyTests that a retried create runs once, and AsyncMiddlewareTests
+that our middleware doesn't force ASGI requests into sync mode.
+BulkloadTests load fixtures, AdmissionControlTests check that requests
+over a view's limit are shed, PurchaseRollupTests that checkouts keep
+the sales and co-purchase rollups equal to a rebuild, ProductPurgeTests
+that deleting a product is atomic and its purge removes every dependent,
+DeltaSyncTests that /products/delta tokens never skip a change,
+AsyncReadTests that the async read views answer like the ViewSets,
+ChangeFeedTests that /changes pages through the log a customer may see,
+and MetricsAccessTests that /metrics is for staff and allowed scrapers.
+BatchTests, JobQueueTests, EventStreamTests, FacetTests and
+PreforkServerTests run the batch endpoint, the job queue, the /events
+stream, the catalog facets and the serve command against their contracts.
+"""
+import asyncio
+import datetime
+import io
+import logging
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import urllib.error
+import urllib.request
+from unittest import mock
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from tipsytequilaapi import jobs, recommendations, sales, tasks
+from tipsytequilaapi.compiled import NotCompilable, compile_serializer, serialize, serialize_one
+from tipsytequilaapi.events import publish_stock
+from tipsytequilaapi.facets import facet_counts
+from tipsytequilaapi.middleware import admission
+from tipsytequilaapi.middleware.admission import get_limiter
+from tipsytequilaapi.models import (CoPurchase, Customer, IdempotencyKey, Job, Order, OrderProduct, Product,
+                                    ProductRating, ProductReview, ProductSales, ProductTombstone, Rating, Review,
+                                    SellerDailySales)
+from tipsytequilaapi.renderers import dumps
+from tipsytequilaapi.sse import EventStream
+from tipsytequilaapi.views.customer import CustomerSerializer
+from tipsytequilaapi.views import async_read
+from tipsytequilaapi.views.order import Orders, OrderSerializer
+from tipsytequilaapi.views.order_product import OrderProductSerializer
+from tipsytequilaapi.views.product import ProductSerializer
+from tipsytequilaapi.views.rating import RatingSerializer
+from tipsytequilaapi.views.review import ReviewSerializer
+from tipsytequilaapi.views.user import UserSerializer
+
+APP_TABLE = 'tipsytequilaapi_'
+FULL_SCAN = re.compile(r'^SCAN (\w+)')
+
+
+class Case:
+    """An endpoint and what its queries may cost
+
+    Arguments:
+        path -- formatted with the ids picked from the seeded data
+        max_queries -- ceiling on queries for one request, auth included
+        scans -- our tables the endpoint may read in full, because
+                 listing every row is what it is for
+        indexes -- index name prefixes some plan must search with
+        groups -- the endpoint groups rows by computed values, which
+                  SQLite can only do through a temporary B-tree
+    """
+
+    def __init__(self, path, max_queries, scans=(), indexes=(), groups=False):
+        self.path = path
+        self.max_queries = max_queries
+        self.scans = {APP_TABLE + table for table in scans}
+        self.indexes = indexes
+        self.groups = groups
+
+
+CASES = (
+    Case('/products', 2, scans=['product']),
+    Case('/products/{product}', 2),
+    Case('/products?ids={product},{recommended}', 3),
+    Case('/products/delta?since={recent}', 3, indexes=[
+        'tipsytequilaapi_product_updated_at', 'tipsytequilaapi_producttombstone_deleted_at']),
+    Case('/products/{product}/recommendations', 3, indexes=['copurchase_product_count_idx']),
+    Case('/products/facets?in_stock=true', 5, scans=['product'],
+         indexes=['tipsytequilaapi_productrating_product_id'], groups=True),
+    Case('/customers', 5, scans=['customer']),
+    Case('/customers/{seller}/sales?days=90', 5, indexes=[
+        'tipsytequilaapi_sellerdailysales_seller_id_date_40729f3b_uniq', 'productsales_seller_rev_idx']),
+    Case('/users', 2),
+    Case('/users/{user}', 2),
+    Case('/orders', 5, indexes=['tipsytequilaapi_order_customer_id', 'tipsytequilaapi_orderproduct_order_id']),
+    Case('/orders/{order}', 5, indexes=['tipsytequilaapi_orderproduct_order_id']),
+    Case('/ratings', 2, scans=['rating']),
+    Case('/ratings?item={product}', 2, indexes=['tipsytequilaapi_productrating_product_id']),
+    Case('/ratings/{rating}', 2),
+    Case('/reviews', 2, scans=['review']),
+    Case('/reviews?item={product}', 2, indexes=['tipsytequilaapi_productreview_product_id']),
+    Case('/reviews/{review}', 2),
+    Case('/orderproducts', 2, scans=['orderproduct']),
+    Case('/orderproducts?order={order}', 2, indexes=['tipsytequilaapi_orderproduct_order_id']),
+    Case('/orderproducts/{line_item}', 2),
+    Case('/changes?since=0', 2),
+)
+
+
+class QueryPlanTests(TestCase):
+    """EXPLAIN QUERY PLAN checks for every GET endpoint of the router"""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_data', customers=100, products=500, orders=1000, line_items=5000,
+            ratings=2500, reviews=1000, stdout=io.StringIO())
+        call_command('rebuild_recommendations', stdout=io.StringIO())
+        call_command('rebuild_sales', stdout=io.StringIO())
+
+        line_item = OrderProduct.objects.select_related('order__customer').first()
+        customer = line_item.order.customer
+        product = line_item.product_id
+        cls.token = Token.objects.get(user_id=customer.user_id).key
+        cls.ids = {
+            'product': product,
+            'recommended': Product.objects.exclude(pk=product).values_list('pk', flat=True).first(),
+            'user': customer.user_id,
+            'seller': customer.id,
+            'order': line_item.order_id,
+            'line_item': line_item.pk,
+            'rating': Rating.objects.values_list('pk', flat=True).first(),
+            'review': Review.objects.values_list('pk', flat=True).first(),
+            'recent': int((timezone.now() - datetime.timedelta(hours=1)).timestamp() * 1e6),
+        }
+
+    def capture(self, path):
+        """Status code and captured queries of an authenticated GET"""
+        # The log is a bounded deque, so a full one would hide new queries
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, HTTP_AUTHORIZATION=f'Token {self.token}')
+        return response.status_code, queries.captured_queries
+
+    @staticmethod
+    def explain(sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[3] for row in cursor.fetchall()]
+
+    def test_query_plans(self):
+        for case in CASES:
+            path = case.path.format(**self.ids)
+            with self.subTest(path=path):
+                status_code, queries = self.capture(path)
+                self.assertEqual(status_code, 200)
+                self.assertLessEqual(
+                    len(queries), case.max_queries,
+                    f'{path} ran {len(queries)} queries:\n' + '\n'.join(q['sql'] for q in queries))
+
+                searched = []
+                for sql in dict.fromkeys(q['sql'] for q in queries if q['sql'].startswith('SELECT')):
+                    plan = self.explain(sql)
+                    searched.extend(plan)
+                    report = f'{sql}\n  ' + '\n  '.join(plan)
+                    if not any(APP_TABLE in step for step in plan):
+                        # Django's own tables, like the ordered auth_permission
+                        # prefetch of /customers, are not ours to tune
+                        continue
+
+                    for step in plan:
+                        scan = FULL_SCAN.match(step)
+                        if scan and scan.group(1).startswith(APP_TABLE):
+                            self.assertIn(scan.group(1), case.scans, f'Full scan in {path}:\n{report}')
+                        if not (case.groups and step == 'USE TEMP B-TREE FOR GROUP BY'):
+                            self.assertNotIn('TEMP B-TREE', step, f'Temporary sort in {path}:\n{report}')
+
+                for index in case.indexes:
+                    self.assertTrue(
+                        any(f'INDEX {index}' in step for step in searched),
+                        f'{path} did not use {index}:\n  ' + '\n  '.join(searched))
+
+
+class CompiledSerializerTests(TestCase):
+    """The compiled serializers render the same bytes as the DRF ones"""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_data', customers=20, products=100, orders=100, line_items=400,
+            ratings=200, reviews=100, stdout=io.StringIO())
+        # What generate_data leaves out: stored images, line items of a
+        # deleted product, an order without line items and text that
+        # needs escaping
+        Product.objects.filter(pk__in=Product.objects.values('pk')[:3]).update(image_path='products/kite 1.png')
+        Product.objects.filter(pk=OrderProduct.objects.values('product')[:1]).update(deleted_at=timezone.now())
+        Order.objects.create(customer=Customer.objects.first(), purchased=False, created_date='2019-10-23')
+        User.objects.filter(pk=User.objects.values('pk')[:1]).update(first_name='Zoë\u2028')
+
+    def setUp(self):
+        self.request = Request(APIRequestFactory().get('/'))
+
+    def querysets(self):
+        return (
+            (ProductSerializer, Product.objects.all()),
+            (OrderSerializer, Order.objects.prefetch_related('lineitems__product')),
+            (CustomerSerializer, Customer.objects.select_related('user').prefetch_related(
+                'user__groups', 'user__user_permissions')),
+            (UserSerializer, User.objects.all()),
+            (RatingSerializer, Rating.objects.all()),
+            (ReviewSerializer, Review.objects.all()),
+            (OrderProductSerializer, OrderProduct.objects.select_related('order__customer', 'product__customer')),
+        )
+
+    def test_lists(self):
+        for serializer_class, queryset in self.querysets():
+            with self.subTest(serializer=serializer_class.__name__):
+                expected = serializer_class(queryset, many=True, context={'request': self.request}).data
+                compiled = compile_serializer(serializer_class)
+                self.assertEqual(dumps(compiled.serialize(compiled.rows(queryset), self.request)), dumps(expected))
+
+    def test_details(self):
+        for serializer_class, queryset in self.querysets():
+            with self.subTest(serializer=serializer_class.__name__):
+                pk = queryset.model.objects.values_list('pk', flat=True).last()
+                expected = serializer_class(queryset.get(pk=pk), context={'request': self.request}).data
+                data = serialize_one(serializer_class, queryset, self.request, pk=pk)
+                self.assertEqual(dumps(data), dumps(expected))
+                with self.assertRaises(queryset.model.DoesNotExist):
+                    serialize_one(serializer_class, queryset, self.request, pk=-1)
+
+    def test_fallback(self):
+        class NamedProductSerializer(serializers.ModelSerializer):
+            label = serializers.SerializerMethodField()
+
+            class Meta:
+                model = Product
+                fields = ('id', 'label')
+
+            def get_label(self, product):
+                return product.name.upper()
+
+        with self.assertRaises(NotCompilable):
+            compile_serializer(NamedProductSerializer)
+        products = Product.objects.all()
+        expected = NamedProductSerializer(products, many=True, context={'request': self.request}).data
+        self.assertEqual(dumps(serialize(NamedProductSerializer, products, self.request)), dumps(expected))
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=1.0)
+    def test_timed(self):
+        response = self.client.get('/products')
+        self.assertGreater(response.wsgi_request.timing.serialize_time, 0)
+        self.assertIn('serialize;dur=', response['Server-Timing'])
+
+
+class ProductCacheTests(TestCase):
+    """GET /products?ids= from the per-process product cache"""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_data', customers=10, products=20, orders=10, line_items=20,
+            ratings=0, reviews=0, stdout=io.StringIO())
+        cls.ids = list(Product.objects.values_list('pk', flat=True)[:5])
+
+    def get_ids(self, ids, **params):
+        params['ids'] = ','.join(map(str, ids))
+        response = self.client.get('/products', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_order_and_invalidation(self):
+        ids = [self.ids[3], self.ids[0], -1, self.ids[3], self.ids[1]]
+        self.assertEqual([product['id'] for product in self.get_ids(ids)], [self.ids[3], self.ids[0], self.ids[1]])
+
+        with self.assertNumQueries(1):
+            cached = self.get_ids(ids)
+        product = Product.objects.get(pk=self.ids[0])
+        product.name = 'Renamed'
+        product.save()
+        product = Product.objects.get(pk=self.ids[1])
+        product.deleted_at = timezone.now()
+        product.save()
+        with self.assertNumQueries(2):
+            fresh = self.get_ids(ids)
+        self.assertEqual([product['name'] for product in fresh], [cached[0]['name'], 'Renamed'])
+
+    def test_filters_and_validation(self):
+        Product.objects.filter(pk=self.ids[2]).update(quantity=0)
+        self.assertEqual([product['id'] for product in self.get_ids(self.ids, in_stock='false')], [self.ids[2]])
+        for ids in ('', '1,x', ','.join(['1'] * 101)):
+            with self.subTest(ids=ids):
+                self.assertEqual(self.client.get(f'/products?ids={ids}').status_code, 400)
+
+
+class IdempotencyTests(TestCase):
+    """Retried creates sent with an Idempotency-Key run once"""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_data', customers=5, products=5, orders=0, line_items=0,
+            ratings=0, reviews=0, stdout=io.StringIO())
+        cls.product = Product.objects.values_list('pk', flat=True).first()
+        cls.token = Token.objects.values_list('key', flat=True).first()
+
+    def post(self, path, body, key=None):
+        headers = {'HTTP_AUTHORIZATION': f'Token {self.token}'}
+        if key is not None:
+            headers['HTTP_IDEMPOTENCY_KEY'] = key
+        return self.client.post(path, body, content_type='application/json', **headers)
+
+    def test_replay(self):
+        body = {'productId': self.product, 'score': 4}
+        first = self.post('/ratings', body, key='k1')
+        self.assertEqual(first.status_code, 201)
+        replayed = self.post('/ratings', body, key='k1')
+        self.assertEqual(replayed.status_code, 201)
+        self.assertEqual(replayed['Idempotent-Replayed'], 'true')
+        self.assertEqual(replayed.json(), first.json())
+        self.assertEqual(Rating.objects.count(), 1)
+
+        self.assertEqual(self.post('/ratings', body, key='k2').status_code, 201)
+        self.assertEqual(Rating.objects.count(), 2)
+
+    def test_different_body(self):
+        self.assertEqual(self.post('/ratings', {'productId': self.product, 'score': 4}, key='k1').status_code, 201)
+        response = self.post('/ratings', {'productId': self.product, 'score': 5}, key='k1')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Rating.objects.count(), 1)
+
+    def test_batch(self):
+        body = {'productId': self.product, 'score': 4}
+        requests = [{'method': 'POST', 'path': '/ratings', 'body': body} for _ in range(2)]
+        response = self.post('/batch', {'requests': requests}, key='k1')
+        self.assertEqual([item['status'] for item in response.json()], [201, 201])
+        self.assertEqual(Rating.objects.count(), 2)
+
+        requests = [{**request, 'idempotency_key': 'k2'} for request in requests]
+        response = self.post('/batch', {'requests': requests})
+        self.assertEqual([item['status'] for item in response.json()], [201, 201])
+        self.assertEqual(Rating.objects.count(), 3)
+
+    def test_register_not_stored(self):
+        body = {
+            'username': 'kite', 'email': 'kite@example.com', 'password': 'secret', 'first_name': 'Kite',
+            'last_name': 'Flyer', 'phone_number': '555-0100', 'address': '1 Hill Road',
+        }
+        response = self.client.post('/register', body, content_type='application/json', HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class AsyncMiddlewareTests(TestCase):
+    """Our middleware keeps the ASGI chain async"""
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=1.0)
+    def test_async_chain(self):
+        # Django reports each sync middleware it adapts, in DEBUG only
+        with self.settings(DEBUG=True), self.assertLogs('django.request', 'DEBUG') as logs:
+            handler = ASGIHandler()
+            logging.getLogger('django.request').debug('Loaded')
+        self.assertEqual(logs.output, ['DEBUG:django.request:Loaded'])
+        self.assertTrue(asyncio.iscoroutinefunction(handler._middleware_chain))
+
+        call_command('generate_data', customers=2, products=2, orders=0, line_items=0,
+                     ratings=0, reviews=0, stdout=io.StringIO())
+        response = async_to_sync(AsyncClient().get)('/products')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+
+
+class BulkloadTests(TestCase):
+    """bulkload finds and loads fixtures like loaddata"""
+
+    def test_label_named_like_a_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            os.mkdir(os.path.join(directory, 'products'))
+            cwd = os.getcwd()
+            os.chdir(directory)
+            try:
+                call_command('bulkload', 'users', 'tokens', 'customers', 'products', stdout=io.StringIO())
+            finally:
+                os.chdir(cwd)
+        self.assertTrue(Product.objects.exists())
+        self.assertEqual(Token.objects.count(), User.objects.count())
+
+
+@override_settings(ADMISSION_CONTROL={'Users.list': {'initial_limit': 1, 'max_queue': 0, 'target_ms': 100}})
+class AdmissionControlTests(TestCase):
+    """Views over their concurrency limit shed requests with 503"""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generate_data', customers=2, products=2, orders=0, line_items=0,
+                     ratings=0, reviews=0, stdout=io.StringIO())
+        cls.token = Token.objects.values_list('key', flat=True).first()
+
+    def setUp(self):
+        admission._limiters.clear()
+        self.addCleanup(admission._limiters.clear)
+        # Take the only slot, as a request in another thread would
+        self.limiter = get_limiter('Users.list')
+        self.assertTrue(self.limiter.acquire())
+
+    def test_shed(self):
+        response = self.client.get('/users', HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+
+        self.limiter.release(0.01, False)
+        self.assertEqual(self.client.get('/users', HTTP_AUTHORIZATION=f'Token {self.token}').status_code, 200)
+
+    def test_batch_shed(self):
+        requests = [{'path': '/users'}, {'path': '/users'}, {'path': '/products'}]
+        response = self.client.post(
+            '/batch', {'requests': requests}, content_type='application/json',
+            HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.assertEqual([item['status'] for item in response.json()], [503, 503, 200])
+
+    def test_limit_adapts(self):
+        self.limiter.release(0.01, False)
+        self.assertEqual(self.limiter.limit, 2)
+        self.assertTrue(self.limiter.acquire())
+        self.limiter.release(1.0, False)
+        self.assertAlmostEqual(self.limiter.limit, 1.8)
+
+
+class PurchaseRollupTests(TestCase):
+    """Checkouts keep the sales and co-purchase rollups equal to a rebuild"""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generate_data', customers=5, products=6, orders=10, line_items=30, ratings=0,
+                     reviews=0, open_cart_ratio=0, stdout=io.StringIO())
+        sales.rebuild()
+        recommendations.rebuild()
+        cls.token = Token.objects.values_list('key', flat=True).first()
+        cls.products = list(Product.objects.values_list('pk', flat=True)[:3])
+
+    def request(self, method, path, body=None):
+        return getattr(self.client, method)(
+            path, body, content_type='application/json', HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def rollups(self):
+        return (
+            sorted(ProductSales.objects.values_list('product_id', 'seller_id', 'units', 'revenue')),
+            sorted(SellerDailySales.objects.values_list('seller_id', 'date', 'units', 'revenue')),
+            sorted(CoPurchase.objects.values_list('product_id', 'other_id', 'count')),
+        )
+
+    def assertRebuilt(self):
+        counted = self.rollups()
+        sales.rebuild()
+        recommendations.rebuild()
+        self.assertEqual(counted, self.rollups())
+
+    def checkout(self):
+        order = self.request('post', '/orders', {'purchased': False, 'created_date': '2026-10-01'}).json()['id']
+        for product in self.products:
+            self.assertEqual(self.request('post', '/orderproducts', {'productId': product}).status_code, 201)
+        before = self.rollups()
+        body = {'purchased': True, 'created_date': '2026-10-02'}
+        self.assertEqual(self.request('put', f'/orders/{order}', body).status_code, 204)
+        self.assertNotEqual(self.rollups(), before)
+        return order
+
+    def test_counted_once(self):
+        order = self.checkout()
+        self.assertRebuilt()
+
+        counted = self.rollups()
+        body = {'purchased': True, 'created_date': '2026-10-09'}
+        self.assertEqual(self.request('put', f'/orders/{order}', body).status_code, 204)
+        self.assertEqual(self.rollups(), counted)
+        self.assertEqual(Order.objects.get(pk=order).counted_date, datetime.date(2026, 10, 2))
+        self.assertRebuilt()
+
+    def test_purchase_is_final(self):
+        order = self.checkout()
+        counted = self.rollups()
+        response = self.request('put', f'/orders/{order}', {'purchased': False, 'created_date': '2026-10-02'})
+        self.assertEqual(response.status_code, 409)
+        line_item = OrderProduct.objects.filter(order_id=order).first()
+        self.assertEqual(self.request('delete', f'/orderproducts/{line_item.pk}').status_code, 409)
+        self.assertEqual(self.rollups(), counted)
+        self.assertRebuilt()
+
+    def test_created_purchased(self):
+        response = self.request('post', '/orders', {'purchased': True, 'created_date': '2026-10-01'})
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNotNone(Order.objects.get(pk=response.json()['id']).counted_date)
+        self.assertRebuilt()
+
+    def test_dashboard_access(self):
+        seller = Customer.objects.get(user__auth_token__key=self.token).pk
+        response = self.request('get', f'/customers/{seller}/sales?days=7')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['daily']), 7)
+
+        self.assertEqual(self.request('get', '/customers/me/sales').status_code, 404)
+        response = self.request('get', f'/customers/{seller}/sales?days=week')
+        self.assertEqual(response.json(), {'message': 'days must be a number.'})
+
+        # A user without a customer row
+        user = User.objects.create_user('clerk', password='secret')
+        response = self.client.get(
+            f'/customers/{seller}/sales', HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}')
+        self.assertEqual(response.status_code, 403)
+
+
+class ProductPurgeTests(TransactionTestCase):
+    """DELETE /products/:id commits whole or not at all, purge_product finishes the job"""
+
+    def setUp(self):
+        call_command('generate_data', customers=5, products=30, orders=10, line_items=60, ratings=30,
+                     reviews=30, open_cart_ratio=1, stdout=io.StringIO())
+        self.token = Token.objects.values_list('key', flat=True).first()
+        # The most popular product, which has a bit of everything
+        self.product = Product.objects.annotate(sold=Count('lineitems')).order_by('-sold')[0].pk
+
+    def delete(self, product_id):
+        return self.client.delete(f'/products/{product_id}', HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def test_failed_destroy_rolls_back(self):
+        with mock.patch('tipsytequilaapi.views.product.enqueue', side_effect=RuntimeError('Queue is down')):
+            with self.assertRaises(RuntimeError):
+                self.delete(self.product)
+        self.assertIsNone(Product.all_objects.get(pk=self.product).deleted_at)
+        self.assertFalse(ProductTombstone.objects.exists())
+
+    @override_settings(PRODUCT_PURGE_BATCH_SIZE=2)
+    def test_purge(self):
+        self.assertEqual(self.delete(self.product).status_code, 204)
+        self.assertEqual(Job.objects.get().payload, f'{{"product_id": {self.product}}}')
+        purchased = OrderProduct.objects.filter(product_id=self.product, order__purchased=True).count()
+        self.assertGreater(OrderProduct.objects.filter(product_id=self.product).count(), purchased + 2)
+        self.assertGreater(ProductRating.objects.filter(product_id=self.product).count(), 2)
+
+        tasks.purge_product(product_id=self.product)
+        self.assertEqual(OrderProduct.objects.filter(product_id=self.product).count(), purchased)
+        self.assertFalse(ProductRating.objects.filter(product_id=self.product).exists())
+        self.assertFalse(ProductReview.objects.filter(product_id=self.product).exists())
+        self.assertEqual(Product.all_objects.filter(pk=self.product).exists(), purchased > 0)
+
+        unsold = Product.objects.exclude(lineitems__order__purchased=True).values_list('pk', flat=True).first()
+        self.assertEqual(self.delete(unsold).status_code, 204)
+        tasks.purge_product(product_id=unsold)
+        self.assertFalse(Product.all_objects.filter(pk=unsold).exists())
+
+
+class DeltaSyncTests(TestCase):
+    """/products/delta returns every change after its token"""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generate_data', customers=2, products=5, orders=0, line_items=0, ratings=0,
+                     reviews=0, stdout=io.StringIO())
+        cls.token = Token.objects.values_list('key', flat=True).first()
+
+    def delta(self, since):
+        response = self.client.get(f'/products/delta?since={since}', HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        return {product['id'] for product in body['products']}, set(body['deleted']), body['token']
+
+    @override_settings(PRODUCT_DELTA_MARGIN=0)
+    def test_token_advances(self):
+        products, _, first = self.delta(0)
+        self.assertEqual(products, set(Product.objects.values_list('pk', flat=True)))
+        self.assertEqual(self.delta(first)[:2], (set(), set()))
+
+        product = Product.objects.first()
+        product.save()
+        products, _, token = self.delta(first)
+        self.assertEqual(products, {product.pk})
+        epoch = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+        self.assertEqual(int(token), (product.updated_at - epoch) // datetime.timedelta(microseconds=1))
+        self.assertEqual(self.delta(token)[:2], (set(), set()))
+
+        self.assertEqual(self.client.delete(
+            f'/products/{product.pk}', HTTP_AUTHORIZATION=f'Token {self.token}').status_code, 204)
+        _, deleted, _ = self.delta(token)
+        self.assertEqual(deleted, {product.pk})
+
+    def test_late_commit(self):
+        _, _, first = self.delta(0)
+        early, late = Product.objects.all()[:2]
+        early.save()
+        _, _, token = self.delta(first)
+
+        # Stamped before the save above, but committed after the delta call
+        Product.objects.filter(pk=late.pk).update(updated_at=early.updated_at - datetime.timedelta(milliseconds=1))
+        products, _, _ = self.delta(token)
+        self.assertIn(late.pk, products)
+
+
+class AsyncReadTests(TestCase):
+    """TIPSYTEQUILA_ASYNC_READS doesn't change what the order detail returns"""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generate_data', customers=3, products=3, orders=6, line_items=10, ratings=0,
+                     reviews=0, stdout=io.StringIO())
+        cls.order = Order.objects.select_related('customer').first()
+        cls.other = Order.objects.exclude(customer=cls.order.customer).first()
+        cls.token = Token.objects.get(user_id=cls.order.customer.user_id).key
+        cls.clerk = Token.objects.create(user=User.objects.create_user('clerk', password='secret')).key
+
+    def responses(self, pk, token=None):
+        headers = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+        request = APIRequestFactory().get(f'/orders/{pk}', **headers)
+        sync = Orders.as_view({'get': 'retrieve'})(request, pk=pk).render()
+        request = APIRequestFactory().get(f'/orders/{pk}', **headers)
+        native = async_to_sync(async_read.orders_detail_view)(request, pk=pk)
+        return [
+            (response.status_code, response.get('WWW-Authenticate'), response.content)
+            for response in (sync, native)
+        ]
+
+    def test_same_responses(self):
+        for pk, token, code in (
+                (self.order.pk, self.token, 200), (self.other.pk, self.token, 404),
+                (self.order.pk, self.clerk, 404), (self.order.pk, None, 401),
+                (self.order.pk, 'bad', 401)):
+            with self.subTest(pk=pk, token=token):
+                sync, native = self.responses(pk, token)
+                self.assertEqual(sync[0], code)
+                self.assertEqual(native, sync)
+
+
+class ChangeFeedTests(TestCase):
+    """/changes pages through public changes and the caller's own"""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generate_data', customers=2, products=2, orders=0, line_items=0, ratings=0,
+                     reviews=0, open_cart_ratio=0, stdout=io.StringIO())
+        cls.buyer, cls.other = Customer.objects.order_by('pk')
+        cls.tokens = {
+            customer.pk: Token.objects.get(user_id=customer.user_id).key for customer in (cls.buyer, cls.other)}
+        staff = User.objects.create_user('admin', password='secret', is_staff=True)
+        cls.staff = Token.objects.create(user=staff).key
+
+    def post(self, customer, path, body):
+        response = self.client.post(
+            path, body, content_type='application/json', HTTP_AUTHORIZATION=f'Token {self.tokens[customer.pk]}')
+        self.assertEqual(response.status_code, 201)
+        return response.json()['id']
+
+    def changes(self, token, limit):
+        """Every change the token may see, read limit at a time"""
+        seen, since = [], 0
+        while True:
+            response = self.client.get(
+                f'/changes?since={since}&limit={limit}', HTTP_AUTHORIZATION=f'Token {token}').json()
+            self.assertLessEqual(len(response['changes']), limit)
+            seen += [(change['entity'], change['id']) for change in response['changes']]
+            since = response['next']
+            if not response['has_more']:
+                return seen
+
+    def test_scoped(self):
+        product = Product.objects.values_list('pk', flat=True).first()
+        order = self.post(self.buyer, '/orders', {'purchased': False, 'created_date': '2026-10-01'})
+        line_item = self.post(self.buyer, '/orderproducts', {'productId': product})
+        rating = self.post(self.other, '/ratings', {'productId': product, 'score': 5})
+        other_order = self.post(self.other, '/orders', {'purchased': False, 'created_date': '2026-10-01'})
+
+        everything = [('order', order), ('orderproduct', line_item), ('rating', rating), ('order', other_order)]
+        self.assertEqual(self.changes(self.staff, 100), everything)
+        self.assertEqual(self.changes(self.tokens[self.buyer.pk], 1), everything[:3])
+        self.assertEqual(self.changes(self.tokens[self.other.pk], 2), everything[2:])
+        clerk = Token.objects.create(user=User.objects.create_user('clerk', password='secret')).key
+        self.assertEqual(self.changes(clerk, 100), [('rating', rating)])
+
+
+class MetricsAccessTests(TestCase):
+    """/metrics answers staff tokens and METRICS_ALLOWED_IPS only"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = Token.objects.create(user=User.objects.create_user('admin', password='secret', is_staff=True))
+        cls.clerk = Token.objects.create(user=User.objects.create_user('clerk', password='secret'))
+
+    def scrape(self, token=None):
+        headers = {'HTTP_AUTHORIZATION': f'Token {token.key}'} if token else {}
+        return self.client.get('/metrics', **headers).status_code
+
+    @override_settings(METRICS_ALLOWED_IPS=[])
+    def test_staff_only(self):
+        self.assertEqual(self.scrape(), 403)
+        self.assertEqual(self.scrape(self.clerk), 403)
+        self.assertEqual(self.scrape(self.staff), 200)
+
+    @override_settings(METRICS_ALLOWED_IPS=['127.0.0.1'])
+    def test_allowed_ip(self):
+        self.assertEqual(self.scrape(), 200)
+
+
+class BatchTests(TransactionTestCase):
+    """An atomic batch commits all of its sub-requests or none"""
+
+    def setUp(self):
+        call_command('generate_data', customers=2, products=2, orders=0, line_items=0, ratings=0,
+                     reviews=0, stdout=io.StringIO())
+        self.token = Token.objects.values_list('key', flat=True).first()
+        self.product = Product.objects.values_list('pk', flat=True).first()
+
+    def batch(self, atomic):
+        requests = [
+            {'method': 'POST', 'path': '/ratings', 'body': {'productId': self.product, 'score': 4}},
+            {'method': 'POST', 'path': '/ratings', 'body': {'productId': 0, 'score': 4}},
+            {'method': 'POST', 'path': '/ratings', 'body': {'productId': self.product, 'score': 5}},
+        ]
+        return self.client.post(
+            '/batch', {'atomic': atomic, 'requests': requests}, content_type='application/json',
+            HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def test_atomic_rollback(self):
+        response = self.batch(True)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([item['status'] for item in response.json()], [201, 500])
+        self.assertFalse(Rating.objects.exists())
+        self.assertFalse(ProductRating.objects.exists())
+
+    def test_independent(self):
+        response = self.batch(False)
+        self.assertEqual([item['status'] for item in response.json()], [201, 500, 201])
+        self.assertEqual(Rating.objects.count(), 2)
+
+
+@jobs.task(name='tests.noop', max_attempts=2, timeout=60)
+def _noop():
+    pass
+
+
+class JobQueueTests(TestCase):
+    """Claimed jobs stay hidden for their timeout, then go to another worker"""
+
+    def expire(self, job):
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - datetime.timedelta(seconds=1))
+
+    def test_visibility_timeout(self):
+        job = jobs.enqueue('tests.noop')
+        [first] = jobs.claim('w1', 10)
+        self.assertEqual((first.pk, first.attempts, first.locked_by), (job.pk, 1, 'w1'))
+        self.assertGreater(first.locked_until, timezone.now() + datetime.timedelta(seconds=55))
+        self.assertEqual(jobs.claim('w2', 10), [])
+
+        self.expire(job)
+        [second] = jobs.claim('w2', 10)
+        self.assertEqual((second.attempts, second.locked_by), (2, 'w2'))
+        # The first worker finishing late doesn't take the job from the second
+        jobs.complete(first)
+        self.assertTrue(Job.objects.filter(pk=job.pk).exists())
+
+        # Out of attempts, a third timeout fails the job
+        self.expire(job)
+        self.assertEqual(jobs.claim('w3', 10), [])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.last_error), (Job.FAILED, 'Timed out on w2'))
+
+    def test_retry_then_complete(self):
+        jobs.enqueue('tests.noop')
+        [job] = jobs.claim('w1', 10)
+        with self.assertLogs('tipsytequila.jobs', 'WARNING'):
+            jobs.fail(job, 'Boom')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.last_error), (Job.QUEUED, 'Boom'))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertEqual(jobs.claim('w1', 10), [])
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        [job] = jobs.claim('w1', 10)
+        self.assertIsNone(jobs.execute(job.task, job.payload))
+        jobs.complete(job)
+        self.assertFalse(Job.objects.exists())
+
+
+class EventStreamTests(TestCase):
+    """/events delivers cart changes and the stock of products in the cart"""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generate_data', customers=1, products=2, orders=0, line_items=0, ratings=0,
+                     reviews=0, open_cart_ratio=1, stdout=io.StringIO())
+        cls.token = Token.objects.values_list('key', flat=True).get()
+        cls.product = Product.objects.values_list('pk', flat=True).first()
+
+    def add_to_cart(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/orderproducts', {'productId': self.product}, content_type='application/json',
+                HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.assertEqual(response.status_code, 201)
+
+    def restock(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            publish_stock(self.product, 7)
+
+    async def stream(self):
+        sent = asyncio.Queue()
+        disconnected = asyncio.Event()
+
+        async def receive():
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def received():
+            return await asyncio.wait_for(sent.get(), 5)
+
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': '/events', 'query_string': f'token={self.token}'.encode(),
+            'headers': [],
+        }
+        app = asyncio.ensure_future(EventStream()(scope, receive, sent.put))
+        start = await received()
+        ready = await received()
+        await sync_to_async(self.add_to_cart)()
+        cart = await received()
+        await sync_to_async(self.restock)()
+        stock = await received()
+        disconnected.set()
+        await asyncio.wait_for(app, 5)
+        return start, ready['body'], cart['body'], stock['body']
+
+    def test_delivery(self):
+        start, ready, cart, stock = async_to_sync(self.stream)()
+        self.assertEqual(start['status'], 200)
+        self.assertTrue(ready.startswith(b'event: ready\n'))
+        self.assertIn(f'"product": {self.product}, "operation": "add"'.encode(), cart)
+        self.assertEqual(stock, (
+            f'event: stock\ndata: {{"type": "stock", "product": {self.product}, "quantity": 7}}\n\n'.encode()))
+
+
+class FacetTests(TestCase):
+    """Facet counts match counting the filtered catalog one product at a time"""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generate_data', customers=10, products=300, orders=0, line_items=0, ratings=600,
+                     reviews=0, stdout=io.StringIO())
+
+    def expected(self, products):
+        edges = settings.PRODUCT_PRICE_BUCKETS
+        scores = {}
+        for product, score in ProductRating.objects.values_list('product_id', 'rating__score'):
+            scores.setdefault(product, []).append(score)
+        prices = [0] * (len(edges) + 1)
+        ratings = [0] * 5
+        sellers = {}
+        for product in products:
+            prices[sum(product.price >= edge for edge in edges)] += 1
+            sellers[product.customer_id] = sellers.get(product.customer_id, 0) + 1
+            if product.pk in scores:
+                ratings[min(int(sum(scores[product.pk]) / len(scores[product.pk])), 4)] += 1
+        return {
+            'count': len(products),
+            'price': prices,
+            'in_stock': sum(product.quantity > 0 for product in products),
+            'ratings': ratings,
+            'unrated': sum(product.pk not in scores for product in products),
+            'sellers': sellers,
+        }
+
+    def counts(self, params):
+        facets = facet_counts(params)
+        return {
+            'count': facets['count'],
+            'price': [bucket['count'] for bucket in facets['price']],
+            'in_stock': facets['availability']['in_stock'],
+            'ratings': [band['count'] for band in facets['ratings']],
+            'unrated': facets['unrated'],
+            'sellers': {seller['id']: seller['count'] for seller in facets['sellers']},
+        }
+
+    def test_counts(self):
+        products = list(Product.objects.all())
+        self.assertEqual(self.counts({}), self.expected(products))
+        self.assertEqual(
+            self.counts({'min_price': '20', 'in_stock': 'true'}),
+            self.expected([product for product in products if product.price >= 20 and product.quantity > 0]))
+
+    def test_product_write_invalidates(self):
+        before = self.counts({})
+        product = Product.objects.filter(quantity__gt=0).first()
+        product.quantity = 0
+        product.save()
+        self.assertEqual(self.counts({})['in_stock'], before['in_stock'] - 1)
+
+
+@unittest.skipUnless(hasattr(socket, 'SO_REUSEPORT'), 'needs SO_REUSEPORT')
+class PreforkServerTests(SimpleTestCase):
+    """manage.py serve answers from its workers, recycles them and stops on TERM"""
+
+    def test_serve(self):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        with tempfile.TemporaryDirectory() as directory:
+            server = subprocess.Popen(
+                [sys.executable, 'manage.py', 'serve', '--bind', f'127.0.0.1:{port}', '--workers', '2',
+                 '--max-requests', '2', '--max-requests-jitter', '0', '--no-access-log'],
+                cwd=settings.BASE_DIR, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                env={**os.environ, 'TIPSYTEQUILA_METRICS_DIR': directory})
+            try:
+                statuses = [self.get(port) for _ in range(8)]
+                server.send_signal(signal.SIGTERM)
+                output, _ = server.communicate(timeout=30)
+            finally:
+                if server.poll() is None:
+                    server.kill()
+                    server.communicate()
+
+        self.assertEqual(statuses, [401] * 8)
+        self.assertEqual(server.returncode, 0, output)
+        self.assertIn('recycled after 2 requests', output)
+        self.assertIn('stopped', output)
+
+    def get(self, port):
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/orders', timeout=5) as response:
+                    return response.status
+            except urllib.error.HTTPError as ex:
+                return ex.code
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
@@ -1,5 +1,8 @@
 from .register import register_user
 from .register import login_user
+from .metrics import metrics
+from .batch import batch
+from .change import Changes
 from .order import Orders
 from .product import Products
 from .customer import Customers
@@ -0,0 +1,186 @@
+"""Native async handlers for the hot read paths
+
+These mirror the GET handlers of the Products, Orders, Ratings and Reviews
+ViewSets, but run on the event loop under ASGI instead of taking a thread
+hop for the whole request. Database access goes through the async ORM
+bridge and the rendered payload is identical to the sync ViewSets, so the
+two modes can be benchmarked against each other.
+
+Only GET is served here. Any other method is handed to the matching sync
+ViewSet view so the write paths are untouched.
+"""
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseServerError
+from rest_framework import exceptions, status
+from rest_framework.authentication import TokenAuthentication
+from tipsytequilaapi import product_cache
+from tipsytequilaapi.compiled import serialize, serialize_one
+from tipsytequilaapi.facets import filter_products
+from tipsytequilaapi.middleware.timing import timed_render
+from tipsytequilaapi.models import Customer, Order, Product, Rating, Review
+from tipsytequilaapi.renderers import FastJSONRenderer
+from .order import OrderSerializer, Orders
+from .product import ProductSerializer, Products
+from .rating import RatingSerializer, Ratings
+from .review import ReviewSerializer, Reviews
+
+
+def _render(data, status_code=status.HTTP_200_OK):
+    """Render serialized data the same way the ViewSets' JSON responses do"""
+    renderer = FastJSONRenderer()
+    with timed_render():
+        content = renderer.render(data)
+    return HttpResponse(content, content_type=renderer.media_type, status=status_code)
+
+
+def _unauthorized(request, detail):
+    """A 401 like DRF's, challenge header included"""
+    response = _render({'detail': detail}, status.HTTP_401_UNAUTHORIZED)
+    response['WWW-Authenticate'] = TokenAuthentication().authenticate_header(request)
+    return response
+
+
+async def _authenticate(request):
+    """Resolve the token in the Authorization header to a user
+
+    Returns None for anonymous requests and raises AuthenticationFailed for
+    a bad token, matching TokenAuthentication.
+    """
+    authenticator = TokenAuthentication()
+    header = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if not header or header[0].lower() != authenticator.keyword.lower():
+        return None
+    if len(header) != 2:
+        raise exceptions.AuthenticationFailed('Invalid token header.')
+
+    user, _ = await sync_to_async(authenticator.authenticate_credentials)(header[1])
+    return user
+
+
+def async_read(handler, fallback):
+    """Build a view that serves GET on the event loop and delegates the rest
+
+    Arguments:
+        handler -- coroutine taking (request, user, **kwargs)
+        fallback -- sync view used for every non-GET method
+    """
+    sync_fallback = sync_to_async(fallback)
+
+    async def view(request, *args, **kwargs):
+        if request.method != 'GET':
+            return await sync_fallback(request, *args, **kwargs)
+
+        try:
+            user = await _authenticate(request)
+        except exceptions.AuthenticationFailed as ex:
+            return _unauthorized(request, ex.detail)
+
+        return await handler(request, user, *args, **kwargs)
+
+    # csrf_exempt() would wrap the coroutine in a sync function on this
+    # Django version, so flag it directly. The fallback ViewSets are exempt.
+    view.csrf_exempt = True
+    # Same identity as the ViewSet view, so instrumentation names it alike
+    view.cls = fallback.cls
+    view.actions = fallback.actions
+    return view
+
+
+async def product_list(request, user):
+    """Async counterpart of Products.list"""
+    try:
+        products = filter_products(Product.objects.all(), request.GET)
+        ids = request.GET.get('ids')
+        if ids is not None:
+            ids = product_cache.parse_ids(ids)
+    except ValueError as ex:
+        return _render({'message': str(ex)}, status.HTTP_400_BAD_REQUEST)
+
+    try:
+        if ids is not None:
+            data = await sync_to_async(product_cache.get_many)(ProductSerializer, products, ids, request)
+        else:
+            data = await sync_to_async(serialize)(ProductSerializer, products, request)
+
+        return _render(data)
+
+    except Exception as ex:
+        return HttpResponseServerError(ex)
+
+
+async def product_detail(request, user, pk=None):
+    """Async counterpart of Products.retrieve"""
+    try:
+        data = await sync_to_async(serialize_one)(ProductSerializer, Product.objects.all(), request, pk=pk)
+        return _render(data)
+    except Exception as ex:
+        return HttpResponseServerError(ex)
+
+
+@sync_to_async
+def _serialize_order(request, user, pk):
+    customer = user.customer
+    orders = Order.objects.prefetch_related('lineitems__product')
+    return serialize_one(OrderSerializer, orders, request, pk=pk, customer=customer)
+
+
+async def order_detail(request, user, pk=None):
+    """Async counterpart of Orders.retrieve"""
+    if user is None:
+        return _unauthorized(request, exceptions.NotAuthenticated.default_detail)
+
+    try:
+        return _render(await _serialize_order(request, user, pk))
+
+    except (Order.DoesNotExist, Customer.DoesNotExist):
+        return _render(
+            {'message': 'The requested order does not exist, or you do not have permission to access it.'},
+            status.HTTP_404_NOT_FOUND
+        )
+
+    except Exception as ex:
+        return HttpResponseServerError(ex)
+
+
+async def rating_list(request, user):
+    """Async counterpart of Ratings.list, including the ?item= filter"""
+    try:
+        ratings = Rating.objects.all()
+        item = request.GET.get('item', None)
+        if item is not None:
+            ratings = Rating.objects.filter(ratings__product__id=item)
+        data = await sync_to_async(serialize)(RatingSerializer, ratings, request)
+
+        return _render(data)
+
+    except Exception as ex:
+        return HttpResponseServerError(ex)
+
+
+async def review_list(request, user):
+    """Async counterpart of Reviews.list, including the ?item= filter"""
+    try:
+        reviews = Review.objects.all()
+        item = request.GET.get('item', None)
+        if item is not None:
+            reviews = Review.objects.filter(review__product__id=item)
+        data = await sync_to_async(serialize)(ReviewSerializer, reviews, request)
+
+        return _render(data)
+
+    except Exception as ex:
+        return HttpResponseServerError(ex)
+
+
+products_list_view = async_read(
+    product_list, Products.as_view({'get': 'list', 'post': 'create'}))
+products_detail_view = async_read(
+    product_detail,
+    Products.as_view({'get': 'retrieve', 'put': 'update', 'delete': 'destroy'}))
+orders_detail_view = async_read(
+    order_detail,
+    Orders.as_view({'get': 'retrieve', 'put': 'update', 'delete': 'destroy'}))
+ratings_list_view = async_read(
+    rating_list, Ratings.as_view({'get': 'list', 'post': 'create'}))
+reviews_list_view = async_read(
+    review_list, Reviews.as_view({'get': 'list', 'post': 'create'}))
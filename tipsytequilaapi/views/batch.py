@@ -0,0 +1,180 @@
+"""Run several API requests in one round-trip"""
+import io
+import time
+from asyncio import iscoroutinefunction
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import OperationalError, transaction
+from django.urls import Resolver404, resolve
+from rest_framework import status
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from tipsytequilaapi import metrics
+from tipsytequilaapi.db.sqlite import is_locked_error, retry_on_locked
+from tipsytequilaapi.idempotency import HEADER as IDEMPOTENCY_HEADER
+from tipsytequilaapi.middleware.admission import SHED_MESSAGE, get_limiter
+from tipsytequilaapi.middleware.metrics import MetricsMiddleware, QueryCounter
+from tipsytequilaapi.middleware.timing import view_name
+from tipsytequilaapi.renderers import dumps, loads
+
+
+class _Rollback(Exception):
+    """Raised to abort an atomic batch after a failed sub-request"""
+
+
+def _sub_request(request, method, path, body, idempotency_key):
+    """Django request for one sub-request, sharing the caller's environ
+
+    The caller's user and token are forced onto the request, so DRF skips
+    authentication and every sub-request shares the same User instance,
+    and with it the cached request.auth.user.customer. The caller's
+    Idempotency-Key is not passed on, each sub-request brings its own.
+    """
+    path_info, _, query_string = path.partition('?')
+    content = dumps(body) if body is not None else b''
+    environ = {key: value for key, value in request.META.items() if key != IDEMPOTENCY_HEADER}
+    if idempotency_key is not None:
+        environ[IDEMPOTENCY_HEADER] = str(idempotency_key)
+    environ.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': query_string,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(content)),
+        'HTTP_ACCEPT': 'application/json',
+        'wsgi.input': io.BytesIO(content),
+        'wsgi.url_scheme': request.scheme,
+    })
+    sub_request = WSGIRequest(environ)
+    sub_request._force_auth_user = request.user
+    sub_request._force_auth_token = request.auth
+    return sub_request
+
+
+def _dispatch(request, item):
+    """Run one sub-request and return its (status, body)
+
+    Sub-requests call their view directly, so what the middleware does per
+    request happens here: the view's admission limit applies, and each
+    sub-request is recorded in the per-route metrics.
+    """
+    if not isinstance(item, dict) or not isinstance(item.get('path'), str) or not item['path'].startswith('/'):
+        return status.HTTP_400_BAD_REQUEST, {'message': 'Each request needs a method and an absolute path.'}
+
+    method = str(item.get('method', 'GET')).upper()
+    try:
+        match = resolve(item['path'].partition('?')[0])
+    except Resolver404:
+        return status.HTTP_404_NOT_FOUND, {'message': 'Not found.'}
+    if match.func is batch:
+        return status.HTTP_400_BAD_REQUEST, {'message': 'Batches can not be nested.'}
+
+    name = view_name(match.func, method)
+    limiter = get_limiter(name)
+    if limiter is not None and not limiter.acquire():
+        metrics.inc('http_requests_shed_total', {'view': name})
+        return status.HTTP_503_SERVICE_UNAVAILABLE, {'message': SHED_MESSAGE}
+
+    sub_request = _sub_request(
+        request._request, method, item['path'], item.get('body'), item.get('idempotency_key'))
+    sub_request.resolver_match = match
+    view = async_to_sync(match.func) if iscoroutinefunction(match.func) else match.func
+    counter = QueryCounter()
+    start = time.perf_counter()
+    failed = True
+    try:
+        with MetricsMiddleware.counting(sub_request, counter):
+            response = view(sub_request, *match.args, **match.kwargs)
+        failed = response.status_code >= 500
+    except OperationalError as ex:
+        # Let retry_on_locked retry the whole transaction
+        if transaction.get_connection().in_atomic_block and is_locked_error(ex):
+            raise
+        return status.HTTP_500_INTERNAL_SERVER_ERROR, {'message': str(ex)}
+    except Exception as ex:
+        return status.HTTP_500_INTERNAL_SERVER_ERROR, {'message': str(ex)}
+    finally:
+        if limiter is not None:
+            limiter.release(time.perf_counter() - start, failed)
+    MetricsMiddleware.record(sub_request, response, counter, start)
+
+    # DRF responses are embedded unrendered, everything else is decoded
+    if isinstance(response, Response):
+        return response.status_code, response.data
+    content = response.content
+    if response.get('Content-Type', '').startswith('application/json'):
+        return response.status_code, loads(content) if content else None
+    return response.status_code, content.decode(response.charset, 'replace')
+
+
+@api_view(['POST'])
+def batch(request):
+    '''Handles a batch of API requests made with the caller's credentials
+    Method arguments:
+      request -- The full HTTP request object
+
+    @api {POST} /batch POST batch of requests
+    @apiName Batch
+    @apiGroup Batch
+    @apiHeader {String} Authorization Auth token
+    @apiParam {Object[]} requests Sub-requests, run in order
+    @apiParam {String} requests.method HTTP method, GET by default
+    @apiParam {String} requests.path Absolute path, with an optional query string
+    @apiParam {Object} [requests.body] JSON body
+    @apiParam {String} [requests.idempotency_key] Idempotency-Key of the sub-request.
+        The batch's own Idempotency-Key header is not passed on.
+    @apiParam {Boolean} [atomic=false] Run every sub-request in one transaction.
+        The first failing sub-request rolls the batch back, skips the rest
+        and makes the response a 400.
+    @apiParamExample {json} Input
+        {
+            "atomic": false,
+            "requests": [
+                {"method": "GET", "path": "/products/1"},
+                {"method": "GET", "path": "/ratings"},
+                {"method": "GET", "path": "/orders/2"}
+            ]
+        }
+    @apiSuccessExample {json} Success
+        [
+            {"status": 200, "body": {"id": 1, "name": "Kirkland Signature Silver", ...}},
+            {"status": 200, "body": [...]},
+            {"status": 200, "body": {"id": 2, "lineitems": [...], ...}}
+        ]
+    '''
+    if isinstance(request.data, list):
+        items, atomic = request.data, False
+    else:
+        items, atomic = request.data.get('requests'), bool(request.data.get('atomic', False))
+
+    if not isinstance(items, list):
+        return Response({'message': 'requests must be an array.'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(items) > settings.BATCH_MAX_REQUESTS:
+        return Response(
+            {'message': f'A batch can hold at most {settings.BATCH_MAX_REQUESTS} requests.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if not atomic:
+        return Response([
+            {'status': status_code, 'body': body}
+            for status_code, body in (_dispatch(request, item) for item in items)
+        ])
+
+    results = []
+
+    @retry_on_locked
+    def run_all():
+        results.clear()
+        for item in items:
+            status_code, body = _dispatch(request, item)
+            results.append({'status': status_code, 'body': body})
+            if status_code >= 400:
+                raise _Rollback()
+
+    try:
+        run_all()
+    except _Rollback:
+        return Response(results, status=status.HTTP_400_BAD_REQUEST)
+    return Response(results)
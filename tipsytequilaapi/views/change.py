@@ -0,0 +1,77 @@
+"""View module for consuming the change feed"""
+from rest_framework.viewsets import ViewSet
+from rest_framework.response import Response
+from django.db.models import Q, Subquery
+from rest_framework import status
+from tipsytequilaapi.models import Change, Customer
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+class Changes(ViewSet):
+    """Cursor-based reads of the change log"""
+
+    def list(self, request):
+        """
+        @api {GET} /changes?since=:cursor&limit=:limit GET changes after a cursor
+        @apiName GetChanges
+        @apiGroup Changes
+        @apiDescription Changes to products, ratings and reviews, and to the
+            caller's own customer, orders and line items. Staff see every change.
+        @apiHeader {String} Authorization Auth token
+        @apiHeaderExample {String} Authorization
+            Token 9ba45f09651c5b0c404f37a2d2572c026c146611
+        @apiParam {Number} [since=0] Cursor returned by the previous call
+        @apiParam {Number} [limit=100] Most changes to return, at most 1000
+        @apiSuccess (200) {Object[]} changes Changes in commit order
+        @apiSuccess (200) {Number} changes.cursor Position of the change in the log
+        @apiSuccess (200) {String} changes.entity Model name, e.g. product
+        @apiSuccess (200) {id} changes.id Id of the changed row
+        @apiSuccess (200) {String} changes.operation create, update or delete
+        @apiSuccess (200) {Number} changes.version Number of changes made to the row so far
+        @apiSuccess (200) {Number} next Cursor to pass as since on the next call
+        @apiSuccess (200) {Boolean} has_more Whether more changes are waiting
+        @apiSuccessExample {json} Success
+            {
+                "changes": [
+                    {"cursor": 41, "entity": "product", "id": 7, "operation": "update", "version": 3},
+                    {"cursor": 42, "entity": "rating", "id": 19, "operation": "create", "version": 1}
+                ],
+                "next": 42,
+                "has_more": false
+            }
+        """
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = min(int(request.query_params.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+        except ValueError:
+            return Response(
+                {'message': 'since and limit must be integers.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if limit < 1:
+            return Response({'message': 'limit must be positive.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        visible = Change.objects.filter(id__gt=since)
+        user = request.auth.user
+        if not user.is_staff:
+            # NULL, matching nothing, for users without a customer
+            owner = Subquery(Customer.objects.filter(user=user).values('pk')[:1])
+            visible = visible.filter(Q(entity__in=Change.PUBLIC_ENTITIES) | Q(owner=owner))
+
+        # One extra row tells whether there is another page
+        rows = list(
+            visible.order_by('id')
+            .values_list('id', 'entity', 'entity_id', 'operation', 'version')[:limit + 1]
+        )
+        changes = [
+            {'cursor': cursor, 'entity': entity, 'id': entity_id, 'operation': operation, 'version': version}
+            for cursor, entity, entity_id, operation, version in rows[:limit]
+        ]
+
+        return Response({
+            'changes': changes,
+            'next': changes[-1]['cursor'] if changes else since,
+            'has_more': len(rows) > limit,
+        })
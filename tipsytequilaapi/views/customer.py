@@ -1,9 +1,14 @@
+from django.conf import settings
 from django.http import HttpResponseServerError
+from rest_framework.decorators import action
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers
 from rest_framework import status
-from tipsytequilaapi.models import Customer
+from tipsytequilaapi.models import Customer, Change
+from tipsytequilaapi.db.sqlite import retry_on_locked
+from tipsytequilaapi import sales
+from tipsytequilaapi.compiled import serialize
 
 
 class CustomerSerializer(serializers.HyperlinkedModelSerializer):
@@ -19,6 +24,7 @@ class CustomerSerializer(serializers.HyperlinkedModelSerializer):
 
 class Customers(ViewSet):
 
+    @retry_on_locked
     def update(self, request, pk=None):
         """
         @api {PUT} /customers/:id PUT changes to customer profile
@@ -31,13 +37,14 @@ class Customers(ViewSet):
         @apiSuccessExample {json} Success
             HTTP/1.1 204 No Content
         """
-        customer = Customer.objects.get(user=request.auth.user)
+        customer = request.auth.user.customer
         customer.user.last_name = request.data["last_name"]
         customer.user.email = request.data["email"]
         customer.address = request.data["address"]
         customer.phone_number = request.data["phone_number"]
         customer.user.save()
         customer.save()
+        Change.record(customer, Change.UPDATE)
 
         return Response({}, status=status.HTTP_204_NO_CONTENT)
 
@@ -64,10 +71,59 @@ class Customers(ViewSet):
                 }
             ]
         """
-        customer = Customer.objects.get(user=request.auth.user)
-        customers = Customer.objects.all()
+        customer = request.auth.user.customer
+        customers = Customer.objects.select_related('user').prefetch_related(
+            'user__groups', 'user__user_permissions')
 
-        json_customers = CustomerSerializer(
-            customers, many=True, context={'request': request})
+        return Response(serialize(CustomerSerializer, customers, request))
 
-        return Response(json_customers.data)
\ No newline at end of file
+    @action(methods=['get'], detail=True)
+    def sales(self, request, pk=None):
+        """
+        @api {GET} /customers/:id/sales GET seller dashboard
+        @apiName GetCustomerSales
+        @apiGroup Customer
+        @apiHeader {String} Authorization Auth token of the seller, or of staff
+        @apiHeaderExample {String} Authorization
+            Token 9ba45f09651c5b0c404f37a2d2572c026c146611
+        @apiParam {id} id Customer Id of the seller
+        @apiParam {Number} [days=30] Days in the daily series, up to today
+        @apiSuccess (200) {Number} units Units sold of the seller's products, all time
+        @apiSuccess (200) {Number} revenue Revenue of those units
+        @apiSuccess (200) {Object[]} top_products Best selling products by revenue
+        @apiSuccess (200) {Object[]} daily Units and revenue per day, oldest first
+        @apiSuccessExample {json} Success
+            {
+                "seller": 5,
+                "units": 1204,
+                "revenue": 40176.5,
+                "top_products": [
+                    {"id": 101, "name": "Kite", "units": 311, "revenue": 4662.89}
+                ],
+                "daily": [
+                    {"date": "2019-10-22", "units": 0, "revenue": 0.0},
+                    {"date": "2019-10-23", "units": 4, "revenue": 59.96}
+                ]
+            }
+        """
+        try:
+            seller_id = int(pk)
+        except ValueError:
+            return Response({'message': 'Customer ids are numbers.'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            days = int(request.query_params.get('days') or 30)
+        except ValueError:
+            return Response({'message': 'days must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= days <= settings.SALES_MAX_DAYS:
+            return Response(
+                {'message': f'days must be between 1 and {settings.SALES_MAX_DAYS}.'},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        user = request.auth.user
+        # Not user.customer, users created outside /register may have none
+        own_id = None if user.is_staff else Customer.objects.filter(user=user).values_list('pk', flat=True).first()
+        if not user.is_staff and own_id != seller_id:
+            return Response(
+                {'message': 'You can only see your own sales.'}, status=status.HTTP_403_FORBIDDEN)
+
+        return Response(sales.dashboard(seller_id, days, settings.SALES_TOP_PRODUCTS))
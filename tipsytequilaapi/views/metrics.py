@@ -0,0 +1,35 @@
+"""Prometheus-style scrape endpoint"""
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from tipsytequilaapi.metrics import collect
+
+
+def _allowed(request):
+    """True for scrapers from METRICS_ALLOWED_IPS and for staff tokens
+
+    Request volumes and latencies by route say a lot about the business, so
+    they aren't public.
+    """
+    if request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS:
+        return True
+    authenticator = TokenAuthentication()
+    header = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(header) != 2 or header[0].lower() != authenticator.keyword.lower():
+        return False
+    try:
+        user, _ = authenticator.authenticate_credentials(header[1])
+    except exceptions.AuthenticationFailed:
+        return False
+    return user.is_staff
+
+
+def metrics(request):
+    '''Expose the metrics of every worker process in text format
+    Method arguments:
+      request -- The full HTTP request object
+    '''
+    if not _allowed(request):
+        return HttpResponseForbidden('Metrics are for staff and METRICS_ALLOWED_IPS only.\n')
+    return HttpResponse(collect(), content_type='text/plain; version=0.0.4; charset=utf-8')
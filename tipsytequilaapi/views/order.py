@@ -6,7 +6,12 @@ from rest_framework.response import Response
 from rest_framework import serializers
 from rest_framework import status
 from rest_framework.decorators import action
-from tipsytequilaapi.models import Order, Customer, Product, OrderProduct
+from tipsytequilaapi.models import Order, Customer, Product, OrderProduct, Change
+from tipsytequilaapi.db.sqlite import retry_on_locked
+from tipsytequilaapi.idempotency import idempotent
+from tipsytequilaapi.events import publish_cart
+from tipsytequilaapi import recommendations, sales
+from tipsytequilaapi.compiled import serialize, serialize_one
 from .product import ProductSerializer
 
 
@@ -38,6 +43,19 @@ class OrderSerializer(serializers.HyperlinkedModelSerializer):
         fields = ('id', 'customer', 'purchased', 'created_date', 'lineitems')
 
 
+def _count(order):
+    """Mark a purchased order for the rollups, True if it wasn't before
+
+    The caller counts it in the same write, so each purchase is counted
+    once, on the day it was purchased with, whatever created_date later
+    becomes.
+    """
+    if not order.purchased or order.counted_date is not None:
+        return False
+    order.counted_date = order.created_date
+    return True
+
+
 class Orders(ViewSet):
     """View for interacting with customer orders"""
 
@@ -62,12 +80,12 @@ class Orders(ViewSet):
             }
         """
         try:
-            customer = Customer.objects.get(user=request.auth.user)
-            order = Order.objects.get(pk=pk, customer=customer)
-            serializer = OrderSerializer(order, context={'request': request})
-            return Response(serializer.data)
+            customer = request.auth.user.customer
+            orders = Order.objects.prefetch_related('lineitems__product')
+            return Response(serialize_one(OrderSerializer, orders, request, pk=pk, customer=customer))
 
-        except Order.DoesNotExist as ex:
+        # Users created outside /register may have no customer, and so no orders
+        except (Order.DoesNotExist, Customer.DoesNotExist) as ex:
             return Response(
                 {'message': 'The requested order does not exist, or you do not have permission to access it.'},
                 status=status.HTTP_404_NOT_FOUND
@@ -76,6 +94,7 @@ class Orders(ViewSet):
         except Exception as ex:
             return HttpResponseServerError(ex)
 
+    @retry_on_locked
     def update(self, request, pk=None):
         """
         @api {PUT} /order/:id PUT new payment for order
@@ -92,12 +111,24 @@ class Orders(ViewSet):
         @apiSuccessExample {json} Success
             HTTP/1.1 204 No Content
         """
-        customer = Customer.objects.get(user=request.auth.user)
+        customer = request.auth.user.customer
         order = Order.objects.get(pk=pk, customer=customer)
+        if order.counted_date is not None and not request.data["purchased"]:
+            return Response(
+                {'message': 'A purchased order can not be returned to the cart.'},
+                status=status.HTTP_409_CONFLICT
+            )
         order.customer = customer
         order.purchased = request.data["purchased"]
         order.created_date = request.data["created_date"]
+        counting = _count(order)
         order.save()
+        Change.record(order, Change.UPDATE)
+        if order.purchased:
+            publish_cart(customer.id, order.id, None, 'purchase')
+        if counting:
+            recommendations.record_purchase(order.id)
+            sales.record_purchase(order)
 
         return Response({}, status=status.HTTP_204_NO_CONTENT)
 
@@ -124,14 +155,13 @@ class Orders(ViewSet):
                 }
             ]
         """
-        customer = Customer.objects.get(user=request.auth.user)
-        orders = Order.objects.filter(customer=customer)
-
-        json_orders = OrderSerializer(
-            orders, many=True, context={'request': request})
+        customer = request.auth.user.customer
+        orders = Order.objects.filter(customer=customer).prefetch_related('lineitems__product')
 
-        return Response(json_orders.data)
+        return Response(serialize(OrderSerializer, orders, request))
 
+    @idempotent
+    @retry_on_locked
     def create(self, request):
         """
         @api {POST} /orders POST new order
@@ -160,20 +190,26 @@ class Orders(ViewSet):
                 "created_date": "2019-10-23",
             }
         """
-        customer = Customer.objects.get(user=request.auth.user)
+        customer = request.auth.user.customer
         
         new_order = Order()
         new_order.customer = customer
         new_order.purchased = request.data["purchased"]
         new_order.created_date = request.data["created_date"]
+        # Nothing to count yet, but purchased orders are always marked counted
+        _count(new_order)
 
         new_order.save()
+        Change.record(new_order, Change.CREATE)
+        if not new_order.purchased:
+            publish_cart(customer.id, new_order.id, None, 'open')
 
         serializer = OrderSerializer(
             new_order, context={'request': request})
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @retry_on_locked
     def destroy(self, request, pk=None):
         """
         @api {DELETE} /orders/:id DELETE order
@@ -188,6 +224,7 @@ class Orders(ViewSet):
         """
         try:
             order = Order.objects.get(pk=pk)
+            Change.record(order, Change.DELETE)
             order.delete()
 
             return Response({}, status=status.HTTP_204_NO_CONTENT)
@@ -10,7 +10,11 @@ from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers
 from rest_framework import status
-from tipsytequilaapi.models import OrderProduct, Customer
+from tipsytequilaapi.models import OrderProduct, Change
+from tipsytequilaapi.db.sqlite import retry_on_locked
+from tipsytequilaapi.idempotency import idempotent
+from tipsytequilaapi.events import publish_cart
+from tipsytequilaapi.compiled import serialize, serialize_one
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
 from rest_framework.parsers import MultiPartParser, FormParser
 
@@ -23,10 +27,20 @@ class OrderProductSerializer(serializers.ModelSerializer):
         depth = 2
 
 
+def _purchased():
+    # Purchased orders are already in the sales and co-purchase rollups
+    return Response(
+        {'message': 'The line items of a purchased order can not be changed.'},
+        status=status.HTTP_409_CONFLICT
+    )
+
+
 class OrderProducts(ViewSet):
     """Request handlers for OrderProducts in the tipsytequila Platform"""
     permission_classes = (IsAuthenticatedOrReadOnly,)
 
+    @idempotent
+    @retry_on_locked
     def create(self, request):
         """
         @api {POST} /order_products POST new order_product
@@ -71,7 +85,7 @@ class OrderProducts(ViewSet):
             }
         """
         new_order_product = OrderProduct()
-        customer = Customer.objects.get(user=request.auth.user)
+        customer = request.auth.user.customer
         new_order_product.order = Order.objects.get(customer=customer, purchased=False)
         new_order_product.product = Product.objects.get(pk=request.data["productId"])
         
@@ -79,6 +93,8 @@ class OrderProducts(ViewSet):
         new_order_product.customer = customer
 
         new_order_product.save()
+        Change.record(new_order_product, Change.CREATE)
+        publish_cart(customer.id, new_order_product.order_id, new_order_product.product_id, 'add')
 
         serializer = OrderProductSerializer(
             new_order_product, context={'request': request})
@@ -111,12 +127,12 @@ class OrderProducts(ViewSet):
             }
         """
         try:
-            order_product = OrderProduct.objects.get(pk=pk)
-            serializer = OrderProductSerializer(order_product, context={'request': request})
-            return Response(serializer.data)
+            order_products = OrderProduct.objects.select_related('order__customer', 'product__customer')
+            return Response(serialize_one(OrderProductSerializer, order_products, request, pk=pk))
         except Exception as ex:
             return HttpResponseServerError(ex)
 
+    @retry_on_locked
     def update(self, request, pk=None):
         """
         @api {PUT} /order_products/:id PUT changes to order_product
@@ -129,16 +145,24 @@ class OrderProducts(ViewSet):
         @apiSuccessExample {json} Success
             HTTP/1.1 204 No Content
         """
-        order_product = OrderProduct.objects.get(pk=pk)
-        order_product.order = Order.objects.get(pk=request.data["orderId"])
+        order_product = OrderProduct.objects.select_related('order').get(pk=pk)
+        previous = (order_product.order.customer_id, order_product.order_id, order_product.product_id)
+        order = Order.objects.get(pk=request.data["orderId"])
+        if order_product.order.purchased or order.purchased:
+            return _purchased()
+        order_product.order = order
         order_product.product = Product.objects.get(pk=request.data["productId"])
-        customer = Customer.objects.get(user=request.auth.user)
+        customer = request.auth.user.customer
         order_product.customer = customer
 
         order_product.save()
+        Change.record(order_product, Change.UPDATE)
+        publish_cart(*previous, 'remove')
+        publish_cart(order_product.order.customer_id, order_product.order_id, order_product.product_id, 'add')
 
         return Response({}, status=status.HTTP_204_NO_CONTENT)
 
+    @retry_on_locked
     def destroy(self, request, pk=None):
         """
         @api {DELETE} /order_products/:id DELETE order_product
@@ -152,7 +176,11 @@ class OrderProducts(ViewSet):
             HTTP/1.1 204 No Content
         """
         try:
-            order_product = OrderProduct.objects.get(pk=pk)
+            order_product = OrderProduct.objects.select_related('order').get(pk=pk)
+            if order_product.order.purchased:
+                return _purchased()
+            Change.record(order_product, Change.DELETE)
+            publish_cart(order_product.order.customer_id, order_product.order_id, order_product.product_id, 'remove')
             order_product.delete()
 
             return Response({}, status=status.HTTP_204_NO_CONTENT)
@@ -182,11 +210,9 @@ class OrderProducts(ViewSet):
                }
            ]
        """
-        order_products = OrderProduct.objects.all()
+        order_products = OrderProduct.objects.select_related('order__customer', 'product__customer')
         order = request.query_params.get('order', None)
         if order is not None:
-            order_products = OrderProduct.objects.filter(order=order)
-        serializer = OrderProductSerializer(order_products, many=True, context={'request': request})
-           
-        return Response(serializer.data)
+            order_products = order_products.filter(order=order)
+        return Response(serialize(OrderProductSerializer, order_products, request))
        
\ No newline at end of file
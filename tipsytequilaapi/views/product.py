@@ -8,10 +8,23 @@ from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers
 from rest_framework import status
-from tipsytequilaapi.models import Product, Customer
+import datetime
+from django.conf import settings
+from django.utils import timezone
+from tipsytequilaapi.models import Product, Customer, Change, ProductTombstone
+from tipsytequilaapi.db.sqlite import retry_on_locked
+from tipsytequilaapi.events import publish_stock
+from tipsytequilaapi.jobs import enqueue
+from tipsytequilaapi import recommendations
+from tipsytequilaapi.compiled import serialize, serialize_one
+from tipsytequilaapi.facets import facet_counts, filter_products
+from tipsytequilaapi import product_cache
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
 from rest_framework.parsers import MultiPartParser, FormParser
 
+# Delta sync tokens count microseconds from here
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
 
 class ProductSerializer(serializers.ModelSerializer):
     """JSON serializer for products"""
@@ -26,6 +39,7 @@ class Products(ViewSet):
     """Request handlers for Products in the tipsytequila Platform"""
     permission_classes = (IsAuthenticatedOrReadOnly,)
 
+    @retry_on_locked
     def create(self, request):
         """
         @api {POST} /products POST new product
@@ -75,7 +89,7 @@ class Products(ViewSet):
         new_product.description = request.data["description"]
         new_product.quantity = request.data["quantity"]
 
-        customer = Customer.objects.get(user=request.auth.user)
+        customer = request.auth.user.customer
         new_product.customer = customer
 
 
@@ -87,6 +101,9 @@ class Products(ViewSet):
             new_product.image_path = data
 
         new_product.save()
+        Change.record(new_product, Change.CREATE)
+        if new_product.image_path:
+            enqueue('optimize_product_image', product_id=new_product.id)
 
         serializer = ProductSerializer(
             new_product, context={'request': request})
@@ -119,12 +136,11 @@ class Products(ViewSet):
             }
         """
         try:
-            product = Product.objects.get(pk=pk)
-            serializer = ProductSerializer(product, context={'request': request})
-            return Response(serializer.data)
+            return Response(serialize_one(ProductSerializer, Product.objects.all(), request, pk=pk))
         except Exception as ex:
             return HttpResponseServerError(ex)
 
+    @retry_on_locked
     def update(self, request, pk=None):
         """
         @api {PUT} /products/:id PUT changes to product
@@ -138,19 +154,24 @@ class Products(ViewSet):
             HTTP/1.1 204 No Content
         """
         product = Product.objects.get(pk=pk)
+        previous_quantity = product.quantity
         product.name = request.data["name"]
         product.price = request.data["price"]
         product.description = request.data["description"]
         product.quantity = request.data["quantity"]
         product.created_date = request.data["created_date"]
 
-        customer = Customer.objects.get(user=request.auth.user)
+        customer = request.auth.user.customer
         product.customer = customer
 
         product.save()
+        Change.record(product, Change.UPDATE)
+        if product.quantity != previous_quantity:
+            publish_stock(product.id, product.quantity)
 
         return Response({}, status=status.HTTP_204_NO_CONTENT)
 
+    @retry_on_locked
     def destroy(self, request, pk=None):
         """
         @api {DELETE} /products/:id DELETE product
@@ -164,22 +185,32 @@ class Products(ViewSet):
             HTTP/1.1 204 No Content
         """
         try:
+            # Soft delete; purge_product removes line items in open carts,
+            # ratings and reviews in small batches afterwards
             product = Product.objects.get(pk=pk)
-            product.delete()
+            product.deleted_at = timezone.now()
+            product.save()
+            Change.record(product, Change.DELETE)
+            ProductTombstone.objects.create(product_id=product.pk)
+            enqueue('purge_product', product_id=product.pk)
 
             return Response({}, status=status.HTTP_204_NO_CONTENT)
 
         except Product.DoesNotExist as ex:
             return Response({'message': ex.args[0]}, status=status.HTTP_404_NOT_FOUND)
 
-        except Exception as ex:
-            return Response({'message': ex.args[0]}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
     def list(self, request):
         """
         @api {GET} /products GET all products
         @apiName ListProducts
         @apiGroup Product
+        @apiParam {Number} [min_price] Lowest price, inclusive
+        @apiParam {Number} [max_price] Highest price, inclusive
+        @apiParam {Boolean} [in_stock] true for products with quantity, false for sold out ones
+        @apiParam {id} [seller] Customer Id of the seller
+        @apiParam {String} [ids] Comma separated product ids, at most 100. Only
+            those products are returned, in this order, leaving out the ones
+            that don't exist or don't match the other filters.
         @apiSuccess (200) {Object[]} products Array of products
         @apiSuccessExample {json} Success
             [
@@ -195,10 +226,17 @@ class Products(ViewSet):
             ]
         """
         try:
-            products = Product.objects.all()
-            serializer = ProductSerializer(products, many=True, context={'request': request})
-            
-            return Response(serializer.data)
+            products = filter_products(Product.objects.all(), request.query_params)
+            ids = request.query_params.get('ids')
+            if ids is not None:
+                ids = product_cache.parse_ids(ids)
+        except ValueError as ex:
+            return Response({'message': str(ex)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            if ids is not None:
+                return Response(product_cache.get_many(ProductSerializer, products, ids, request))
+            return Response(serialize(ProductSerializer, products, request))
         
         except Exception as ex:
             return HttpResponseServerError(ex)
@@ -234,18 +272,145 @@ class Products(ViewSet):
 #            products, many=True, context={'request': request})
 #        return Response(serializer.data)
 
-#    @action(methods=['post'], detail=True)
-#    def recommend(self, request, pk=None):
-#        """Recommend products to other users"""
-#
-#        if request.method == "POST":
-#            rec = Recommendation()
-#            rec.recommender = Customer.objects.get(user=request.auth.user)
-#            rec.customer = Customer.objects.get(user__id=request.data["recipient"])
-#            rec.product = Product.objects.get(pk=pk)
-#
-#            rec.save()
-#
-#        return Response(None, status=status.HTTP_204_NO_CONTENT)
+    @action(methods=['get'], detail=True)
+    def recommendations(self, request, pk=None):
+        """
+        @api {GET} /products/:id/recommendations GET products bought together
+        @apiName GetProductRecommendations
+        @apiGroup Product
+        @apiParam {id} id Product Id
+        @apiParam {Number} [limit] Most products to return, at most 10
+        @apiSuccess (200) {Object[]} products Products most often in the same purchased orders, best first
+        @apiSuccessExample {json} Success
+            [
+                {
+                    "id": 102,
+                    "name": "Salt",
+                    "price": 2.99,
+                    "description": "Rim the glass",
+                    "quantity": 200,
+                    "created_date": "2019-10-23",
+                    "image_path": null
+                }
+            ]
+        """
+        try:
+            limit = min(int(request.query_params.get('limit') or settings.RECOMMENDATIONS_TOP_K),
+                        settings.RECOMMENDATIONS_TOP_K)
+        except ValueError:
+            return Response({'message': 'limit must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not Product.objects.filter(pk=pk).exists():
+            return Response({'message': 'Product not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        products = recommendations.top(pk, limit)
+        serializer = ProductSerializer(products, many=True, context={'request': request})
+        return Response(serializer.data)
+
+    @action(methods=['get'], detail=False)
+    def facets(self, request):
+        """
+        @api {GET} /products/facets GET filter sidebar counts
+        @apiName GetProductFacets
+        @apiGroup Product
+        @apiParam {Number} [min_price] Lowest price, inclusive
+        @apiParam {Number} [max_price] Highest price, inclusive
+        @apiParam {Boolean} [in_stock] true for products with quantity, false for sold out ones
+        @apiParam {id} [seller] Customer Id of the seller
+        @apiSuccess (200) {Number} count Products matching the filters
+        @apiSuccess (200) {Object[]} price Products per price bucket, max is null for the last one
+        @apiSuccess (200) {Object} availability Products in stock and sold out
+        @apiSuccess (200) {Object[]} sellers Sellers with the most matching products
+        @apiSuccess (200) {Object[]} ratings Products per band of average rating
+        @apiSuccess (200) {Number} unrated Products without ratings
+        @apiSuccessExample {json} Success
+            {
+                "count": 42,
+                "price": [
+                    {"min": 0, "max": 10, "count": 3},
+                    {"min": 10, "max": 25, "count": 11},
+                    {"min": 250, "max": null, "count": 1}
+                ],
+                "availability": {"in_stock": 39, "out_of_stock": 3},
+                "sellers": [{"id": 5, "name": "Joe Shepherd", "count": 17}],
+                "ratings": [{"min": 4, "max": 5, "count": 20}],
+                "unrated": 8
+            }
+        """
+        try:
+            return Response(facet_counts(request.query_params))
+        except ValueError as ex:
+            return Response({'message': str(ex)}, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(methods=['get'], detail=False)
+    def delta(self, request):
+        """
+        @api {GET} /products/delta?since=:token GET products changed since a sync token
+        @apiName GetProductDelta
+        @apiGroup Product
+        @apiParam {String} [since] Token returned by the previous call. Leave it
+            out for a full sync.
+        @apiSuccess (200) {Object[]} products Products created or changed since the token
+        @apiSuccess (200) {id[]} deleted Ids of products deleted since the token
+        @apiSuccess (200) {String} token Token to pass as since on the next call.
+            Products changed in the last few seconds may come again with it.
+        @apiSuccess (200) {Boolean} reset True when products is the full catalog and
+            the client should replace its copy, e.g. when the token is older
+            than the kept deletion history
+        @apiSuccessExample {json} Success
+            {
+                "products": [
+                    {
+                        "id": 101,
+                        "name": "Kite",
+                        "price": 14.99,
+                        "description": "It flies high",
+                        "quantity": 60,
+                        "created_date": "2019-10-23",
+                        "image_path": null
+                    }
+                ],
+                "deleted": [7, 12],
+                "token": "1760895600123456",
+                "reset": false
+            }
+        """
+        try:
+            since = int(request.query_params.get('since') or 0)
+        except ValueError:
+            return Response({'message': 'Invalid sync token.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Tokens are the newest updated_at/deleted_at the client has seen, in
+        # microseconds since the epoch. Timestamps are taken before their
+        # write commits, and not always under the write lock (admin, bulkload),
+        # so a write can commit after a newer one. Tokens therefore stay
+        # PRODUCT_DELTA_MARGIN behind now, and anything committing within it
+        # is sent again on the next call.
+        now = timezone.now()
+        since_time = _EPOCH + datetime.timedelta(microseconds=since)
+        horizon = now - datetime.timedelta(days=settings.PRODUCT_TOMBSTONE_DAYS)
+        reset = since_time < horizon
+
+        if reset:
+            products = list(Product.objects.all())
+            deleted = []
+        else:
+            products = list(Product.objects.filter(updated_at__gt=since_time))
+            deleted = list(ProductTombstone.objects.filter(
+                deleted_at__gt=since_time).values_list('product_id', 'deleted_at'))
+
+        latest = max(
+            [product.updated_at for product in products] + [deleted_at for _, deleted_at in deleted],
+            default=None)
+        token = since
+        if latest is not None:
+            latest = min(latest, now - datetime.timedelta(seconds=settings.PRODUCT_DELTA_MARGIN))
+            token = max(since, (latest - _EPOCH) // datetime.timedelta(microseconds=1))
 
-        
\ No newline at end of file
+        serializer = ProductSerializer(products, many=True, context={'request': request})
+        return Response({
+            'products': serializer.data,
+            'deleted': [product_id for product_id, _ in deleted],
+            'token': str(token),
+            'reset': reset,
+        })
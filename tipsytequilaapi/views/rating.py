@@ -10,7 +10,11 @@ from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers
 from rest_framework import status
-from tipsytequilaapi.models import Rating, Customer
+from tipsytequilaapi.models import Rating, Change
+from tipsytequilaapi.db.coalesce import write as group_write
+from tipsytequilaapi.db.sqlite import retry_on_locked
+from tipsytequilaapi.idempotency import idempotent
+from tipsytequilaapi.compiled import serialize, serialize_one
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
 from rest_framework.parsers import MultiPartParser, FormParser
 
@@ -27,6 +31,7 @@ class Ratings(ViewSet):
     """Request handlers for Ratings in the tipsytequila Platform"""
     permission_classes = (IsAuthenticatedOrReadOnly,)
 
+    @idempotent
     def create(self, request):
         """
         @api {POST} /ratings POST new rating
@@ -70,17 +75,18 @@ class Ratings(ViewSet):
                 "rating": 0,
             }
         """
+        product = Product.objects.get(pk=request.data["productId"])
         new_rating = Rating()
         new_rating.score = request.data["score"]
-        
-        customer = Customer.objects.get(user=request.auth.user)
-        new_rating.customer = customer
-
-        new_rating.save()
-        product_rating = ProductRating()
-        product_rating.rating = new_rating
-        product_rating.product = Product.objects.get(pk=request.data["productId"])
-        product_rating.save()
+
+        def save():
+            # Both inserts and the change record commit together, batched
+            # with other ratings and reviews when coalescing is on
+            new_rating.save()
+            Change.record(new_rating, Change.CREATE)
+            ProductRating.objects.create(rating=new_rating, product=product)
+
+        group_write(save)
         serializer = RatingSerializer(
             new_rating, context={'request': request})
 
@@ -112,12 +118,11 @@ class Ratings(ViewSet):
             }
         """
         try:
-            rating = Rating.objects.get(pk=pk)
-            serializer = RatingSerializer(rating, context={'request': request})
-            return Response(serializer.data)
+            return Response(serialize_one(RatingSerializer, Rating.objects.all(), request, pk=pk))
         except Exception as ex:
             return HttpResponseServerError(ex)
 
+    @retry_on_locked
     def update(self, request, pk=None):
         """
         @api {PUT} /ratings/:id PUT changes to rating
@@ -133,13 +138,15 @@ class Ratings(ViewSet):
         rating = Rating.objects.get(pk=pk)
         rating.score = request.data["score"]
 
-        customer = Customer.objects.get(user=request.auth.user)
+        customer = request.auth.user.customer
         rating.customer = customer
 
         rating.save()
+        Change.record(rating, Change.UPDATE)
 
         return Response({}, status=status.HTTP_204_NO_CONTENT)
 
+    @retry_on_locked
     def destroy(self, request, pk=None):
         """
         @api {DELETE} /ratings/:id DELETE rating
@@ -154,6 +161,7 @@ class Ratings(ViewSet):
         """
         try:
             rating = Rating.objects.get(pk=pk)
+            Change.record(rating, Change.DELETE)
             rating.delete()
 
             return Response({}, status=status.HTTP_204_NO_CONTENT)
@@ -188,9 +196,7 @@ class Ratings(ViewSet):
             item = request.query_params.get('item', None)
             if item is not None:
                 ratings = Rating.objects.filter(ratings__product__id=item)
-            serializer = RatingSerializer(ratings, many=True, context={'request': request})
-            
-            return Response(serializer.data)
+            return Response(serialize(RatingSerializer, ratings, request))
         
         except Exception as ex:
             return HttpResponseServerError(ex)
\ No newline at end of file
@@ -1,11 +1,12 @@
 """Register user"""
-import json
 from django.http import HttpResponse, HttpResponseNotAllowed
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from tipsytequilaapi.models import Customer
+from tipsytequilaapi.db.sqlite import retry_on_locked
+from tipsytequilaapi.renderers import dumps
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 
@@ -29,12 +30,12 @@ def login_user(request):
         # If authentication was successful, respond with their token
         if authenticated_user is not None:
             token = Token.objects.get(user=authenticated_user)
-            data = json.dumps({"valid": True, "token": token.key, "id": authenticated_user.id})
+            data = dumps({"valid": True, "token": token.key, "id": authenticated_user.id})
             return HttpResponse(data, content_type='application/json')
 
         else:
             # Bad login details were provided. So we can't log the user in.
-            data = json.dumps({"valid": False})
+            data = dumps({"valid": False})
             return HttpResponse(data, content_type='application/json')
 
     return HttpResponseNotAllowed(permitted_methods=['POST'])
@@ -42,6 +43,7 @@ def login_user(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@retry_on_locked
 def register_user(request):
     '''Handles the creation of a new user for authentication
     Method arguments:
@@ -73,5 +75,5 @@ def register_user(request):
     token = Token.objects.create(user=customer.user)
 
     # Return the token to the client
-    data = json.dumps({"token": token.key, "id": new_user.id})
+    data = dumps({"token": token.key, "id": new_user.id})
     return HttpResponse(data, content_type='application/json', status=status.HTTP_201_CREATED)
\ No newline at end of file
@@ -10,7 +10,11 @@ from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from rest_framework import serializers
 from rest_framework import status
-from tipsytequilaapi.models import Review, Customer
+from tipsytequilaapi.models import Review, Change
+from tipsytequilaapi.db.coalesce import write as group_write
+from tipsytequilaapi.db.sqlite import retry_on_locked
+from tipsytequilaapi.idempotency import idempotent
+from tipsytequilaapi.compiled import serialize, serialize_one
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
 from rest_framework.parsers import MultiPartParser, FormParser
 
@@ -27,6 +31,7 @@ class Reviews(ViewSet):
     """Request handlers for Reviews in the tipsytequila Platform"""
     permission_classes = (IsAuthenticatedOrReadOnly,)
 
+    @idempotent
     def create(self, request):
         """
         @api {POST} /reviews POST new review
@@ -71,18 +76,18 @@ class Reviews(ViewSet):
             }
         """
 
-        
+        product = Product.objects.get(pk=request.data["productId"])
         new_review = Review()
         new_review.description = request.data["description"]
-        
-        customer = Customer.objects.get(user=request.auth.user)
-        new_review.customer = customer
-
-        new_review.save()
-        product_review = ProductReview()
-        product_review.review = new_review
-        product_review.product = Product.objects.get(pk=request.data["productId"])
-        product_review.save()
+
+        def save():
+            # Both inserts and the change record commit together, batched
+            # with other ratings and reviews when coalescing is on
+            new_review.save()
+            Change.record(new_review, Change.CREATE)
+            ProductReview.objects.create(review=new_review, product=product)
+
+        group_write(save)
         serializer = ReviewSerializer(
             new_review, context={'request': request})
 
@@ -114,12 +119,11 @@ class Reviews(ViewSet):
             }
         """
         try:
-            review = Review.objects.get(pk=pk)
-            serializer = ReviewSerializer(review, context={'request': request})
-            return Response(serializer.data)
+            return Response(serialize_one(ReviewSerializer, Review.objects.all(), request, pk=pk))
         except Exception as ex:
             return HttpResponseServerError(ex)
 
+    @retry_on_locked
     def update(self, request, pk=None):
         """
         @api {PUT} /reviews/:id PUT changes to review
@@ -135,13 +139,15 @@ class Reviews(ViewSet):
         review = Review.objects.get(pk=pk)
         review.description = request.data["description"]
 
-        customer = Customer.objects.get(user=request.auth.user)
+        customer = request.auth.user.customer
         review.customer = customer
 
         review.save()
+        Change.record(review, Change.UPDATE)
 
         return Response({}, status=status.HTTP_204_NO_CONTENT)
 
+    @retry_on_locked
     def destroy(self, request, pk=None):
         """
         @api {DELETE} /reviews/:id DELETE review
@@ -156,6 +162,7 @@ class Reviews(ViewSet):
         """
         try:
             review = Review.objects.get(pk=pk)
+            Change.record(review, Change.DELETE)
             review.delete()
 
             return Response({}, status=status.HTTP_204_NO_CONTENT)
@@ -190,9 +197,7 @@ class Reviews(ViewSet):
             item = request.query_params.get('item', None)
             if item is not None:
                 reviews = Review.objects.filter(review__product__id=item)
-            serializer = ReviewSerializer(reviews, many=True, context={'request': request})
-            
-            return Response(serializer.data)
+            return Response(serialize(ReviewSerializer, reviews, request))
         
         except Exception as ex:
             return HttpResponseServerError(ex)
\ No newline at end of file
@@ -4,6 +4,7 @@ from rest_framework.response import Response
 from rest_framework import serializers
 from rest_framework import status
 from django.contrib.auth.models import User
+from tipsytequilaapi.compiled import serialize, serialize_one
 
 
 class UserSerializer(serializers.HyperlinkedModelSerializer):
@@ -35,9 +36,7 @@ class Users(ViewSet):
             Response -- JSON serialized customer instance
         """
         try:
-            user = User.objects.get(pk=pk)
-            serializer = UserSerializer(user, context={'request': request})
-            return Response(serializer.data)
+            return Response(serialize_one(UserSerializer, User.objects.all(), request, pk=pk))
         except Exception as ex:
             return HttpResponseServerError(ex)
 
@@ -46,6 +45,4 @@ class Users(ViewSet):
     def list(self, request):
         """Handle GET requests to user resource"""
         users = User.objects.all()
-        serializer = UserSerializer(
-            users, many=True, context={'request': request})
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serialize(UserSerializer, users, request))
\ No newline at end of file